@@ -0,0 +1,22 @@
+"""
+Cache de usuários autenticados por token (conexões WebSocket).
+
+A chave combina o id do usuário e a versão de token (claim "token_version"
+do JWT, espelhando Agent.token_version), então revogar tokens ou desativar o
+usuário invalida as entradas sem precisar varrer o cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+def user_auth_cache_key(user_id: int, token_version: int) -> str:
+    return f"auth_user:{user_id}:v{token_version}"
+
+
+def get_auth_cache_ttl() -> int:
+    return getattr(settings, 'WS_AUTH_CACHE_TTL_SECONDS', 60)
+
+
+def invalidate_user_auth_cache(user_id: int, *token_versions: int) -> None:
+    """Remove o usuário do cache para as versões de token informadas"""
+    cache.delete_many([user_auth_cache_key(user_id, version) for version in token_versions])
@@ -0,0 +1,26 @@
+"""
+Autenticação JWT da API REST com revogação por Agent.token_version.
+
+O claim "token_version" do token precisa ser igual ao do usuário:
+Agent.revoke_tokens() incrementa a versão e invalida todos os access tokens
+já emitidos (o refresh é recusado por VersionedTokenRefreshSerializer). É a
+mesma regra aplicada aos WebSockets em core.ws.
+"""
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+
+class VersionedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication que também confere o claim token_version"""
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if validated_token.get("token_version", 0) != getattr(user, "token_version", 0):
+            raise AuthenticationFailed("Token revogado", code="token_revoked")
+        return user
+
+
+class VersionedJWTScheme(SimpleJWTScheme):
+    """Esquema OpenAPI (drf-spectacular) igual ao do JWTAuthentication"""
+    target_class = "accounts.authentication.VersionedJWTAuthentication"
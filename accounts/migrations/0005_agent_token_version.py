@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_add_agent_presence_typing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incrementado para revogar tokens já emitidos (claim token_version)'),
+        ),
+    ]
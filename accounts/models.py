@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .auth_cache import invalidate_user_auth_cache
+
 # Importar modelos de preferências e presença
 from .models_preferences import PreferenciasNotificacao
 from .models_presence import AgentPresence, TypingIndicator
@@ -10,10 +12,26 @@ class Agent(AbstractUser):
     display_name = models.CharField(max_length=150, blank=True)
     phone_number = models.CharField(max_length=30, blank=True)
     is_active = models.BooleanField(default=True)
+    token_version = models.PositiveIntegerField(
+        default=0,
+        help_text="Incrementado para revogar tokens já emitidos (claim token_version)"
+    )
 
     def __str__(self) -> str:
         return self.display_name or self.username
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Desativação, troca de permissões etc. não podem esperar o TTL do cache
+        invalidate_user_auth_cache(self.pk, self.token_version)
+
+    def revoke_tokens(self) -> None:
+        """Invalida todos os tokens emitidos até agora para o usuário"""
+        previous_version = self.token_version
+        self.token_version = previous_version + 1
+        self.save(update_fields=['token_version'])
+        invalidate_user_auth_cache(self.pk, previous_version)
+
     class Meta(AbstractUser.Meta):
         permissions = (
             ("manage_auth", "Pode gerenciar autenticação (grupos e permissões)"),
@@ -137,6 +137,36 @@ class AgentPresence(models.Model):
         self.websocket_connected = False
         self.status_changed_at = timezone.now()
         self.save(update_fields=['status', 'websocket_connected', 'status_changed_at', 'updated_at'])
+    
+    @classmethod
+    def mark_many_offline(cls, agent_ids, statuses=('online', 'busy', 'away')):
+        """
+        Marca vários agentes como offline em um único UPDATE ... RETURNING.
+        
+        Returns:
+            Lista de agent_id efetivamente alterados (estavam em um dos statuses)
+        """
+        if not agent_ids:
+            return []
+        
+        from django.db import connection
+        
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {cls._meta.db_table}
+                   SET status = 'offline',
+                       websocket_connected = FALSE,
+                       status_changed_at = %s,
+                       updated_at = %s
+                 WHERE agent_id = ANY(%s)
+                   AND status IN %s
+             RETURNING agent_id
+                """,
+                [now, now, list(agent_ids), tuple(statuses)]
+            )
+            return [row[0] for row in cursor.fetchall()]
 
 
 class TypingIndicator(models.Model):
@@ -0,0 +1,321 @@
+"""
+Presença de atendentes no cache compartilhado (Redis em produção).
+
+Heartbeats (frames do WebSocket ou POST /presence/heartbeat/) apenas renovam
+uma chave com TTL por atendente; status, mensagem e conexões vivem no cache.
+A tabela AgentPresence é atualizada em lote por flush_agent_presence, que
+grava apenas os atendentes cujo estado mudou.
+
+Cada campo fica numa chave própria, gravada sem ler as demais: heartbeats,
+conexões e mudanças de status simultâneas não desfazem umas às outras.
+websocket_connected é derivado do contador de sockets (atômico via incr/decr).
+
+Chaves:
+- presence:status:{id} (status, status_changed_at)
+- presence:msg:{id}    mensagem de status
+- presence:hb:{id}     último heartbeat (epoch), expira em PRESENCE_HEARTBEAT_TTL_SECONDS
+- presence:conn:{id}   número de sockets abertos
+- presence:agents      {id: username} dos atendentes ativos (recarregado do banco periodicamente)
+"""
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+AGENTS_KEY = 'presence:agents'
+AGENTS_TTL = 300
+
+ACTIVE_STATUSES = ('online', 'busy', 'away')
+
+# Grupo do channel layer com todos os sockets autenticados (eventos de presença)
+PRESENCE_GROUP = 'agents_presence'
+
+
+class PresenceStateService:
+    """Leitura e escrita da presença no cache"""
+
+    @staticmethod
+    def _status_key(agent_id: int) -> str:
+        return f"presence:status:{agent_id}"
+
+    @staticmethod
+    def _msg_key(agent_id: int) -> str:
+        return f"presence:msg:{agent_id}"
+
+    @staticmethod
+    def _hb_key(agent_id: int) -> str:
+        return f"presence:hb:{agent_id}"
+
+    @staticmethod
+    def _conn_key(agent_id: int) -> str:
+        return f"presence:conn:{agent_id}"
+
+    @staticmethod
+    def heartbeat_ttl() -> int:
+        return getattr(settings, 'PRESENCE_HEARTBEAT_TTL_SECONDS', 120)
+
+    @staticmethod
+    def _default_state() -> Dict:
+        return {
+            'status': 'offline',
+            'status_message': '',
+            'status_changed_at': None,
+            'websocket_connected': False,
+        }
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def heartbeat(agent_id: int, socket: bool = False) -> None:
+        """
+        Renova o heartbeat; volta para online quem estava offline com socket aberto.
+
+        socket=True indica heartbeat vindo de um WebSocket aberto: se o
+        sweeper (mark_offline) zerou as conexões, o socket volta a contar.
+        """
+        cache.set(PresenceStateService._hb_key(agent_id), time.time(),
+                  timeout=PresenceStateService.heartbeat_ttl())
+
+        conn_key = PresenceStateService._conn_key(agent_id)
+        if socket and not cache.get(conn_key):
+            cache.set(conn_key, 1, timeout=None)
+
+        status = cache.get(PresenceStateService._status_key(agent_id))
+        if (status is None or status[0] == 'offline') and cache.get(conn_key):
+            PresenceStateService.set_status(agent_id, 'online')
+
+    @staticmethod
+    def set_status(agent_id: int, new_status: str, message: str = '') -> Dict:
+        """Altera status (e mensagem, se informada)"""
+        key = PresenceStateService._status_key(agent_id)
+        status = cache.get(key)
+        old_status = status[0] if status else 'offline'
+        if new_status != old_status:
+            cache.set(key, (new_status, timezone.now()), timeout=None)
+        if message:
+            cache.set(PresenceStateService._msg_key(agent_id), message, timeout=None)
+
+        if new_status == 'online' and old_status != 'online':
+            # Atendente que chega online pode receber clientes já na fila
+            from atendimento.scheduler import get_distribuicao_scheduler
+            get_distribuicao_scheduler().agendar_para_atendente(agent_id, 'online')
+        return PresenceStateService._load_states([agent_id])[agent_id]
+
+    @staticmethod
+    def socket_connected(agent_id: int) -> None:
+        """Registra um socket aberto do atendente"""
+        key = PresenceStateService._conn_key(agent_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+
+        PresenceStateService._ensure_known(agent_id)
+        PresenceStateService.heartbeat(agent_id)
+
+    @staticmethod
+    def socket_disconnected(agent_id: int) -> None:
+        """Registra o fechamento de um socket; o status só muda por timeout"""
+        key = PresenceStateService._conn_key(agent_id)
+        try:
+            remaining = cache.decr(key)
+        except ValueError:
+            # Conexões já zeradas pelo sweeper
+            return
+        if remaining < 0:
+            # Sockets que o sweeper já havia descontado: volta a zero sem perder incrementos concorrentes
+            cache.incr(key, -remaining)
+
+    @staticmethod
+    def mark_offline(agent_ids: List[int]) -> None:
+        """Marca atendentes como offline no cache (usado pelo sweeper)"""
+        now = timezone.now()
+        cache.set_many(
+            {PresenceStateService._status_key(agent_id): ('offline', now) for agent_id in agent_ids},
+            timeout=None
+        )
+        cache.delete_many([PresenceStateService._conn_key(agent_id) for agent_id in agent_ids])
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def agents() -> Dict[int, str]:
+        """{id: username} dos atendentes ativos (do cache; recarrega do banco a cada AGENTS_TTL)"""
+        agents = cache.get(AGENTS_KEY)
+        if agents is None:
+            User = get_user_model()
+            agents = dict(User.objects.filter(is_active=True).order_by('id').values_list('id', 'username'))
+            cache.set(AGENTS_KEY, agents, timeout=AGENTS_TTL)
+        return agents
+
+    @staticmethod
+    def agent_ids() -> List[int]:
+        return list(PresenceStateService.agents())
+
+    @staticmethod
+    def _ensure_known(agent_id: int) -> None:
+        agents = cache.get(AGENTS_KEY)
+        if agents is not None and agent_id not in agents:
+            # Atendente novo: força recarga na próxima leitura
+            cache.delete(AGENTS_KEY)
+
+    @staticmethod
+    def _load_states(agent_ids: List[int]) -> Dict[int, Dict]:
+        """Estado montado das chaves de cada atendente (só os que têm status ou conexão no cache)"""
+        keys = {}
+        for agent_id in agent_ids:
+            keys[PresenceStateService._status_key(agent_id)] = (agent_id, 'status')
+            keys[PresenceStateService._msg_key(agent_id)] = (agent_id, 'msg')
+            keys[PresenceStateService._conn_key(agent_id)] = (agent_id, 'conn')
+
+        values: Dict[int, Dict] = {}
+        for key, value in cache.get_many(list(keys)).items():
+            agent_id, field = keys[key]
+            values.setdefault(agent_id, {})[field] = value
+
+        states = {}
+        for agent_id, fields in values.items():
+            if 'status' not in fields and 'conn' not in fields:
+                continue
+            state = PresenceStateService._default_state()
+            if 'status' in fields:
+                state['status'], state['status_changed_at'] = fields['status']
+            state['status_message'] = fields.get('msg') or ''
+            state['websocket_connected'] = (fields.get('conn') or 0) > 0
+            states[agent_id] = state
+        return states
+
+    @staticmethod
+    def last_heartbeats(agent_ids: List[int]) -> Dict[int, float]:
+        """Epoch do último heartbeat dos atendentes com heartbeat ainda válido"""
+        keys = {PresenceStateService._hb_key(agent_id): agent_id for agent_id in agent_ids}
+        return {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+
+    @staticmethod
+    def _build(agent_id: int, username: str, state: Optional[Dict], heartbeat: Optional[float]) -> Dict:
+        state = state or PresenceStateService._default_state()
+        return {
+            'agent': agent_id,
+            'agent_username': username,
+            'status': state['status'],
+            'status_message': state['status_message'],
+            'status_changed_at': state['status_changed_at'],
+            'websocket_connected': state['websocket_connected'],
+            'last_heartbeat': (
+                datetime.fromtimestamp(heartbeat, tz=dt_timezone.utc) if heartbeat else None
+            ),
+            'is_available': state['status'] == 'online' and state['websocket_connected'],
+            'esta_inativo': heartbeat is None,
+        }
+
+    @staticmethod
+    def get(agent_id: int, username: str = '') -> Dict:
+        """Presença de um atendente"""
+        return PresenceStateService._build(
+            agent_id,
+            username,
+            PresenceStateService._load_states([agent_id]).get(agent_id),
+            cache.get(PresenceStateService._hb_key(agent_id)),
+        )
+
+    @staticmethod
+    def available_ids(agent_ids: List[int]) -> List[int]:
+        """Atendentes (dentre agent_ids) online e com WebSocket conectado"""
+        states = PresenceStateService._load_states(agent_ids)
+        return [
+            agent_id for agent_id in agent_ids
+            if agent_id in states
+            and states[agent_id]['status'] == 'online'
+            and states[agent_id]['websocket_connected']
+        ]
+
+    @staticmethod
+    def snapshot() -> List[Dict]:
+        """Presença de todos os atendentes ativos, lida apenas do cache"""
+        agents = PresenceStateService.agents()
+        states = PresenceStateService._load_states(list(agents))
+        heartbeats = PresenceStateService.last_heartbeats(list(agents))
+        return [
+            PresenceStateService._build(agent_id, username, states.get(agent_id), heartbeats.get(agent_id))
+            for agent_id, username in agents.items()
+        ]
+
+    # ------------------------------------------------------------------
+    # Persistência
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def flush() -> int:
+        """
+        Grava em AgentPresence, em lote, os atendentes cujo estado no cache
+        difere do banco.
+
+        Returns:
+            Número de linhas criadas ou atualizadas
+        """
+        from .models_presence import AgentPresence
+
+        states = PresenceStateService._load_states(PresenceStateService.agent_ids())
+        if not states:
+            return 0
+
+        heartbeats = PresenceStateService.last_heartbeats(list(states))
+        rows = {p.agent_id: p for p in AgentPresence.objects.filter(agent_id__in=list(states))}
+        now = timezone.now()
+        fields = ['status', 'status_message', 'websocket_connected', 'status_changed_at', 'last_heartbeat', 'updated_at']
+
+        to_update = []
+        to_create = []
+        for agent_id, state in states.items():
+            heartbeat = heartbeats.get(agent_id)
+            last_heartbeat = datetime.fromtimestamp(heartbeat, tz=dt_timezone.utc) if heartbeat else None
+            row = rows.get(agent_id)
+
+            if row is None:
+                to_create.append(AgentPresence(
+                    agent_id=agent_id,
+                    status=state['status'],
+                    status_message=state['status_message'],
+                    websocket_connected=state['websocket_connected'],
+                ))
+                continue
+
+            if (row.status, row.status_message, row.websocket_connected) == (
+                state['status'], state['status_message'], state['websocket_connected']
+            ):
+                continue
+
+            row.status = state['status']
+            row.status_message = state['status_message']
+            row.websocket_connected = state['websocket_connected']
+            row.status_changed_at = state['status_changed_at'] or now
+            row.last_heartbeat = last_heartbeat or row.last_heartbeat
+            row.updated_at = now
+            to_update.append(row)
+
+        if to_update:
+            AgentPresence.objects.bulk_update(to_update, fields)
+        if to_create:
+            AgentPresence.objects.bulk_create(to_create, ignore_conflicts=True)
+
+        return len(to_update) + len(to_create)
+
+
+_presence_service = PresenceStateService()
+
+
+def get_presence_service() -> PresenceStateService:
+    """Retorna instância global do serviço"""
+    return _presence_service
@@ -1,5 +1,10 @@
 from django.contrib.auth.models import Group, Permission
 from rest_framework import serializers
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 
 class PermissionSerializer(serializers.ModelSerializer):
@@ -25,3 +30,25 @@ class AgentGroupsSerializer(serializers.Serializer):
     group_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=True)
 
 
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Inclui Agent.token_version no JWT (copiado para o access token no refresh)"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["token_version"] = getattr(user, "token_version", 0)
+        return token
+
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    """Recusa refresh tokens de usuário inativo ou emitidos antes de revoke_tokens()"""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs["refresh"])
+        user_id = refresh.get(api_settings.USER_ID_CLAIM)
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}, is_active=True
+        ).only("pk", "token_version").first()
+        if not user or refresh.get("token_version", 0) != user.token_version:
+            raise InvalidToken("Token revogado")
+        return super().validate(attrs)
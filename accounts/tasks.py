@@ -4,7 +4,6 @@ Tasks Celery para accounts (Issue #51).
 import logging
 from celery import shared_task
 from django.utils import timezone
-from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
@@ -14,58 +13,85 @@ def check_agent_presence_timeout():
     """
     Task periódica para marcar agentes como offline por timeout (Issue #51).
     
-    Verifica heartbeat e marca como offline se sem atividade há mais de 2 minutos.
+    Marca como offline quem não envia heartbeat há mais de
+    PRESENCE_HEARTBEAT_TTL_SECONDS (chave expirada no cache), com um único
+    UPDATE ... RETURNING, emite um único evento agents_presence_changed e
+    redistribui a fila dos departamentos que perderam atendentes.
     """
     from accounts.models_presence import AgentPresence
+    from accounts.presence_state import ACTIVE_STATUSES, PRESENCE_GROUP, get_presence_service
+    from atendimento.models import Departamento
+    from atendimento.service import get_distribuicao_service
     from channels.layers import get_channel_layer
     from asgiref.sync import async_to_sync
     
     logger.info("[Task] Verificando timeout de presença de agentes")
     
-    timeout_threshold = timezone.now() - timedelta(minutes=2)
-    
-    # Busca agentes online sem heartbeat recente
-    agents_to_timeout = AgentPresence.objects.filter(
-        status__in=['online', 'busy', 'away'],
-        last_heartbeat__lt=timeout_threshold
+    # Heartbeats vivem no cache; quem não tem a chave (TTL expirado) está inativo
+    presence_service = get_presence_service()
+    active_ids = list(
+        AgentPresence.objects.filter(status__in=ACTIVE_STATUSES).values_list('agent_id', flat=True)
     )
+    alive = presence_service.last_heartbeats(active_ids)
+    stale_ids = [agent_id for agent_id in active_ids if agent_id not in alive]
     
-    if not agents_to_timeout.exists():
+    if not stale_ids:
         return {'agents_marked_offline': 0}
     
-    marked_offline = 0
-    channel_layer = get_channel_layer()
+    marked_offline = AgentPresence.mark_many_offline(stale_ids, ACTIVE_STATUSES)
+    presence_service.mark_offline(marked_offline)
+    
+    if not marked_offline:
+        return {'agents_marked_offline': 0}
     
-    for presence in agents_to_timeout:
-        old_status = presence.status
-        presence.mark_as_offline()
-        
-        logger.info(
-            f"Agente {presence.agent.username} marcado como offline por timeout "
-            f"(último heartbeat: {presence.last_heartbeat})"
+    logger.info(f"[Task] Agentes marcados como offline por timeout: {marked_offline}")
+    
+    # Um único evento para todos os agentes afetados
+    channel_layer = get_channel_layer()
+    if channel_layer:
+        event_payload = {
+            "event": "agents_presence_changed",
+            "data": {
+                "agent_ids": marked_offline,
+                "status": "offline",
+                "message": "Desconectado por inatividade",
+                "timestamp": timezone.now().isoformat()
+            },
+            "version": "v1"
+        }
+        async_to_sync(channel_layer.group_send)(
+            PRESENCE_GROUP,
+            {"type": "whatsapp.event", "event": event_payload}
         )
-        
-        # Emite evento WebSocket
-        if channel_layer:
-            event_payload = {
-                "event": "agent_presence_changed",
-                "data": {
-                    "agent_id": presence.agent.id,
-                    "status": "offline",
-                    "message": "Desconectado por inatividade",
-                    "timestamp": timezone.now().isoformat()
-                },
-                "version": "v1"
-            }
-            
-            async_to_sync(channel_layer.group_send)(
-                "agents_presence",
-                {"type": "whatsapp.event", "event": event_payload}
-            )
-        
-        marked_offline += 1
     
-    logger.info(f"[Task] {marked_offline} agentes marcados como offline por timeout")
+    # Departamentos que perderam capacidade: redistribui a fila pendente
+    departamento_ids = list(
+        Departamento.objects.filter(atendentes__id__in=marked_offline, ativo=True)
+        .values_list('id', flat=True).distinct()
+    )
+    distribuicao = get_distribuicao_service()
+    for departamento_id in departamento_ids:
+        try:
+            distribuicao.distribuir_automaticamente(departamento_id)
+        except Exception as e:
+            logger.error(f"Erro ao redistribuir fila do departamento {departamento_id}: {e}")
     
-    return {'agents_marked_offline': marked_offline}
+    return {
+        'agents_marked_offline': len(marked_offline),
+        'departamentos_redistribuidos': len(departamento_ids)
+    }
 
+
+@shared_task
+def flush_agent_presence():
+    """
+    Task periódica que grava em AgentPresence, em lote, a presença mantida
+    no cache (apenas atendentes cujo estado mudou).
+    """
+    from accounts.presence_state import get_presence_service
+    
+    flushed = get_presence_service().flush()
+    if flushed:
+        logger.info(f"[Task] Presença de {flushed} agentes gravada no banco")
+    
+    return {'agents_flushed': flushed}
@@ -0,0 +1,202 @@
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from accounts.models_presence import AgentPresence
+from accounts.presence_state import PRESENCE_GROUP, PresenceStateService
+from accounts.tasks import check_agent_presence_timeout, flush_agent_presence
+from atendimento.models import Departamento
+
+Agent = get_user_model()
+
+
+class PresenceStateServiceTests(TestCase):
+    """Testes da presença mantida no cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.agent = Agent.objects.create_user(username="atendente", password="testpass123")
+        self.other = Agent.objects.create_user(username="outro", password="testpass123")
+
+    def test_heartbeat_sem_escrita_no_banco(self):
+        PresenceStateService.socket_connected(self.agent.id)
+
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                PresenceStateService.heartbeat(self.agent.id)
+
+        presence = PresenceStateService.get(self.agent.id)
+        self.assertEqual(presence["status"], "online")
+        self.assertTrue(presence["websocket_connected"])
+        self.assertTrue(presence["is_available"])
+        self.assertFalse(AgentPresence.objects.exists())
+
+    def test_ultimo_socket_fechado(self):
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.socket_connected(self.agent.id)
+
+        PresenceStateService.socket_disconnected(self.agent.id)
+        self.assertTrue(PresenceStateService.get(self.agent.id)["websocket_connected"])
+
+        PresenceStateService.socket_disconnected(self.agent.id)
+        self.assertFalse(PresenceStateService.get(self.agent.id)["websocket_connected"])
+
+    def test_campos_gravados_separadamente(self):
+        """Conexões e heartbeats não regravam status e mensagem (nem o contrário)"""
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.set_status(self.agent.id, "busy", "Em reunião")
+
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.heartbeat(self.agent.id)
+        PresenceStateService.socket_disconnected(self.agent.id)
+
+        presence = PresenceStateService.get(self.agent.id)
+        self.assertEqual(presence["status"], "busy")
+        self.assertEqual(presence["status_message"], "Em reunião")
+        self.assertTrue(presence["websocket_connected"])
+
+    def test_socket_aberto_volta_online_apos_timeout(self):
+        """Depois do sweeper, o heartbeat de um socket ainda aberto restaura a conexão"""
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.mark_offline([self.agent.id])
+        self.assertFalse(PresenceStateService.get(self.agent.id)["websocket_connected"])
+
+        # Heartbeat da API REST não prova socket aberto
+        PresenceStateService.heartbeat(self.agent.id)
+        self.assertEqual(PresenceStateService.get(self.agent.id)["status"], "offline")
+
+        PresenceStateService.heartbeat(self.agent.id, socket=True)
+        presence = PresenceStateService.get(self.agent.id)
+        self.assertEqual(presence["status"], "online")
+        self.assertTrue(presence["is_available"])
+
+        # O fechamento do socket depois do sweeper não deixa o contador negativo
+        PresenceStateService.socket_disconnected(self.agent.id)
+        PresenceStateService.socket_disconnected(self.agent.id)
+        PresenceStateService.socket_connected(self.agent.id)
+        self.assertTrue(PresenceStateService.get(self.agent.id)["websocket_connected"])
+
+    def test_snapshot_servido_do_cache(self):
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.set_status(self.other.id, "busy", "Em reunião")
+        PresenceStateService.snapshot()
+
+        with self.assertNumQueries(0):
+            snapshot = {p["agent"]: p for p in PresenceStateService.snapshot()}
+
+        self.assertEqual(snapshot[self.agent.id]["status"], "online")
+        self.assertEqual(snapshot[self.other.id]["status"], "busy")
+        self.assertEqual(snapshot[self.other.id]["agent_username"], "outro")
+
+    def test_flush_grava_apenas_mudancas(self):
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.set_status(self.other.id, "away")
+
+        self.assertEqual(flush_agent_presence()["agents_flushed"], 2)
+        self.assertEqual(AgentPresence.objects.get(agent=self.agent).status, "online")
+        self.assertEqual(AgentPresence.objects.get(agent=self.other).status, "away")
+
+        # Heartbeats não geram escrita
+        PresenceStateService.heartbeat(self.agent.id)
+        self.assertEqual(flush_agent_presence()["agents_flushed"], 0)
+
+        PresenceStateService.set_status(self.agent.id, "busy")
+        with self.assertNumQueries(3):
+            # agentes (recarregados do banco), leitura das linhas e um UPDATE em lote
+            cache.delete("presence:agents")
+            self.assertEqual(flush_agent_presence()["agents_flushed"], 1)
+        self.assertEqual(AgentPresence.objects.get(agent=self.agent).status, "busy")
+
+    def test_timeout_por_heartbeat_expirado(self):
+        PresenceStateService.socket_connected(self.agent.id)
+        PresenceStateService.socket_connected(self.other.id)
+        flush_agent_presence()
+
+        cache.delete(f"presence:hb:{self.other.id}")
+        result = check_agent_presence_timeout()
+
+        self.assertEqual(result["agents_marked_offline"], 1)
+        self.assertEqual(AgentPresence.objects.get(agent=self.other).status, "offline")
+        self.assertEqual(AgentPresence.objects.get(agent=self.agent).status, "online")
+        self.assertEqual(PresenceStateService.get(self.other.id)["status"], "offline")
+
+    def test_timeout_em_lote_com_um_evento(self):
+        extra = [
+            Agent.objects.create_user(username=f"extra{i}", password="testpass123")
+            for i in range(3)
+        ]
+        stale = [self.other] + extra
+        for agent in [self.agent] + stale:
+            PresenceStateService.socket_connected(agent.id)
+        flush_agent_presence()
+        for agent in stale:
+            cache.delete(f"presence:hb:{agent.id}")
+
+        departamento = Departamento.objects.create(nome="Suporte")
+        departamento.atendentes.add(self.other, extra[0])
+
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(PRESENCE_GROUP, channel_name)
+
+        with patch(
+            "atendimento.service.DistribuicaoAtendimentoService.distribuir_automaticamente"
+        ) as distribuir:
+            # ativos, UPDATE ... RETURNING e departamentos afetados
+            with self.assertNumQueries(3):
+                result = check_agent_presence_timeout()
+
+        self.assertEqual(result["agents_marked_offline"], 4)
+        self.assertEqual(result["departamentos_redistribuidos"], 1)
+        distribuir.assert_called_once_with(departamento.id)
+        self.assertEqual(
+            AgentPresence.objects.filter(status="offline").count(), 4
+        )
+
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        event = message["event"]
+        self.assertEqual(event["event"], "agents_presence_changed")
+        self.assertEqual(sorted(event["data"]["agent_ids"]), sorted(a.id for a in stale))
+        self.assertEqual(event["data"]["status"], "offline")
+
+        # Nada mais a marcar: nenhum evento adicional
+        self.assertEqual(check_agent_presence_timeout()["agents_marked_offline"], 0)
+
+
+class PresenceViewTests(TestCase):
+    """Testes dos endpoints de presença"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.agent = Agent.objects.create_user(username="atendente", password="testpass123")
+        self.client.force_authenticate(user=self.agent)
+
+    def test_set_status_e_me(self):
+        response = self.client.post("/api/v1/presence/set-status/", {"status": "busy", "message": "Almoço"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get("/api/v1/presence/me/")
+        self.assertEqual(response.data["status"], "busy")
+        self.assertEqual(response.data["status_message"], "Almoço")
+        self.assertEqual(response.data["agent_username"], "atendente")
+
+    def test_set_status_invalido(self):
+        response = self.client.post("/api/v1/presence/set-status/", {"status": "dormindo"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_heartbeat_e_snapshot(self):
+        response = self.client.post("/api/v1/presence/heartbeat/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get("/api/v1/presence/snapshot/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        presence = next(p for p in response.data if p["agent"] == self.agent.id)
+        self.assertFalse(presence["esta_inativo"])
+        self.assertFalse(AgentPresence.objects.exists())
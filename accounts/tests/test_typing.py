@@ -0,0 +1,87 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from accounts.models_presence import TypingIndicator
+from accounts.typing_state import TypingStateService
+
+Agent = get_user_model()
+
+
+@patch("accounts.typing_state.emit_chat_event")
+class TypingStateServiceTests(TestCase):
+    """Testes do estado de digitação em cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = Agent.objects.create_user(username="atendente", password="testpass123")
+
+    def test_throttle_um_evento_por_janela(self, mock_emit):
+        """Várias teclas dentro da janela geram um único typing_start"""
+        results = [TypingStateService.start(self.user.id, "atendente", "5511999") for _ in range(10)]
+
+        self.assertEqual(results.count(True), 1)
+        mock_emit.assert_called_once()
+        chat_id, event, data = mock_emit.call_args[0]
+        self.assertEqual((chat_id, event), ("5511999", "typing_start"))
+        self.assertEqual(data["agent_id"], self.user.id)
+        self.assertEqual(data["expires_in"], 6)
+        self.assertTrue(TypingStateService.is_typing(self.user.id, "5511999"))
+
+    def test_throttle_por_chat(self, mock_emit):
+        TypingStateService.start(self.user.id, "atendente", "chat_a")
+        TypingStateService.start(self.user.id, "atendente", "chat_b")
+        self.assertEqual(mock_emit.call_count, 2)
+
+    def test_stop_emite_apenas_se_digitando(self, mock_emit):
+        self.assertFalse(TypingStateService.stop(self.user.id, "atendente", "5511999"))
+        mock_emit.assert_not_called()
+
+        TypingStateService.start(self.user.id, "atendente", "5511999")
+        self.assertTrue(TypingStateService.stop(self.user.id, "atendente", "5511999"))
+        self.assertEqual(mock_emit.call_args[0][1], "typing_stop")
+        self.assertFalse(TypingStateService.is_typing(self.user.id, "5511999"))
+
+        # Após o stop, um novo start é emitido imediatamente
+        self.assertTrue(TypingStateService.start(self.user.id, "atendente", "5511999"))
+
+    def test_sem_escrita_no_banco(self, mock_emit):
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                TypingStateService.start(self.user.id, "atendente", "5511999")
+            TypingStateService.stop(self.user.id, "atendente", "5511999")
+        self.assertFalse(TypingIndicator.objects.exists())
+
+    @override_settings(TYPING_DB_SAMPLE_RATE=1.0)
+    def test_amostragem_opcional(self, mock_emit):
+        TypingStateService.start(self.user.id, "atendente", "5511999")
+        indicator = TypingIndicator.objects.get(agent=self.user, chat_id="5511999")
+        self.assertTrue(indicator.is_typing)
+
+
+@patch("accounts.typing_state.emit_chat_event")
+class TypingIndicatorViewTests(TestCase):
+    """Testes para /api/v1/typing/ (compatibilidade HTTP)"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = Agent.objects.create_user(username="atendente", password="testpass123")
+        self.client.force_authenticate(user=self.user)
+
+    def test_post_e_delete(self, mock_emit):
+        response = self.client.post("/api/v1/typing/", {"chat_id": "5511999"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.delete("/api/v1/typing/?chat_id=5511999")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual([c[0][1] for c in mock_emit.call_args_list], ["typing_start", "typing_stop"])
+        self.assertFalse(TypingIndicator.objects.exists())
+
+    def test_chat_id_obrigatorio(self, mock_emit):
+        response = self.client.post("/api/v1/typing/", {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.test import TestCase
+from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -297,3 +298,42 @@ class AgentGroupsViewTests(TestCase):
         response = self.client.patch("/api/v1/authz/agents/99999/groups/", data, format="json")
         
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TokenRevocationTests(TestCase):
+    """Testes de Agent.revoke_tokens() na API REST"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = Agent.objects.create_user(username="testuser", password="testpass123")
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "testuser", "password": "testpass123"}, format="json"
+        )
+        self.access = response.data["access"]
+        self.refresh = response.data["refresh"]
+
+    def test_access_token_revogado_e_recusado(self):
+        """Testa GET /api/v1/me/ com access token emitido antes de revoke_tokens()"""
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(self.client.get("/api/v1/me/").status_code, status.HTTP_200_OK)
+
+        self.user.revoke_tokens()
+        self.assertEqual(self.client.get("/api/v1/me/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_token_revogado_e_recusado(self):
+        """Testa POST /api/v1/auth/refresh/ com refresh token emitido antes de revoke_tokens()"""
+        response = self.client.post(reverse("token_refresh"), {"refresh": self.refresh}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.user.revoke_tokens()
+        response = self.client.post(reverse("token_refresh"), {"refresh": self.refresh}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_emitido_depois_da_revogacao_e_aceito(self):
+        """Testa que um login novo recebe a versão atual"""
+        self.user.revoke_tokens()
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "testuser", "password": "testpass123"}, format="json"
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get("/api/v1/me/").status_code, status.HTTP_200_OK)
@@ -0,0 +1,117 @@
+"""
+Indicadores de digitação efêmeros (sem escrita no banco por tecla).
+
+O estado "digitando" vive apenas no cache, com TTL curto, e os eventos vão
+para o tópico da conversa (chat_{chat_id}). Cada atendente gera no máximo um
+typing_start por conversa a cada TYPING_THROTTLE_SECONDS; o cliente limpa o
+indicador ao receber typing_stop ou após expires_in segundos.
+
+A tabela TypingIndicator passa a ser usada só para amostragem analítica
+(TYPING_DB_SAMPLE_RATE, desligada por padrão).
+"""
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from chats.events import emit_chat_event
+
+logger = logging.getLogger(__name__)
+
+
+class TypingStateService:
+    """Estado de digitação por (chat_id, atendente) no cache"""
+
+    @staticmethod
+    def _state_key(chat_id: str, agent_id: int) -> str:
+        return f"typing:{chat_id}:{agent_id}"
+
+    @staticmethod
+    def _throttle_key(chat_id: str, agent_id: int) -> str:
+        return f"typing_throttle:{chat_id}:{agent_id}"
+
+    @staticmethod
+    def _ttl() -> int:
+        return getattr(settings, 'TYPING_TTL_SECONDS', 6)
+
+    @staticmethod
+    def _throttle() -> int:
+        return getattr(settings, 'TYPING_THROTTLE_SECONDS', 3)
+
+    @staticmethod
+    def start(agent_id: int, username: str, chat_id: str) -> bool:
+        """
+        Registra que o atendente está digitando no chat.
+
+        Returns:
+            True se um evento typing_start foi emitido (fora da janela de throttle)
+        """
+        chat_id = str(chat_id)
+        if not cache.add(TypingStateService._throttle_key(chat_id, agent_id), 1,
+                         timeout=TypingStateService._throttle()):
+            return False
+
+        ttl = TypingStateService._ttl()
+        cache.set(TypingStateService._state_key(chat_id, agent_id), 1, timeout=ttl)
+        TypingStateService._emit(chat_id, agent_id, username, 'typing_start', expires_in=ttl)
+        TypingStateService._sample(agent_id, chat_id, is_typing=True)
+        return True
+
+    @staticmethod
+    def stop(agent_id: int, username: str, chat_id: str) -> bool:
+        """
+        Registra que o atendente parou de digitar.
+
+        Returns:
+            True se havia indicador ativo (e typing_stop foi emitido)
+        """
+        chat_id = str(chat_id)
+        cache.delete(TypingStateService._throttle_key(chat_id, agent_id))
+        if not cache.delete(TypingStateService._state_key(chat_id, agent_id)):
+            return False
+
+        TypingStateService._emit(chat_id, agent_id, username, 'typing_stop')
+        TypingStateService._sample(agent_id, chat_id, is_typing=False)
+        return True
+
+    @staticmethod
+    def is_typing(agent_id: int, chat_id: str) -> bool:
+        return cache.get(TypingStateService._state_key(str(chat_id), agent_id)) is not None
+
+    @staticmethod
+    def _emit(chat_id: str, agent_id: int, username: str, event: str, **extra) -> None:
+        emit_chat_event(chat_id, event, {
+            'chat_id': chat_id,
+            'agent_id': agent_id,
+            'from': username,
+            'timestamp': timezone.now().isoformat(),
+            **extra,
+        })
+
+    @staticmethod
+    def _sample(agent_id: int, chat_id: str, is_typing: bool) -> None:
+        """Persiste uma amostra em TypingIndicator para análise, se habilitado"""
+        rate = getattr(settings, 'TYPING_DB_SAMPLE_RATE', 0.0)
+        if rate <= 0 or random.random() >= rate:
+            return
+
+        from .models_presence import TypingIndicator
+
+        try:
+            TypingIndicator.objects.update_or_create(
+                agent_id=agent_id,
+                chat_id=chat_id,
+                defaults={'is_typing': is_typing}
+            )
+        except Exception as e:
+            logger.warning(f"Falha ao amostrar indicador de digitação: {e}")
+
+
+_typing_service = TypingStateService()
+
+
+def get_typing_service() -> TypingStateService:
+    """Retorna instância global do serviço"""
+    return _typing_service
@@ -10,12 +10,19 @@ from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from drf_spectacular.utils import extend_schema
 
-from .models_presence import AgentPresence, TypingIndicator
-from .serializers_presence import AgentPresenceSerializer, TypingIndicatorSerializer
+from .models_presence import AgentPresence
+from .presence_state import PRESENCE_GROUP, get_presence_service
+from .serializers_presence import AgentPresenceSerializer
+from .typing_state import get_typing_service
 
 
 class AgentPresenceViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet para consultar presença de agentes"""
+    """
+    ViewSet para consultar presença de agentes.
+    
+    Presença é lida e escrita no cache (ver accounts/presence_state.py);
+    a tabela AgentPresence é atualizada em lote por flush_agent_presence.
+    """
     queryset = AgentPresence.objects.select_related('agent')
     serializer_class = AgentPresenceSerializer
     permission_classes = [IsAuthenticated]
@@ -23,11 +30,12 @@ class AgentPresenceViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'], url_path='me')
     def my_presence(self, request):
         """Obtém presença do usuário autenticado"""
-        presence, created = AgentPresence.objects.get_or_create(
-            agent=request.user
-        )
-        serializer = self.get_serializer(presence)
-        return Response(serializer.data)
+        return Response(get_presence_service().get(request.user.id, request.user.username))
+    
+    @action(detail=False, methods=['get'], url_path='snapshot')
+    def snapshot(self, request):
+        """Presença de todos os atendentes ativos (servida apenas do cache)"""
+        return Response(get_presence_service().snapshot())
     
     @action(detail=False, methods=['post'], url_path='set-status')
     def set_status(self, request):
@@ -41,12 +49,9 @@ class AgentPresenceViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        presence, created = AgentPresence.objects.get_or_create(
-            agent=request.user
-        )
-        
-        old_status = presence.status
-        presence.set_status(new_status, message)
+        service = get_presence_service()
+        old_status = service.get(request.user.id)['status']
+        service.set_status(request.user.id, new_status, message)
         
         # Emite evento WebSocket
         self._emit_presence_event(request.user.id, new_status, message)
@@ -58,12 +63,8 @@ class AgentPresenceViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['post'], url_path='heartbeat')
     def heartbeat(self, request):
-        """Atualiza heartbeat do usuário"""
-        presence, created = AgentPresence.objects.get_or_create(
-            agent=request.user
-        )
-        
-        presence.heartbeat()
+        """Atualiza heartbeat do usuário (preferir o frame {"type": "heartbeat"} no WebSocket)"""
+        get_presence_service().heartbeat(request.user.id)
         
         return Response({'message': 'Heartbeat atualizado'}, status=status.HTTP_200_OK)
     
@@ -88,13 +89,19 @@ class AgentPresenceViewSet(viewsets.ReadOnlyModelViewSet):
         
         # Broadcast para todos os atendentes
         async_to_sync(channel_layer.group_send)(
-            "agents_presence",
+            PRESENCE_GROUP,
             {"type": "whatsapp.event", "event": event_payload}
         )
 
 
 class TypingIndicatorView(APIView):
-    """View para controlar indicadores de digitação"""
+    """
+    View para controlar indicadores de digitação.
+    
+    Mantida por compatibilidade: o caminho preferido é pelo WebSocket
+    ({"type": "typing_start" | "typing_stop", "chat_id": ...}). O estado fica
+    só no cache (ver accounts/typing_state.py), sem escrita no banco.
+    """
     permission_classes = [IsAuthenticated]
     
     @extend_schema(summary="Indica que está digitando")
@@ -108,14 +115,7 @@ class TypingIndicatorView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        indicator, created = TypingIndicator.objects.update_or_create(
-            agent=request.user,
-            chat_id=chat_id,
-            defaults={'is_typing': True}
-        )
-        
-        # Emite evento WebSocket
-        self._emit_typing_event(chat_id, request.user.username, 'typing_start')
+        get_typing_service().start(request.user.id, request.user.username, chat_id)
         
         return Response({'message': 'Indicador de digitação ativado'}, status=status.HTTP_200_OK)
     
@@ -130,43 +130,6 @@ class TypingIndicatorView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            indicator = TypingIndicator.objects.get(
-                agent=request.user,
-                chat_id=chat_id
-            )
-            indicator.is_typing = False
-            indicator.save(update_fields=['is_typing', 'updated_at'])
-            
-            # Emite evento WebSocket
-            self._emit_typing_event(chat_id, request.user.username, 'typing_stop')
-            
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        
-        except TypingIndicator.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
-    
-    def _emit_typing_event(self, chat_id, username, event_type):
-        """Emite evento de digitação"""
-        from django.utils import timezone
-        
-        channel_layer = get_channel_layer()
-        if not channel_layer:
-            return
+        get_typing_service().stop(request.user.id, request.user.username, chat_id)
         
-        event_payload = {
-            "event": event_type,
-            "data": {
-                "chat_id": chat_id,
-                "from": username,
-                "timestamp": timezone.now().isoformat()
-            },
-            "version": "v1"
-        }
-        
-        # Broadcast para todos (outros atendentes veem quem está digitando)
-        async_to_sync(channel_layer.group_send)(
-            "agents_presence",
-            {"type": "whatsapp.event", "event": event_payload}
-        )
-
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,162 @@
+"""
+Índice de disponibilidade dos atendentes para a distribuição automática.
+
+Um atendente recebe clientes da fila quando pertence ao departamento, está
+online com o WebSocket conectado (presença em accounts.presence_state) e tem
+menos atendimentos ativos que max_atendimentos_simultaneos. A presença já
+vive no cache compartilhado; este módulo mantém ao lado dela a carga de cada
+atendente, para que o distribuidor resolva presença e carga com leituras em
+lote (get_many), sem COUNT agregado sobre atendimentos.
+
+Chaves:
+- disponibilidade:carga:{id}  atendimentos ativos do atendente (contador)
+
+A carga é ajustada em Atendimento.save e nas atribuições em lote do
+distribuidor. Incrementos valem na hora (dentro da transação) e decrementos
+só no commit: se a transação falhar, a carga fica alta e o atendente deixa
+de receber clientes até a chave expirar, nunca passa da capacidade. Chaves
+ausentes ou expiradas (DISPONIBILIDADE_CARGA_TTL_SECONDS) são reconstruídas
+do banco com uma consulta para todos os atendentes que faltam, o que também
+corrige desvios de atualizações em massa que não passam por save().
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+KEY_PREFIX = 'disponibilidade:carga'
+
+# Status que ocupam uma vaga do atendente
+STATUS_CARGA = ('aguardando', 'em_atendimento')
+
+
+class DisponibilidadeIndex:
+    """Presença + carga dos atendentes no cache compartilhado"""
+
+    @staticmethod
+    def ttl() -> int:
+        return getattr(settings, 'DISPONIBILIDADE_CARGA_TTL_SECONDS', 300)
+
+    @staticmethod
+    def _key(atendente_id: int) -> str:
+        return f"{KEY_PREFIX}:{atendente_id}"
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def cargas_disponiveis(atendente_ids: Iterable[int], capacidade: int) -> List[Tuple[int, int]]:
+        """
+        (atendente_id, carga) dos atendentes online e abaixo da capacidade.
+
+        Args:
+            atendente_ids: membros ativos do departamento
+            capacidade: max_atendimentos_simultaneos do departamento
+        """
+        from accounts.presence_state import get_presence_service
+
+        online = get_presence_service().available_ids(list(atendente_ids))
+        if not online:
+            return []
+
+        cargas = DisponibilidadeIndex.cargas(online)
+        return [
+            (atendente_id, cargas[atendente_id])
+            for atendente_id in online
+            if cargas[atendente_id] < capacidade
+        ]
+
+    @staticmethod
+    def cargas(atendente_ids: List[int]) -> Dict[int, int]:
+        """Carga de cada atendente; as ausentes no cache são recalculadas do banco"""
+        keys = {DisponibilidadeIndex._key(atendente_id): atendente_id for atendente_id in atendente_ids}
+        cargas = {keys[key]: max(0, value) for key, value in cache.get_many(list(keys)).items()}
+
+        faltando = [atendente_id for atendente_id in atendente_ids if atendente_id not in cargas]
+        if faltando:
+            cargas.update(DisponibilidadeIndex._reconstruir(faltando))
+        return cargas
+
+    @staticmethod
+    def _reconstruir(atendente_ids: List[int]) -> Dict[int, int]:
+        from .models import Atendimento
+
+        contagem = dict(
+            Atendimento.objects.filter(
+                atendente_id__in=atendente_ids,
+                status__in=STATUS_CARGA
+            ).values('atendente_id').annotate(total=Count('id')).values_list('atendente_id', 'total')
+        )
+        cargas = {}
+        ttl = DisponibilidadeIndex.ttl()
+        for atendente_id in atendente_ids:
+            key = DisponibilidadeIndex._key(atendente_id)
+            # add: não sobrescreve um contador criado por outro processo nesse meio tempo
+            if cache.add(key, contagem.get(atendente_id, 0), timeout=ttl):
+                cargas[atendente_id] = contagem.get(atendente_id, 0)
+            else:
+                cargas[atendente_id] = max(0, cache.get(key, contagem.get(atendente_id, 0)))
+        return cargas
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _somar(atendente_id: int, delta: int) -> None:
+        try:
+            cache.incr(DisponibilidadeIndex._key(atendente_id), delta)
+        except ValueError:
+            # Sem contador no cache: será reconstruído do banco na próxima leitura
+            pass
+
+    @staticmethod
+    def incrementar(atendente_id: int, quantidade: int = 1) -> None:
+        """Ocupa vagas do atendente imediatamente (antes do commit)"""
+        DisponibilidadeIndex._somar(atendente_id, quantidade)
+
+    @staticmethod
+    def decrementar(atendente_id: int, quantidade: int = 1) -> None:
+        """Libera vagas do atendente quando a transação corrente fizer commit"""
+        transaction.on_commit(lambda: DisponibilidadeIndex._somar(atendente_id, -quantidade))
+
+    @staticmethod
+    def registrar_mudanca(anterior: Optional[Tuple[Optional[int], bool]], atual: Tuple[Optional[int], bool]) -> None:
+        """
+        Ajusta a carga após gravar um atendimento.
+
+        Args:
+            anterior: (atendente_id, ocupa_vaga) antes da gravação; None se desconhecido
+            atual: (atendente_id, ocupa_vaga) depois da gravação
+        """
+        if anterior == atual:
+            return
+        if anterior is None:
+            # Estado anterior não carregado (campos adiados): recalcula do banco
+            atendente_id = atual[0]
+            if atendente_id:
+                transaction.on_commit(lambda: DisponibilidadeIndex.invalidar([atendente_id]))
+            return
+
+        atendente_anterior, ocupava = anterior
+        atendente_atual, ocupa = atual
+        if ocupa and atendente_atual:
+            DisponibilidadeIndex.incrementar(atendente_atual)
+        if ocupava and atendente_anterior:
+            DisponibilidadeIndex.decrementar(atendente_anterior)
+
+    @staticmethod
+    def invalidar(atendente_ids: Iterable[int]) -> None:
+        """Descarta a carga em cache (recalculada na próxima leitura)"""
+        cache.delete_many([DisponibilidadeIndex._key(atendente_id) for atendente_id in atendente_ids])
+
+
+_disponibilidade_index = DisponibilidadeIndex()
+
+
+def get_disponibilidade_index() -> DisponibilidadeIndex:
+    """Retorna instância global do índice"""
+    return _disponibilidade_index
@@ -0,0 +1,236 @@
+"""
+Painel de supervisão por departamento, publicado pelo WebSocket.
+
+Em vez de consultar /filas/ e /atendimentos/ a cada poucos segundos, o
+painel se inscreve no grupo dashboard_dept_{id} (mensagem
+{"type": "subscribe_dashboard", "departamento_id": ...} no WhatsAppConsumer)
+e recebe o evento dashboard_snapshot.
+
+O snapshot é montado só com estado já mantido no cache compartilhado:
+- fila e espera máxima: conjunto ordenado de atendimento.queue_position
+- atendimentos ativos: contador por departamento, ajustado em Atendimento.save
+- atendentes online/ocupados: presença e carga (atendimento.availability)
+  dos membros do departamento (lista em cache por CONTADOR_TTL)
+
+Eventos da fila e dos atendimentos chamam notificar(), que publica no máximo
+um snapshot por DASHBOARD_INTERVALO_SECONDS por departamento: o primeiro
+evento da janela publica na hora; os seguintes agendam uma única publicação
+ao fim da janela (task publicar_dashboard), que leva o estado mais recente.
+Sem broker (desenvolvimento), CELERY_TASK_ALWAYS_EAGER roda a task na hora e
+ela publica sem esperar a janela.
+"""
+import logging
+import time
+from typing import Dict, List
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dashboard'
+
+# Validade dos contadores e da lista de membros; ao expirar são recalculados do banco
+CONTADOR_TTL = 300
+
+
+def dashboard_group_name(departamento_id: int) -> str:
+    """Grupo do channel layer com os painéis do departamento"""
+    return f"dashboard_dept_{departamento_id}"
+
+
+class DashboardService:
+    """Snapshot e publicação coalescida do painel por departamento"""
+
+    @staticmethod
+    def intervalo() -> int:
+        return max(1, getattr(settings, 'DASHBOARD_INTERVALO_SECONDS', 1))
+
+    @staticmethod
+    def _key(departamento_id: int, suffix: str) -> str:
+        return f"{KEY_PREFIX}:{departamento_id}:{suffix}"
+
+    # ------------------------------------------------------------------
+    # Contadores
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def ativos(departamento_id: int) -> int:
+        """Atendimentos que ocupam vaga no departamento"""
+        from .availability import STATUS_CARGA
+        from .models import Atendimento
+
+        key = DashboardService._key(departamento_id, 'ativos')
+        valor = cache.get(key)
+        if valor is None:
+            valor = Atendimento.objects.filter(
+                departamento_id=departamento_id, status__in=STATUS_CARGA
+            ).count()
+            if not cache.add(key, valor, timeout=CONTADOR_TTL):
+                valor = cache.get(key, valor)
+        return max(0, valor)
+
+    @staticmethod
+    def registrar_mudanca(anterior, atual) -> None:
+        """
+        Ajusta o contador de ativos após gravar um atendimento (no commit).
+
+        Args:
+            anterior: (departamento_id, ocupa_vaga) antes da gravação; None se desconhecido
+            atual: (departamento_id, ocupa_vaga) depois da gravação
+        """
+        if anterior == atual:
+            return
+
+        def aplicar():
+            if anterior is None:
+                cache.delete(DashboardService._key(atual[0], 'ativos'))
+            else:
+                if anterior[1]:
+                    DashboardService._somar(anterior[0], -1)
+                if atual[1]:
+                    DashboardService._somar(atual[0], 1)
+            departamentos = {atual[0], anterior[0] if anterior else None} - {None}
+            for departamento_id in departamentos:
+                DashboardService.notificar(departamento_id)
+
+        transaction.on_commit(aplicar)
+
+    @staticmethod
+    def registrar_atribuicoes(departamento_id: int, quantidade: int) -> None:
+        """Atendimentos criados em lote pelo distribuidor (no commit)"""
+        def aplicar():
+            DashboardService._somar(departamento_id, quantidade)
+            DashboardService.notificar(departamento_id)
+
+        transaction.on_commit(aplicar)
+
+    @staticmethod
+    def _somar(departamento_id: int, delta: int) -> None:
+        try:
+            cache.incr(DashboardService._key(departamento_id, 'ativos'), delta)
+        except ValueError:
+            # Sem contador: será recalculado na próxima leitura
+            pass
+
+    @staticmethod
+    def membros(departamento_id: int) -> List[int]:
+        """Atendentes ativos do departamento (cache)"""
+        from .models import Departamento
+
+        key = DashboardService._key(departamento_id, 'membros')
+        membros = cache.get(key)
+        if membros is None:
+            membros = list(
+                Departamento.atendentes.through.objects.filter(
+                    departamento_id=departamento_id, agent__is_active=True
+                ).values_list('agent_id', flat=True)
+            )
+            cache.set(key, membros, timeout=CONTADOR_TTL)
+        return membros
+
+    @staticmethod
+    def invalidar_membros(departamento_id: int) -> None:
+        cache.delete(DashboardService._key(departamento_id, 'membros'))
+
+    # ------------------------------------------------------------------
+    # Snapshot
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def snapshot(departamento_id: int) -> Dict:
+        """Estado atual do painel do departamento, lido do cache"""
+        from accounts.presence_state import get_presence_service
+        from .availability import get_disponibilidade_index
+        from .queue_position import get_posicao_fila_service
+
+        fila, mais_antiga = get_posicao_fila_service().resumo(departamento_id)
+        online = get_presence_service().available_ids(DashboardService.membros(departamento_id))
+        cargas = get_disponibilidade_index().cargas(online) if online else {}
+        agora = time.time()
+
+        return {
+            'departamento_id': departamento_id,
+            'fila': fila,
+            'espera_maxima_segundos': int(agora - mais_antiga) if mais_antiga else 0,
+            'atendimentos_ativos': DashboardService.ativos(departamento_id),
+            'atendentes_online': len(online),
+            'atendentes_ocupados': sum(1 for carga in cargas.values() if carga > 0),
+            'timestamp': agora,
+        }
+
+    # ------------------------------------------------------------------
+    # Publicação
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def notificar(departamento_id: int) -> None:
+        """Registra uma mudança no departamento; publica respeitando o intervalo"""
+        if DashboardService.publicar(departamento_id):
+            return
+
+        # Dentro da janela: uma única publicação pendente leva o estado final
+        intervalo = DashboardService.intervalo()
+        if not cache.add(DashboardService._key(departamento_id, 'pendente'), 1, timeout=intervalo * 2):
+            return
+
+        from .tasks import publicar_dashboard
+
+        try:
+            publicar_dashboard.apply_async(args=[departamento_id], countdown=intervalo)
+        except Exception as e:
+            # A chave pendente expira em dois intervalos; só então um evento tenta de novo
+            logger.error(f"Falha ao agendar painel do departamento {departamento_id}: {e}")
+
+    @staticmethod
+    def publicar(departamento_id: int) -> bool:
+        """
+        Publica o snapshot se a janela do departamento estiver livre.
+
+        Returns:
+            False se outro snapshot foi publicado há menos de um intervalo
+        """
+        if not cache.add(DashboardService._key(departamento_id, 'janela'), 1,
+                         timeout=DashboardService.intervalo()):
+            return False
+
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            return True
+        try:
+            async_to_sync(channel_layer.group_send)(
+                dashboard_group_name(departamento_id),
+                {
+                    'type': 'dashboard.event',
+                    'event': 'dashboard_snapshot',
+                    'data': DashboardService.snapshot(departamento_id),
+                }
+            )
+        except Exception as e:
+            logger.error(f"Erro ao publicar painel do departamento {departamento_id}: {e}")
+        return True
+
+    @staticmethod
+    def publicar_pendente(departamento_id: int, forcar: bool = False) -> bool:
+        """
+        Publicação agendada ao fim da janela (task publicar_dashboard).
+
+        forcar ignora a janela ainda aberta (task executada sem countdown, em modo eager).
+        """
+        if forcar:
+            cache.delete(DashboardService._key(departamento_id, 'janela'))
+        if not DashboardService.publicar(departamento_id):
+            return False
+        cache.delete(DashboardService._key(departamento_id, 'pendente'))
+        return True
+
+
+_dashboard_service = DashboardService()
+
+
+def get_dashboard_service() -> DashboardService:
+    """Retorna instância global do serviço"""
+    return _dashboard_service
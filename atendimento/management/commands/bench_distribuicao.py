@@ -0,0 +1,93 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.presence_state import get_presence_service
+from atendimento.availability import get_disponibilidade_index
+from atendimento.models import Atendimento, Departamento, FilaAtendimento
+from atendimento.service import get_distribuicao_service
+from clientes.models import Cliente
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede uma passada de distribuição automática com uma fila grande: "
+        "tempo total e número de consultas. Cria os dados dentro de uma "
+        "transação descartada ao final (rollback)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fila", type=int, default=1000, help="Clientes aguardando na fila")
+        parser.add_argument("--atendentes", type=int, default=200, help="Atendentes do departamento")
+        parser.add_argument("--capacidade", type=int, default=5, help="max_atendimentos_simultaneos")
+
+    def handle(self, *args, **options):
+        fila, atendentes, capacidade = options["fila"], options["atendentes"], options["capacidade"]
+
+        with transaction.atomic():
+            departamento = Departamento.objects.create(
+                nome="Bench distribuição", max_atendimentos_simultaneos=capacidade
+            )
+            User = get_user_model()
+            usuarios = User.objects.bulk_create([
+                User(username=f"bench_distribuicao_{i}", is_active=True) for i in range(atendentes)
+            ])
+            departamento.atendentes.add(*usuarios)
+            # Só atendentes online recebem clientes (índice de disponibilidade)
+            presence = get_presence_service()
+            atendente_ids = [usuario.id for usuario in usuarios]
+            for atendente_id in atendente_ids:
+                presence.socket_connected(atendente_id)
+
+            clientes = Cliente.objects.bulk_create([
+                Cliente(
+                    razao_social=f"Cliente bench {i}",
+                    cnpj=f"99.{i // 1000000:03d}.{i // 1000 % 1000:03d}/{i % 1000:04d}-00",
+                    status="ativo",
+                )
+                for i in range(fila)
+            ])
+            prioridades = ("urgente", "alta", "normal", "baixa")
+            # bulk_create não passa por FilaAtendimento.save: o peso vai explícito
+            FilaAtendimento.objects.bulk_create([
+                FilaAtendimento(
+                    departamento=departamento,
+                    cliente=cliente,
+                    chat_id=f"55119{i:08d}",
+                    numero_whatsapp=f"55119{i:08d}",
+                    prioridade=prioridades[i % 4],
+                    prioridade_rank=FilaAtendimento.rank_da_prioridade(prioridades[i % 4]),
+                )
+                for i, cliente in enumerate(clientes)
+            ])
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                distribuidos = get_distribuicao_service().distribuir_automaticamente(departamento.id)
+                elapsed = time.perf_counter() - started
+
+            cargas = sorted(
+                Atendimento.objects.filter(departamento=departamento)
+                .values_list("atendente_id", flat=True)
+            )
+            por_atendente = {}
+            for atendente_id in cargas:
+                por_atendente[atendente_id] = por_atendente.get(atendente_id, 0) + 1
+
+            self.stdout.write(
+                f"fila={fila} atendentes={atendentes} capacidade={capacidade}: "
+                f"{distribuidos} distribuídos em {elapsed * 1000:.1f}ms, "
+                f"{len(queries)} consultas, carga por atendente "
+                f"min={min(por_atendente.values(), default=0)} max={max(por_atendente.values(), default=0)}"
+            )
+
+            transaction.set_rollback(True)
+
+        # Presença e carga dos atendentes descartados ficam fora do cache compartilhado
+        presence.mark_offline(atendente_ids)
+        get_disponibilidade_index().invalidar(atendente_ids)
+
+        self.stdout.write(self.style.SUCCESS("Benchmark concluído."))
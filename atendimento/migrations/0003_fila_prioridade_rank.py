@@ -0,0 +1,45 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:20
+
+from django.db import migrations, models
+
+# Cópia de FilaAtendimento.PRIORIDADE_RANK no momento da migração
+PRIORIDADE_RANK = {'baixa': 0, 'normal': 1, 'alta': 2, 'urgente': 3}
+
+
+def preencher_prioridade_rank(apps, schema_editor):
+    """Calcula o peso das filas existentes com um único UPDATE"""
+    FilaAtendimento = apps.get_model('atendimento', 'FilaAtendimento')
+    FilaAtendimento.objects.exclude(prioridade='normal').update(
+        prioridade_rank=models.Case(
+            *[models.When(prioridade=prioridade, then=rank) for prioridade, rank in PRIORIDADE_RANK.items()],
+            default=PRIORIDADE_RANK['normal'],
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0002_add_transferencia_model'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='filaatendimento',
+            options={'ordering': ['-prioridade_rank', 'entrou_na_fila_em'], 'verbose_name': 'Fila de Atendimento', 'verbose_name_plural': 'Filas de Atendimento'},
+        ),
+        migrations.RemoveIndex(
+            model_name='filaatendimento',
+            name='atendimento_priorid_692f9d_idx',
+        ),
+        migrations.AddField(
+            model_name='filaatendimento',
+            name='prioridade_rank',
+            field=models.PositiveSmallIntegerField(default=1, editable=False, help_text='Derivado de prioridade no save (0 = baixa, 3 = urgente)', verbose_name='Peso da Prioridade'),
+        ),
+        migrations.RunPython(preencher_prioridade_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='filaatendimento',
+            index=models.Index(condition=models.Q(('atribuido_em__isnull', True)), fields=['departamento', '-prioridade_rank', 'entrou_na_fila_em'], name='fila_pendente_idx'),
+        ),
+    ]
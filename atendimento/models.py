@@ -85,18 +85,17 @@ class Departamento(models.Model):
     
     def get_atendentes_disponiveis(self):
         """Retorna atendentes disponíveis (online e com capacidade)"""
-        from django.db.models import Count
+        from .availability import get_disponibilidade_index
         
-        return self.atendentes.filter(
-            is_active=True
-        ).annotate(
-            atendimentos_ativos=Count(
-                'atendimentos_atendente',
-                filter=Q(atendimentos_atendente__status__in=['aguardando', 'em_atendimento'])
-            )
-        ).filter(
-            atendimentos_ativos__lt=self.max_atendimentos_simultaneos
+        membros = list(self.atendentes.filter(is_active=True).values_list('id', flat=True))
+        disponiveis = get_disponibilidade_index().cargas_disponiveis(
+            membros, self.max_atendimentos_simultaneos
         )
+        return self.atendentes.filter(id__in=[atendente_id for atendente_id, _ in disponiveis])
+
+
+# Ordem de atendimento da fila: maior prioridade primeiro, FIFO dentro dela
+ORDEM_FILA = ['-prioridade_rank', 'entrou_na_fila_em']
 
 
 class FilaAtendimento(models.Model):
@@ -113,6 +112,14 @@ class FilaAtendimento(models.Model):
         ('urgente', 'Urgente'),
     ]
     
+    # Peso numérico da prioridade (ordenar o CharField seria alfabético)
+    PRIORIDADE_RANK = {
+        'baixa': 0,
+        'normal': 1,
+        'alta': 2,
+        'urgente': 3,
+    }
+    
     # Identificação
     departamento = models.ForeignKey(
         Departamento,
@@ -156,6 +163,13 @@ class FilaAtendimento(models.Model):
         db_index=True
     )
     
+    prioridade_rank = models.PositiveSmallIntegerField(
+        default=1,
+        editable=False,
+        verbose_name=_("Peso da Prioridade"),
+        help_text=_("Derivado de prioridade no save (0 = baixa, 3 = urgente)")
+    )
+    
     # Timestamps
     entrou_na_fila_em = models.DateTimeField(
         auto_now_add=True,
@@ -172,15 +186,41 @@ class FilaAtendimento(models.Model):
     class Meta:
         verbose_name = _("Fila de Atendimento")
         verbose_name_plural = _("Filas de Atendimento")
-        ordering = ['-prioridade', 'entrou_na_fila_em']  # Prioridade desc, FIFO asc
+        ordering = ORDEM_FILA
         indexes = [
             models.Index(fields=['departamento', 'atribuido_em']),
-            models.Index(fields=['prioridade', 'entrou_na_fila_em']),
+            # Cabeça da fila pendente de um departamento: uma busca no índice, sem sort
+            models.Index(
+                fields=['departamento', '-prioridade_rank', 'entrou_na_fila_em'],
+                name='fila_pendente_idx',
+                condition=Q(atribuido_em__isnull=True)
+            ),
         ]
     
     def __str__(self) -> str:
         return f"Fila {self.departamento.nome} - {self.cliente.razao_social}"
     
+    @classmethod
+    def rank_da_prioridade(cls, prioridade: str) -> int:
+        return cls.PRIORIDADE_RANK.get(prioridade, cls.PRIORIDADE_RANK['normal'])
+    
+    def save(self, *args, **kwargs):
+        self.prioridade_rank = self.rank_da_prioridade(self.prioridade)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'prioridade' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'prioridade_rank'}
+        super().save(*args, **kwargs)
+        
+        # Posição na fila (entrada, mudança de prioridade ou atribuição), no commit
+        from .queue_position import get_posicao_fila_service
+        get_posicao_fila_service().registrar(self)
+    
+    def delete(self, *args, **kwargs):
+        from .queue_position import get_posicao_fila_service
+        if self.atribuido_em is None:
+            get_posicao_fila_service().remover(self.departamento_id, [(self.pk, self.chat_id)])
+        return super().delete(*args, **kwargs)
+    
     @property
     def tempo_espera_minutos(self) -> int:
         """Calcula tempo de espera na fila em minutos"""
@@ -352,6 +392,52 @@ class Atendimento(models.Model):
         atendente_nome = self.atendente.username if self.atendente else "Não atribuído"
         return f"Atendimento #{self.id} - {self.cliente.razao_social} ({atendente_nome})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado carregado, para ajustar carga, painel e cache do chat no save
+        campos = ('atendente_id', 'departamento_id', 'status')
+        if all(campo in instance.__dict__ for campo in campos):
+            instance._estado_anterior = instance._estado_atual()
+        else:
+            instance._estado_anterior = None
+        return instance
+    
+    def _estado_atual(self):
+        return (self.atendente_id, self.departamento_id, self.status)
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Alimenta o delta-sync da API de chats (GET /chats/changes/) e mantém
+        # a permissão do cache de mensagens recentes alinhada
+        from chats.active_conversations import get_conversa_ativa_service
+        from chats.changes import CAMPOS_ATENDIMENTO, altera_campos, record_chat_change
+        from chats.message_cache import get_recent_messages_cache
+        from .availability import STATUS_CARGA, get_disponibilidade_index
+        from .dashboard import get_dashboard_service
+        if altera_campos(kwargs.get('update_fields'), CAMPOS_ATENDIMENTO):
+            record_chat_change(atendimento_id=self.pk)
+            get_recent_messages_cache().update_atendimento(self)
+        
+        anterior = getattr(self, '_estado_anterior', (None, None, None))
+        atual = self._estado_atual()
+        self._estado_anterior = atual
+        if anterior == atual:
+            return
+        
+        # Atendimento ativo do chat em cache (finalizar, cancelar, transferir...)
+        get_conversa_ativa_service().invalidar_no_commit([self.chat_id])
+        
+        # Carga dos atendentes e painel do departamento (instância nova: não ocupava vaga)
+        ocupava = anterior[2] in STATUS_CARGA if anterior else None
+        ocupa = atual[2] in STATUS_CARGA
+        get_disponibilidade_index().registrar_mudanca(
+            (anterior[0], ocupava) if anterior else None, (atual[0], ocupa)
+        )
+        get_dashboard_service().registrar_mudanca(
+            (anterior[1], ocupava) if anterior else None, (atual[1], ocupa)
+        )
+    
     @property
     def tempo_espera_minutos(self) -> int:
         """Tempo de espera até ser atribuído"""
@@ -405,6 +491,14 @@ class Atendimento(models.Model):
             self.tempo_total_atendimento_segundos = int(delta.total_seconds())
         
         self.save(update_fields=['status', 'finalizado_em', 'observacoes', 'tempo_total_atendimento_segundos', 'atualizado_em'])
+        self._liberar_capacidade('finalizado')
+        
+        # Alimenta o tempo médio de atendimento usado no ETA da fila
+        if self.tempo_total_atendimento_segundos:
+            from .queue_position import get_posicao_fila_service
+            get_posicao_fila_service().registrar_duracao(
+                self.departamento_id, self.tempo_total_atendimento_segundos
+            )
     
     def cancelar(self, motivo: str = ''):
         """Cancela o atendimento"""
@@ -412,6 +506,13 @@ class Atendimento(models.Model):
         self.finalizado_em = timezone.now()
         self.observacoes = f"Cancelado: {motivo}"
         self.save(update_fields=['status', 'finalizado_em', 'observacoes', 'atualizado_em'])
+        self._liberar_capacidade('cancelado')
+    
+    def _liberar_capacidade(self, motivo: str):
+        """Agenda a distribuição da fila nos departamentos do atendente liberado"""
+        if self.atendente_id:
+            from .scheduler import get_distribuicao_scheduler
+            get_distribuicao_scheduler().agendar_para_atendente(self.atendente_id, motivo)
     
     def incrementar_mensagens_cliente(self):
         """Incrementa contador de mensagens do cliente"""
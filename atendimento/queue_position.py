@@ -0,0 +1,458 @@
+"""
+Posição na fila e tempo estimado de espera por chat.
+
+Cada departamento tem um conjunto ordenado das filas pendentes, na mesma
+ordem de atendimento de filas_pendentes (prioridade_rank desc, FIFO). Com o
+cache em Redis, o conjunto é um sorted set (ZRANK em O(log n)); sem Redis,
+uma lista ordenada em memória do processo (busca binária), suficiente para
+desenvolvimento e testes.
+
+Chaves (Redis):
+- fila_posicao:{departamento_id}  sorted set; membro "{fila_id}|{chat_id}"
+- fila_posicao:chats              hash chat_id -> "{departamento_id}|{membro}"
+
+O conjunto é mantido por FilaAtendimento.save/delete e pelas atribuições em
+lote do distribuidor, sempre no commit. Departamento sem o marcador de
+sincronia no cache (primeira leitura, ou a cada FILA_POSICAO_RESYNC_SECONDS)
+é reconstruído do banco pelo índice fila_pendente_idx, o que corrige
+eventuais desvios (linhas removidas em massa, Redis reiniciado).
+
+ETA: posição x tempo médio de atendimento do departamento (média móvel
+exponencial atualizada em Atendimento.finalizar) / vagas dos atendentes
+online; membros e capacidade do departamento vêm do cache, sem consulta por
+leitura. A cada mudança, as primeiras FILA_POSICAO_PUSH_LIMITE posições que
+mudaram são publicadas no tópico do chat (evento queue_position).
+"""
+import bisect
+import logging
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'fila_posicao'
+CHATS_KEY = f'{KEY_PREFIX}:chats'
+
+# Peso da duração mais recente na média móvel do tempo de atendimento
+TMA_ALPHA = 0.2
+
+# Validade da capacidade por atendente em cache (editada em PATCH /departamentos/)
+CAPACIDADE_TTL = 300
+
+# Separa as faixas de prioridade no score (epoch em segundos < 1e10)
+_RANK_STEP = 1e10
+_MAX_RANK = 3
+
+
+def _score(prioridade_rank: int, entrou_na_fila_em) -> float:
+    """Menor score = atendido antes: maior prioridade, depois quem chegou primeiro"""
+    return (_MAX_RANK - prioridade_rank) * _RANK_STEP + entrou_na_fila_em.timestamp()
+
+
+def _member(fila_id: int, chat_id: str) -> str:
+    return f"{fila_id}|{chat_id}"
+
+
+def _chat_do_membro(member: str) -> str:
+    return member.split('|', 1)[1]
+
+
+class _FilaMemoria:
+    """Conjuntos ordenados na memória do processo (sem Redis)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filas: Dict[int, List[Tuple[float, str]]] = {}
+        self._scores: Dict[int, Dict[str, float]] = {}
+        self._chats: Dict[str, Tuple[int, str]] = {}
+
+    def add(self, departamento_id: int, member: str, score: float) -> None:
+        with self._lock:
+            self._remove(departamento_id, member)
+            bisect.insort(self._filas.setdefault(departamento_id, []), (score, member))
+            self._scores.setdefault(departamento_id, {})[member] = score
+            self._chats[_chat_do_membro(member)] = (departamento_id, member)
+
+    def _remove(self, departamento_id: int, member: str) -> None:
+        score = self._scores.get(departamento_id, {}).pop(member, None)
+        if score is not None:
+            fila = self._filas[departamento_id]
+            del fila[bisect.bisect_left(fila, (score, member))]
+
+    def remove(self, departamento_id: int, members: Iterable[str]) -> None:
+        with self._lock:
+            for member in members:
+                self._remove(departamento_id, member)
+                chat_id = _chat_do_membro(member)
+                if self._chats.get(chat_id, (None, None))[1] == member:
+                    del self._chats[chat_id]
+
+    def rank(self, departamento_id: int, member: str) -> Optional[int]:
+        with self._lock:
+            score = self._scores.get(departamento_id, {}).get(member)
+            if score is None:
+                return None
+            return bisect.bisect_left(self._filas[departamento_id], (score, member))
+
+    def score(self, departamento_id: int, member: str) -> Optional[float]:
+        return self._scores.get(departamento_id, {}).get(member)
+
+    def card(self, departamento_id: int) -> int:
+        return len(self._filas.get(departamento_id, ()))
+
+    def range(self, departamento_id: int, start: int, stop: int) -> List[str]:
+        with self._lock:
+            return [member for _, member in self._filas.get(departamento_id, [])[start:stop]]
+
+    def oldest(self, departamento_id: int) -> Optional[float]:
+        """Menor instante de entrada entre as faixas de prioridade (uma busca por faixa)"""
+        with self._lock:
+            fila = self._filas.get(departamento_id, [])
+            entradas = []
+            for faixa in range(_MAX_RANK + 1):
+                index = bisect.bisect_left(fila, (faixa * _RANK_STEP,))
+                if index < len(fila) and fila[index][0] < (faixa + 1) * _RANK_STEP:
+                    entradas.append(fila[index][0] - faixa * _RANK_STEP)
+            return min(entradas, default=None)
+
+    def replace(self, departamento_id: int, items: Dict[str, float]) -> None:
+        with self._lock:
+            for member in self._scores.pop(departamento_id, {}):
+                self._chats.pop(_chat_do_membro(member), None)
+            self._filas[departamento_id] = sorted((score, member) for member, score in items.items())
+            self._scores[departamento_id] = dict(items)
+            for member in items:
+                self._chats[_chat_do_membro(member)] = (departamento_id, member)
+
+    def chat(self, chat_id: str) -> Optional[Tuple[int, str]]:
+        return self._chats.get(chat_id)
+
+
+class _FilaRedis:
+    """Sorted sets no Redis do cache (django-redis)"""
+
+    def __init__(self, client):
+        self._client = client
+
+    @staticmethod
+    def _key(departamento_id: int) -> str:
+        return f"{KEY_PREFIX}:{departamento_id}"
+
+    def add(self, departamento_id: int, member: str, score: float) -> None:
+        pipe = self._client.pipeline()
+        pipe.zadd(self._key(departamento_id), {member: score})
+        pipe.hset(CHATS_KEY, _chat_do_membro(member), f"{departamento_id}|{member}")
+        pipe.execute()
+
+    def remove(self, departamento_id: int, members: Iterable[str]) -> None:
+        members = list(members)
+        if not members:
+            return
+        pipe = self._client.pipeline()
+        pipe.zrem(self._key(departamento_id), *members)
+        pipe.hdel(CHATS_KEY, *[_chat_do_membro(member) for member in members])
+        pipe.execute()
+
+    def rank(self, departamento_id: int, member: str) -> Optional[int]:
+        return self._client.zrank(self._key(departamento_id), member)
+
+    def score(self, departamento_id: int, member: str) -> Optional[float]:
+        return self._client.zscore(self._key(departamento_id), member)
+
+    def card(self, departamento_id: int) -> int:
+        return self._client.zcard(self._key(departamento_id))
+
+    def range(self, departamento_id: int, start: int, stop: int) -> List[str]:
+        if stop <= start:
+            return []
+        return [m.decode() for m in self._client.zrange(self._key(departamento_id), start, stop - 1)]
+
+    def oldest(self, departamento_id: int) -> Optional[float]:
+        """Menor instante de entrada entre as faixas de prioridade (uma busca por faixa)"""
+        pipe = self._client.pipeline(transaction=False)
+        for faixa in range(_MAX_RANK + 1):
+            pipe.zrangebyscore(
+                self._key(departamento_id), faixa * _RANK_STEP, f"({(faixa + 1) * _RANK_STEP}",
+                start=0, num=1, withscores=True
+            )
+        entradas = [
+            primeiro[0][1] - faixa * _RANK_STEP
+            for faixa, primeiro in enumerate(pipe.execute()) if primeiro
+        ]
+        return min(entradas, default=None)
+
+    def replace(self, departamento_id: int, items: Dict[str, float]) -> None:
+        key = self._key(departamento_id)
+        # Chats que saíram do conjunto também saem do hash chat -> departamento
+        novos = {_chat_do_membro(member) for member in items}
+        antigos = {_chat_do_membro(m.decode()) for m in self._client.zrange(key, 0, -1)} - novos
+        pipe = self._client.pipeline()  # MULTI/EXEC: leitores não veem o conjunto vazio
+        pipe.delete(key)
+        if antigos:
+            pipe.hdel(CHATS_KEY, *antigos)
+        if items:
+            pipe.zadd(key, items)
+            pipe.hset(CHATS_KEY, mapping={
+                _chat_do_membro(member): f"{departamento_id}|{member}" for member in items
+            })
+        pipe.execute()
+
+    def chat(self, chat_id: str) -> Optional[Tuple[int, str]]:
+        value = self._client.hget(CHATS_KEY, chat_id)
+        if value is None:
+            return None
+        departamento_id, member = value.decode().split('|', 1)
+        return int(departamento_id), member
+
+
+class PosicaoFilaService:
+    """Posição, ETA e publicação das mudanças da fila de espera"""
+
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self._criar_backend()
+        return self._backend
+
+    @staticmethod
+    def _criar_backend():
+        if type(cache).__module__.startswith('django_redis'):
+            from django_redis import get_redis_connection
+            return _FilaRedis(get_redis_connection('default'))
+        return _FilaMemoria()
+
+    @staticmethod
+    def push_limite() -> int:
+        return getattr(settings, 'FILA_POSICAO_PUSH_LIMITE', 50)
+
+    @staticmethod
+    def _sync_key(departamento_id: int) -> str:
+        return f"{KEY_PREFIX}:{departamento_id}:sincronizada"
+
+    # ------------------------------------------------------------------
+    # Sincronia com o banco
+    # ------------------------------------------------------------------
+
+    def reconstruir(self, departamento_id: int) -> int:
+        """Recarrega o conjunto do departamento a partir das filas pendentes"""
+        from .service import filas_pendentes
+
+        items = {
+            _member(fila_id, chat_id): _score(rank, entrou_em)
+            for fila_id, chat_id, rank, entrou_em in filas_pendentes(departamento_id).values_list(
+                'id', 'chat_id', 'prioridade_rank', 'entrou_na_fila_em'
+            )
+        }
+        self.backend.replace(departamento_id, items)
+        cache.set(
+            self._sync_key(departamento_id), True,
+            timeout=getattr(settings, 'FILA_POSICAO_RESYNC_SECONDS', 3600)
+        )
+        return len(items)
+
+    def _garantir(self, departamento_id: int) -> bool:
+        """Reconstrói o conjunto se estiver fora de sincronia; True se reconstruiu"""
+        if cache.get(self._sync_key(departamento_id)):
+            return False
+        self.reconstruir(departamento_id)
+        return True
+
+    # ------------------------------------------------------------------
+    # Escrita (chamada no commit)
+    # ------------------------------------------------------------------
+
+    def registrar(self, fila) -> None:
+        """Entrada, mudança de prioridade ou atribuição de uma fila (FilaAtendimento.save)"""
+        if fila.atribuido_em is None:
+            departamento_id, fila_id = fila.departamento_id, fila.pk
+            member, score = _member(fila.pk, fila.chat_id), _score(fila.prioridade_rank, fila.entrou_na_fila_em)
+            transaction.on_commit(lambda: self._entrar(departamento_id, fila_id, member, score))
+        else:
+            self.remover(fila.departamento_id, [(fila.pk, fila.chat_id)])
+
+    def remover(self, departamento_id: int, filas: Iterable[Tuple[int, str]]) -> None:
+        """Filas (id, chat_id) que saíram da espera: atribuídas ou removidas"""
+        members = [_member(fila_id, chat_id) for fila_id, chat_id in filas]
+        transaction.on_commit(lambda: self._sair(departamento_id, members))
+
+    def _entrar(self, departamento_id: int, fila_id: int, member: str, score: float) -> None:
+        try:
+            reconstruido = self._garantir(departamento_id)
+            if not reconstruido and self.backend.score(departamento_id, member) == score:
+                # Gravação da fila que não muda a ordem (ex.: edição de observações)
+                return
+            anterior = None if reconstruido else self.backend.rank(departamento_id, member)
+            self.backend.add(departamento_id, member, score)
+            atual = self.backend.rank(departamento_id, member)
+            inicio = min(r for r in (anterior, atual) if r is not None)
+            self._publicar(departamento_id, inicio)
+            self._notificar_painel(departamento_id)
+        except Exception as e:
+            logger.error(f"Erro ao registrar fila {fila_id} na posição da fila: {e}")
+
+    def _sair(self, departamento_id: int, members: List[str]) -> None:
+        try:
+            self._garantir(departamento_id)
+            ranks = [self.backend.rank(departamento_id, member) for member in members]
+            presentes = [m for m, r in zip(members, ranks) if r is not None]
+            if not presentes:
+                return
+            self.backend.remove(departamento_id, presentes)
+            for member in presentes:
+                self._emitir(_chat_do_membro(member), {
+                    'chat_id': _chat_do_membro(member),
+                    'departamento_id': departamento_id,
+                    'posicao': None,
+                    'total': None,
+                    'eta_segundos': None,
+                })
+            self._publicar(departamento_id, min(r for r in ranks if r is not None))
+            self._notificar_painel(departamento_id)
+        except Exception as e:
+            logger.error(f"Erro ao remover filas do departamento {departamento_id} da posição da fila: {e}")
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def posicao(self, chat_id: str) -> Optional[Dict]:
+        """
+        Posição (1 = próximo) e ETA do chat, ou None se não está aguardando.
+
+        Returns:
+            {'chat_id', 'departamento_id', 'posicao', 'total', 'eta_segundos'}
+        """
+        encontrado = self.backend.chat(chat_id)
+        if encontrado is None:
+            from .models import FilaAtendimento
+
+            # Conjunto ainda não carregado neste processo/Redis: sincroniza o departamento
+            departamento_id = FilaAtendimento.objects.filter(
+                chat_id=chat_id, atribuido_em__isnull=True
+            ).values_list('departamento_id', flat=True).first()
+            if departamento_id is None or cache.get(self._sync_key(departamento_id)):
+                return None
+            self.reconstruir(departamento_id)
+            encontrado = self.backend.chat(chat_id)
+            if encontrado is None:
+                return None
+
+        departamento_id, member = encontrado
+        rank = self.backend.rank(departamento_id, member)
+        if rank is None:
+            return None
+        return self._dados(chat_id, departamento_id, rank + 1,
+                           self.backend.card(departamento_id), self.estimativa(departamento_id))
+
+    def resumo(self, departamento_id: int) -> Tuple[int, Optional[float]]:
+        """(filas aguardando, epoch de entrada da mais antiga) do departamento"""
+        self._garantir(departamento_id)
+        return self.backend.card(departamento_id), self.backend.oldest(departamento_id)
+
+    def estimativa(self, departamento_id: int) -> Optional[float]:
+        """Segundos de espera por posição: TMA / vagas online (None sem atendentes online)"""
+        from accounts.presence_state import get_presence_service
+        from .dashboard import get_dashboard_service
+
+        capacidade = self.capacidade(departamento_id)
+        if capacidade is None:
+            return None
+        membros = get_dashboard_service().membros(departamento_id)
+        vagas = len(get_presence_service().available_ids(membros)) * capacidade
+        if vagas <= 0:
+            return None
+        return self.tempo_medio_atendimento(departamento_id) / vagas
+
+    @staticmethod
+    def _capacidade_key(departamento_id: int) -> str:
+        return f"{KEY_PREFIX}:{departamento_id}:capacidade"
+
+    def capacidade(self, departamento_id: int) -> Optional[int]:
+        """max_atendimentos_simultaneos do departamento (cache); None se não existe"""
+        from .models import Departamento
+
+        key = self._capacidade_key(departamento_id)
+        valor = cache.get(key)
+        if valor is None:
+            valor = Departamento.objects.filter(id=departamento_id).values_list(
+                'max_atendimentos_simultaneos', flat=True
+            ).first()
+            if valor is None:
+                return None
+            cache.set(key, valor, timeout=CAPACIDADE_TTL)
+        return valor
+
+    def invalidar_capacidade(self, departamento_id: int) -> None:
+        cache.delete(self._capacidade_key(departamento_id))
+
+    @staticmethod
+    def _dados(chat_id: str, departamento_id: int, posicao: int, total: int,
+               por_posicao: Optional[float]) -> Dict:
+        return {
+            'chat_id': chat_id,
+            'departamento_id': departamento_id,
+            'posicao': posicao,
+            'total': total,
+            'eta_segundos': math.ceil(posicao * por_posicao) if por_posicao is not None else None,
+        }
+
+    # ------------------------------------------------------------------
+    # Tempo médio de atendimento
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _tma_key(departamento_id: int) -> str:
+        return f"{KEY_PREFIX}:tma:{departamento_id}"
+
+    def tempo_medio_atendimento(self, departamento_id: int) -> float:
+        return cache.get(self._tma_key(departamento_id)) or getattr(settings, 'FILA_TMA_PADRAO_SECONDS', 600)
+
+    def registrar_duracao(self, departamento_id: int, segundos: int) -> None:
+        """Atualiza a média móvel com a duração de um atendimento finalizado"""
+        atual = cache.get(self._tma_key(departamento_id))
+        media = segundos if atual is None else TMA_ALPHA * segundos + (1 - TMA_ALPHA) * atual
+        cache.set(self._tma_key(departamento_id), media, timeout=None)
+
+    # ------------------------------------------------------------------
+    # Publicação
+    # ------------------------------------------------------------------
+
+    def _publicar(self, departamento_id: int, inicio: int) -> None:
+        """Publica a posição dos chats a partir de inicio (as que mudaram), até o limite"""
+        limite = self.push_limite()
+        if inicio >= limite:
+            return
+        members = self.backend.range(departamento_id, inicio, limite)
+        if not members:
+            return
+        total = self.backend.card(departamento_id)
+        por_posicao = self.estimativa(departamento_id)
+        for offset, member in enumerate(members):
+            chat_id = _chat_do_membro(member)
+            self._emitir(chat_id, self._dados(chat_id, departamento_id, inicio + offset + 1, total, por_posicao))
+
+    @staticmethod
+    def _notificar_painel(departamento_id: int) -> None:
+        from .dashboard import get_dashboard_service
+        get_dashboard_service().notificar(departamento_id)
+
+    @staticmethod
+    def _emitir(chat_id: str, data: Dict) -> None:
+        from chats.events import emit_chat_event
+        emit_chat_event(chat_id, 'queue_position', data)
+
+
+_posicao_fila_service = PosicaoFilaService()
+
+
+def get_posicao_fila_service() -> PosicaoFilaService:
+    """Retorna instância global do serviço"""
+    return _posicao_fila_service
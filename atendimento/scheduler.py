@@ -0,0 +1,143 @@
+"""
+Distribuição automática disparada por eventos de capacidade.
+
+Além de adicionar_na_fila e POST /filas/distribuir/, a fila precisa andar
+quando surge capacidade: um atendimento finalizado, cancelado ou
+transferido, um atendente que fica online ou a edição de
+max_atendimentos_simultaneos/atendentes de um departamento.
+
+Cada evento agenda uma passada de distribuir_automaticamente para os
+departamentos afetados. Eventos do mesmo departamento dentro de
+DISTRIBUICAO_DEBOUNCE_SECONDS são agrupados por uma chave no cache
+compartilhado (cache.add): só o primeiro enfileira a task, com countdown
+igual à janela; os demais são absorvidos. A task remove a chave antes de
+distribuir, de modo que eventos ocorridos durante a passada agendam a
+próxima. A chave é tomada e a task enfileirada no commit da transação que
+gerou o evento; um evento de transação desfeita não agenda nem bloqueia o
+departamento. Com a janela zerada, a passada roda no próprio processo; sem
+broker (desenvolvimento), CELERY_TASK_ALWAYS_EAGER faz o mesmo para a task.
+"""
+import logging
+from typing import Iterable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'distribuicao:agendada'
+
+# Folga além da janela: se o worker não consumir a task, a chave expira e
+# um evento posterior volta a agendar
+KEY_MARGIN_SECONDS = 60
+
+distribuicao_agendamentos = Counter(
+    'distribuicao_agendamentos_total',
+    'Eventos de capacidade recebidos pelo agendador, por resultado (agendado/agrupado)'
+)
+
+
+class DistribuicaoScheduler:
+    """Agenda passadas de distribuição por departamento, com debounce"""
+
+    @staticmethod
+    def debounce_seconds() -> int:
+        return getattr(settings, 'DISTRIBUICAO_DEBOUNCE_SECONDS', 2)
+
+    @staticmethod
+    def _key(departamento_id: int) -> str:
+        return f"{KEY_PREFIX}:{departamento_id}"
+
+    @staticmethod
+    def agendar(departamento_id: int, motivo: str = '') -> None:
+        """Agenda uma passada de distribuição para o departamento no commit da transação"""
+        transaction.on_commit(lambda: DistribuicaoScheduler._agendar_agora(departamento_id, motivo))
+
+    @staticmethod
+    def _agendar_agora(departamento_id: int, motivo: str = '') -> bool:
+        """
+        Toma a chave de debounce e enfileira a passada.
+
+        Returns:
+            True se agendou, False se já havia uma passada pendente
+        """
+        delay = max(0, DistribuicaoScheduler.debounce_seconds())
+        key = DistribuicaoScheduler._key(departamento_id)
+        if not cache.add(key, motivo or True, timeout=delay + KEY_MARGIN_SECONDS):
+            distribuicao_agendamentos.inc(result='agrupado')
+            return False
+
+        distribuicao_agendamentos.inc(result='agendado')
+        logger.debug(f"Distribuição do departamento {departamento_id} agendada ({motivo})")
+        DistribuicaoScheduler._disparar(departamento_id, delay)
+        return True
+
+    @staticmethod
+    def agendar_departamentos(departamento_ids: Iterable[int], motivo: str = '') -> int:
+        """Agenda vários departamentos; retorna quantos foram enviados ao agendador"""
+        total = 0
+        for departamento_id in departamento_ids:
+            DistribuicaoScheduler.agendar(departamento_id, motivo)
+            total += 1
+        return total
+
+    @staticmethod
+    def agendar_para_atendente(atendente_id: int, motivo: str = '') -> int:
+        """
+        Agenda os departamentos ativos do atendente que têm clientes na fila.
+
+        A carga de um atendente conta atendimentos de todos os departamentos,
+        então capacidade liberada vale para qualquer um deles.
+        """
+        if not atendente_id:
+            return 0
+        return DistribuicaoScheduler.agendar_departamentos(
+            DistribuicaoScheduler._departamentos_com_fila(atendente_id), motivo
+        )
+
+    @staticmethod
+    def _departamentos_com_fila(atendente_id: int) -> List[int]:
+        from .models import Departamento, FilaAtendimento
+
+        return list(
+            Departamento.objects.filter(
+                atendentes__id=atendente_id,
+                ativo=True,
+                id__in=FilaAtendimento.objects.filter(
+                    atribuido_em__isnull=True
+                ).values('departamento_id')
+            ).values_list('id', flat=True)
+        )
+
+    @staticmethod
+    def _disparar(departamento_id: int, delay: int) -> None:
+        if delay <= 0:
+            DistribuicaoScheduler.executar(departamento_id)
+            return
+
+        from .tasks import distribuir_departamento
+
+        try:
+            distribuir_departamento.apply_async(args=[departamento_id], countdown=delay)
+        except Exception as e:
+            # A chave de debounce expira em KEY_MARGIN_SECONDS e o próximo evento agenda de novo
+            logger.error(f"Falha ao enfileirar distribuição do departamento {departamento_id}: {e}")
+
+    @staticmethod
+    def executar(departamento_id: int) -> int:
+        """Passada agendada: libera o debounce e distribui o departamento"""
+        from .service import get_distribuicao_service
+
+        cache.delete(DistribuicaoScheduler._key(departamento_id))
+        return get_distribuicao_service().distribuir_automaticamente(departamento_id)
+
+
+_scheduler = DistribuicaoScheduler()
+
+
+def get_distribuicao_scheduler() -> DistribuicaoScheduler:
+    """Retorna instância global do agendador"""
+    return _scheduler
@@ -3,16 +3,66 @@ Serviço de distribuição automática de atendimentos (Issue #37).
 
 Implementa lógica de atribuição inteligente de atendimentos para atendentes.
 """
+import heapq
 import logging
-from typing import Optional
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from django.conf import settings
 from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone
 
-from .models import Departamento, FilaAtendimento, Atendimento
+from .models import ORDEM_FILA, Departamento, FilaAtendimento, Atendimento
 
 logger = logging.getLogger(__name__)
 
 
+def filas_pendentes(departamento_id: int) -> QuerySet:
+    """
+    Filas aguardando atendente no departamento, na ordem de atendimento.
+    
+    Servida pelo índice parcial fila_pendente_idx: a cabeça da fila (e cada
+    lote do distribuidor) é lida direto do índice, sem ordenar linhas.
+    """
+    return FilaAtendimento.objects.filter(
+        departamento_id=departamento_id,
+        atribuido_em__isnull=True
+    ).order_by(*ORDEM_FILA)
+
+
+def planejar_atribuicoes(
+    filas: Iterable[FilaAtendimento],
+    cargas: Iterable[Tuple[int, int]],
+    capacidade: int
+) -> List[Tuple[FilaAtendimento, int]]:
+    """
+    Atribui a fila, na ordem recebida, ao atendente com menor carga.
+    
+    Min-heap de (carga, atendente_id): cada atribuição custa O(log atendentes)
+    e o atendente volta ao heap enquanto estiver abaixo da capacidade.
+    
+    Args:
+        filas: Filas pendentes já ordenadas por prioridade
+        cargas: Pares (atendente_id, atendimentos ativos)
+        capacidade: Máximo de atendimentos simultâneos por atendente
+    
+    Returns:
+        Pares (fila, atendente_id); filas sem atendente livre ficam de fora
+    """
+    heap = [(carga, atendente_id) for atendente_id, carga in cargas if carga < capacidade]
+    heapq.heapify(heap)
+    
+    plano = []
+    for fila in filas:
+        if not heap:
+            break
+        carga, atendente_id = heapq.heappop(heap)
+        plano.append((fila, atendente_id))
+        if carga + 1 < capacidade:
+            heapq.heappush(heap, (carga + 1, atendente_id))
+    return plano
+
+
 class DistribuicaoAtendimentoService:
     """
     Serviço de distribuição automática de atendimentos.
@@ -71,6 +121,16 @@ class DistribuicaoAtendimentoService:
         """
         Distribui atendimentos pendentes para atendentes disponíveis.
         
+        A fila é drenada em lotes de DISTRIBUICAO_BATCH_SIZE. Cada lote é uma
+        transação curta que reivindica filas e atendentes com
+        SELECT ... FOR UPDATE SKIP LOCKED: vários processos podem distribuir
+        o mesmo departamento em paralelo sem atribuir a mesma fila duas vezes,
+        sem passar da capacidade de um atendente e sem esperar por locks.
+        Só recebem clientes atendentes online, com WebSocket conectado e abaixo
+        da capacidade, segundo o índice de disponibilidade (presença e carga
+        em cache). A atribuição do lote é feita em memória
+        (planejar_atribuicoes) e os atendimentos são criados em lote.
+        
         Args:
             departamento_id: ID do departamento
         
@@ -83,67 +143,106 @@ class DistribuicaoAtendimentoService:
             logger.warning(f"Departamento {departamento_id} não encontrado ou inativo")
             return 0
         
-        # Busca filas pendentes (ordenadas por prioridade e FIFO)
-        filas_pendentes = FilaAtendimento.objects.filter(
-            departamento=departamento,
-            atribuido_em__isnull=True
-        ).order_by('-prioridade', 'entrou_na_fila_em')
+        batch_size = getattr(settings, 'DISTRIBUICAO_BATCH_SIZE', 50)
+        distribuidos = 0
+        while True:
+            reivindicadas, atribuidas = DistribuicaoAtendimentoService._distribuir_lote(
+                departamento, batch_size
+            )
+            distribuidos += atribuidas
+            # Fila vazia (ou toda reivindicada por outro processo) ou sem atendentes livres
+            if reivindicadas < batch_size or atribuidas < reivindicadas:
+                break
         
-        if not filas_pendentes.exists():
-            return 0
+        if distribuidos > 0:
+            logger.info(f"{distribuidos} atendimentos distribuídos no departamento {departamento.nome}")
         
-        # Busca atendentes disponíveis
-        atendentes_disponiveis = departamento.get_atendentes_disponiveis()
+        return distribuidos
+    
+    @staticmethod
+    def _distribuir_lote(departamento: Departamento, batch_size: int) -> Tuple[int, int]:
+        """
+        Reivindica e atribui um lote da fila.
         
-        if not atendentes_disponiveis.exists():
-            logger.info(f"Nenhum atendente disponível no departamento {departamento.nome}")
-            return 0
+        Returns:
+            (filas reivindicadas, filas atribuídas)
+        """
+        from django.contrib.auth import get_user_model
+        from chats.changes import record_chat_changes
+        from .availability import get_disponibilidade_index
+        from chats.active_conversations import get_conversa_ativa_service
+        from .dashboard import get_dashboard_service
+        from .queue_position import get_posicao_fila_service
         
-        distribuidos = 0
+        User = get_user_model()
+        indice = get_disponibilidade_index()
         
-        # Distribui usando round-robin
-        for fila in filas_pendentes:
-            # Pega atendente com menos atendimentos ativos
-            atendente = atendentes_disponiveis.order_by('atendimentos_ativos').first()
+        with transaction.atomic():
+            # Filas pendentes (prioridade e FIFO) que nenhum outro processo está atribuindo
+            filas = list(
+                filas_pendentes(departamento.id).select_for_update(skip_locked=True).only(
+                    'id', 'cliente_id', 'chat_id', 'numero_whatsapp', 'prioridade'
+                )[:batch_size]
+            )
+            if not filas:
+                return 0, 0
             
-            if not atendente:
-                break
+            # Atendentes livres de outros distribuidores; a carga lida abaixo não
+            # diminui até o commit, pois quem atribui a eles precisa do mesmo lock
+            atendente_ids = list(
+                User.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                    departamentos=departamento,
+                    is_active=True
+                ).values_list('id', flat=True)
+            )
+            # Presença e carga vêm do índice de disponibilidade (cache)
+            cargas = indice.cargas_disponiveis(
+                atendente_ids, departamento.max_atendimentos_simultaneos
+            ) if atendente_ids else []
             
-            # Cria atendimento e atribui
-            with transaction.atomic():
-                atendimento = Atendimento.objects.create(
+            plano = planejar_atribuicoes(filas, cargas, departamento.max_atendimentos_simultaneos)
+            if not plano:
+                logger.info(f"Nenhum atendente disponível no departamento {departamento.nome}")
+                return len(filas), 0
+            
+            agora = timezone.now()
+            atendimentos = Atendimento.objects.bulk_create([
+                Atendimento(
                     departamento=departamento,
-                    cliente=fila.cliente,
+                    cliente_id=fila.cliente_id,
                     chat_id=fila.chat_id,
                     numero_whatsapp=fila.numero_whatsapp,
                     prioridade=fila.prioridade,
-                    status='aguardando'
-                )
-                
-                # Atribui atendente
-                atendimento.atribuir_atendente(atendente)
-                
-                # Marca fila como atribuída
-                fila.atribuido_em = timezone.now()
-                fila.save(update_fields=['atribuido_em'])
-                
-                distribuidos += 1
-                
-                logger.info(
-                    f"Atendimento {atendimento.id} atribuído a {atendente.username} "
-                    f"(departamento: {departamento.nome}, cliente: {fila.cliente.razao_social})"
+                    atendente_id=atendente_id,
+                    status='em_atendimento',
+                    iniciado_em=agora
                 )
+                for fila, atendente_id in plano
+            ])
             
-            # Atualiza contagem de atendentes disponíveis
-            atendentes_disponiveis = departamento.get_atendentes_disponiveis()
+            get_dashboard_service().registrar_atribuicoes(departamento.id, len(atendimentos))
+            get_conversa_ativa_service().invalidar_no_commit(fila.chat_id for fila, _ in plano)
             
-            if not atendentes_disponiveis.exists():
-                break
-        
-        if distribuidos > 0:
-            logger.info(f"{distribuidos} atendimentos distribuídos no departamento {departamento.nome}")
+            # Marca filas como atribuídas (update não passa por FilaAtendimento.save)
+            FilaAtendimento.objects.filter(
+                id__in=[fila.id for fila, _ in plano]
+            ).update(atribuido_em=agora)
+            get_posicao_fila_service().remover(
+                departamento.id, [(fila.id, fila.chat_id) for fila, _ in plano]
+            )
+            
+            # bulk_create não passa por Atendimento.save: alimenta o delta-sync
+            # e a carga dos atendentes aqui
+            record_chat_changes(atendimento.id for atendimento in atendimentos)
+            for atendente_id, quantidade in Counter(atendente_id for _, atendente_id in plano).items():
+                indice.incrementar(atendente_id, quantidade)
         
-        return distribuidos
+        return len(filas), len(atendimentos)
+    
+    @staticmethod
+    def proxima_da_fila(departamento_id: int) -> Optional[FilaAtendimento]:
+        """Próxima fila a ser atendida no departamento (uma busca no índice)"""
+        return filas_pendentes(departamento_id).first()
     
     @staticmethod
     def atribuir_manualmente(
@@ -160,12 +259,6 @@ class DistribuicaoAtendimentoService:
         Returns:
             Atendimento criado ou None
         """
-        try:
-            fila = FilaAtendimento.objects.get(id=fila_id, atribuido_em__isnull=True)
-        except FilaAtendimento.DoesNotExist:
-            logger.warning(f"Fila {fila_id} não encontrada ou já atribuída")
-            return None
-        
         from django.contrib.auth import get_user_model
         User = get_user_model()
         
@@ -176,6 +269,14 @@ class DistribuicaoAtendimentoService:
             return None
         
         with transaction.atomic():
+            # Fila sendo atribuída por outro processo conta como já atribuída
+            fila = FilaAtendimento.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                id=fila_id, atribuido_em__isnull=True
+            ).select_related('departamento', 'cliente').first()
+            if not fila:
+                logger.warning(f"Fila {fila_id} não encontrada ou já atribuída")
+                return None
+            
             # Cria atendimento
             atendimento = Atendimento.objects.create(
                 departamento=fila.departamento,
@@ -18,8 +18,8 @@ def encerrar_atendimentos_inativos():
     """
     from atendimento.models import Atendimento
     from core.models import Config
+    from core.event_stream import publish_user_event
     from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
     
     logger.info("[Task] Verificando atendimentos inativos para encerramento automático")
     
@@ -86,10 +86,7 @@ def encerrar_atendimentos_inativos():
                         "version": "v1"
                     }
                     
-                    async_to_sync(channel_layer.group_send)(
-                        f"user_{atendimento.atendente.id}_whatsapp",
-                        {"type": "whatsapp.event", "event": event_payload}
-                    )
+                    publish_user_event(atendimento.atendente_id, event_payload)
                 
                 encerrados += 1
             
@@ -113,3 +110,32 @@ def encerrar_atendimentos_inativos():
         logger.error(f"[Task] Erro no encerramento automático: {e}", exc_info=True)
         raise
 
+
+
+@shared_task
+def distribuir_departamento(departamento_id):
+    """
+    Passada de distribuição agendada por um evento de capacidade.
+    
+    Enfileirada com countdown por atendimento.scheduler (debounce por departamento).
+    """
+    from atendimento.scheduler import get_distribuicao_scheduler
+    
+    distribuidos = get_distribuicao_scheduler().executar(departamento_id)
+    return {'departamento_id': departamento_id, 'distribuidos': distribuidos}
+
+
+@shared_task(bind=True)
+def publicar_dashboard(self, departamento_id):
+    """
+    Publicação do painel ao fim da janela de coalescência (atendimento.dashboard).
+    
+    Se outro snapshot saiu nesse meio tempo, tenta de novo no próximo intervalo.
+    Em modo eager (CELERY_TASK_ALWAYS_EAGER) não há countdown: publica na hora.
+    """
+    from atendimento.dashboard import get_dashboard_service
+    
+    service = get_dashboard_service()
+    if not service.publicar_pendente(departamento_id, forcar=bool(self.request.is_eager)):
+        publicar_dashboard.apply_async(args=[departamento_id], countdown=service.intervalo())
+    return {'departamento_id': departamento_id}
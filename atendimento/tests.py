@@ -0,0 +1,627 @@
+"""
+Testes da distribuição automática de atendimentos.
+"""
+from django.contrib.auth import get_user_model
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.presence_state import PresenceStateService
+from atendimento.availability import get_disponibilidade_index
+from atendimento.dashboard import dashboard_group_name, get_dashboard_service
+from atendimento.models import Atendimento, Departamento, FilaAtendimento
+from atendimento.queue_position import get_posicao_fila_service
+from atendimento.scheduler import get_distribuicao_scheduler
+from atendimento.tasks import publicar_dashboard
+from atendimento.service import filas_pendentes, get_distribuicao_service, planejar_atribuicoes
+from chats.events import chat_group_name
+from chats.models import ChatChange
+from clientes.models import Cliente
+
+User = get_user_model()
+
+
+def ficar_online(*atendentes):
+    """Abre um WebSocket para cada atendente (presença online)"""
+    for atendente in atendentes:
+        PresenceStateService.socket_connected(atendente.id)
+
+
+class DistribuicaoAutomaticaTests(TestCase):
+    """Testes para DistribuicaoAtendimentoService.distribuir_automaticamente"""
+    
+    def setUp(self):
+        cache.clear()
+        self.departamento = Departamento.objects.create(
+            nome='Suporte',
+            max_atendimentos_simultaneos=3
+        )
+        self.atendente1 = User.objects.create_user(username='atendente1', password='pass123')
+        self.atendente2 = User.objects.create_user(username='atendente2', password='pass123')
+        self.departamento.atendentes.add(self.atendente1, self.atendente2)
+        ficar_online(self.atendente1, self.atendente2)
+        self.service = get_distribuicao_service()
+    
+    def _enfileirar(self, quantidade, prioridade='normal', inicio=0):
+        filas = []
+        for i in range(inicio, inicio + quantidade):
+            cliente = Cliente.objects.create(
+                razao_social=f'Cliente {i}',
+                cnpj=f'12.345.678/{i:04d}-90',
+                status='ativo'
+            )
+            filas.append(FilaAtendimento.objects.create(
+                departamento=self.departamento,
+                cliente=cliente,
+                chat_id=f'55119000{i:05d}',
+                numero_whatsapp=f'55119000{i:05d}',
+                prioridade=prioridade
+            ))
+        return filas
+    
+    def test_distribui_pelo_atendente_menos_carregado(self):
+        """Carga existente é considerada e ninguém passa da capacidade"""
+        Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=Cliente.objects.create(razao_social='Ativo', cnpj='98.765.432/0001-10'),
+            atendente=self.atendente2,
+            chat_id='5511888888888',
+            numero_whatsapp='5511888888888',
+            status='em_atendimento'
+        )
+        self._enfileirar(6)
+        
+        distribuidos = self.service.distribuir_automaticamente(self.departamento.id)
+        
+        self.assertEqual(distribuidos, 5)
+        cargas = {
+            atendente.id: atendente.atendimentos_atendente.filter(status='em_atendimento').count()
+            for atendente in (self.atendente1, self.atendente2)
+        }
+        self.assertEqual(cargas, {self.atendente1.id: 3, self.atendente2.id: 3})
+        self.assertEqual(FilaAtendimento.objects.filter(atribuido_em__isnull=True).count(), 1)
+        
+        atendimento = Atendimento.objects.filter(atendente=self.atendente1).first()
+        self.assertIsNotNone(atendimento.iniciado_em)
+        self.assertTrue(ChatChange.objects.filter(atendimento_id=atendimento.id).exists())
+    
+    def test_distribui_por_prioridade(self):
+        """Com capacidade limitada, a fila de maior prioridade é atendida primeiro"""
+        self.departamento.max_atendimentos_simultaneos = 1
+        self.departamento.save()
+        self.departamento.atendentes.remove(self.atendente2)
+        self._enfileirar(2)
+        urgente = self._enfileirar(1, prioridade='urgente', inicio=2)[0]
+        
+        self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 1)
+        
+        urgente.refresh_from_db()
+        self.assertIsNotNone(urgente.atribuido_em)
+    
+    def test_ordem_numerica_de_prioridade(self):
+        """Prioridade ordena pelo peso (urgente > alta > normal > baixa), não alfabeticamente"""
+        baixa = self._enfileirar(1, prioridade='baixa')[0]
+        alta = self._enfileirar(1, prioridade='alta', inicio=1)[0]
+        normal = self._enfileirar(1, prioridade='normal', inicio=2)[0]
+        urgente = self._enfileirar(1, prioridade='urgente', inicio=3)[0]
+        alta2 = self._enfileirar(1, prioridade='alta', inicio=4)[0]
+        
+        self.assertEqual(
+            list(filas_pendentes(self.departamento.id)),
+            [urgente, alta, alta2, normal, baixa]
+        )
+        self.assertEqual(self.service.proxima_da_fila(self.departamento.id), urgente)
+        
+        # Mudança de prioridade recalcula o peso
+        baixa.prioridade = 'urgente'
+        baixa.save(update_fields=['prioridade'])
+        self.assertEqual(self.service.proxima_da_fila(self.departamento.id), baixa)
+    
+    def test_cabeca_da_fila_usa_indice_parcial(self):
+        """A próxima fila é lida do índice fila_pendente_idx, sem ordenação"""
+        self._enfileirar(3)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        
+        plano = filas_pendentes(self.departamento.id)[:1].explain()
+        
+        self.assertIn('fila_pendente_idx', plano)
+        self.assertNotIn('Sort', plano)
+    
+    def test_distribuicao_consultas_constantes(self):
+        """Um lote usa o mesmo número de consultas para 2 ou 6 filas"""
+        self._enfileirar(2)
+        with self.assertNumQueries(9):
+            self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 2)
+        
+        Atendimento.objects.all().update(status='finalizado')
+        # update() em massa não passa por Atendimento.save: descarta a carga em cache
+        get_disponibilidade_index().invalidar([self.atendente1.id, self.atendente2.id])
+        self._enfileirar(6, inicio=2)
+        with self.assertNumQueries(9):
+            self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 6)
+    
+    def test_carga_em_cache_dispensa_contagem(self):
+        """Com a carga no índice, o lote não consulta os atendimentos ativos"""
+        self._enfileirar(1)
+        self.service.distribuir_automaticamente(self.departamento.id)
+        self.assertEqual(
+            get_disponibilidade_index().cargas([self.atendente1.id, self.atendente2.id]),
+            {self.atendente1.id: 1, self.atendente2.id: 0}
+        )
+        
+        self._enfileirar(1, inicio=1)
+        with self.assertNumQueries(8):
+            self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 1)
+    
+    def test_atendente_offline_nao_recebe(self):
+        """Apenas atendentes online e com WebSocket conectado recebem clientes"""
+        PresenceStateService.socket_disconnected(self.atendente1.id)
+        PresenceStateService.set_status(self.atendente2.id, 'away')
+        self._enfileirar(2)
+        
+        self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 0)
+        
+        PresenceStateService.set_status(self.atendente2.id, 'online')
+        self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 2)
+        self.assertEqual(Atendimento.objects.filter(atendente=self.atendente2).count(), 2)
+        self.assertEqual(
+            list(self.departamento.get_atendentes_disponiveis()), [self.atendente2]
+        )
+    
+    def test_carga_acompanha_finalizacao_e_transferencia(self):
+        """Atendimento.save mantém a carga do índice; a liberação vale no commit"""
+        self._enfileirar(2)
+        self.service.distribuir_automaticamente(self.departamento.id)
+        indice = get_disponibilidade_index()
+        atendimento = Atendimento.objects.get(atendente=self.atendente1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            atendimento.atendente = self.atendente2
+            atendimento.save()
+            # Antes do commit a vaga de origem continua ocupada
+            self.assertEqual(indice.cargas([self.atendente1.id])[self.atendente1.id], 1)
+        self.assertEqual(
+            indice.cargas([self.atendente1.id, self.atendente2.id]),
+            {self.atendente1.id: 0, self.atendente2.id: 2}
+        )
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            atendimento.finalizar()
+        self.assertEqual(indice.cargas([self.atendente2.id])[self.atendente2.id], 1)
+    
+    @override_settings(DISTRIBUICAO_BATCH_SIZE=2)
+    def test_distribuicao_em_lotes(self):
+        """A fila é drenada em vários lotes até acabar a capacidade"""
+        self._enfileirar(7)
+        
+        self.assertEqual(self.service.distribuir_automaticamente(self.departamento.id), 6)
+        self.assertEqual(FilaAtendimento.objects.filter(atribuido_em__isnull=True).count(), 1)
+    
+    def test_planejar_atribuicoes_sem_capacidade(self):
+        """Atendentes lotados não recebem filas"""
+        plano = planejar_atribuicoes(['a', 'b'], [(1, 3), (2, 3)], capacidade=3)
+        self.assertEqual(plano, [])
+        
+        plano = planejar_atribuicoes(['a', 'b', 'c'], [(1, 2), (2, 0)], capacidade=3)
+        self.assertEqual(plano, [('a', 2), ('b', 2), ('c', 1)])
+
+
+class DistribuicaoAgendadaTests(TestCase):
+    """Testes da distribuição disparada por eventos de capacidade (atendimento.scheduler)"""
+    
+    def setUp(self):
+        cache.clear()
+        self.departamento = Departamento.objects.create(
+            nome='Suporte',
+            max_atendimentos_simultaneos=1
+        )
+        self.atendente1 = User.objects.create_user(username='atendente1', password='pass123')
+        self.departamento.atendentes.add(self.atendente1)
+        ficar_online(self.atendente1)
+        self.ocupado = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=Cliente.objects.create(razao_social='Ativo', cnpj='98.765.432/0001-10'),
+            atendente=self.atendente1,
+            chat_id='5511888888888',
+            numero_whatsapp='5511888888888',
+            status='em_atendimento'
+        )
+    
+    _enfileirar = DistribuicaoAutomaticaTests._enfileirar
+    
+    @override_settings(DISTRIBUICAO_DEBOUNCE_SECONDS=0)
+    def test_finalizar_distribui_fila(self):
+        """A vaga liberada ao finalizar é ocupada pelo próximo da fila no commit"""
+        fila = self._enfileirar(1)[0]
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ocupado.finalizar()
+        
+        fila.refresh_from_db()
+        self.assertIsNotNone(fila.atribuido_em)
+        self.assertTrue(
+            Atendimento.objects.filter(chat_id=fila.chat_id, atendente=self.atendente1).exists()
+        )
+        # A passada libera o debounce para o próximo evento
+        self.assertIsNone(cache.get(get_distribuicao_scheduler()._key(self.departamento.id)))
+    
+    def test_transacao_desfeita_nao_bloqueia_departamento(self):
+        """Evento de uma transação desfeita não toma a chave de debounce"""
+        self._enfileirar(1)
+        scheduler = get_distribuicao_scheduler()
+        
+        with patch('atendimento.tasks.distribuir_departamento.apply_async') as apply_async:
+            try:
+                with transaction.atomic():
+                    scheduler.agendar(self.departamento.id, 'teste')
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+            self.assertIsNone(cache.get(scheduler._key(self.departamento.id)))
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                scheduler.agendar(self.departamento.id, 'teste')
+        
+        apply_async.assert_called_once_with(args=[self.departamento.id], countdown=2)
+    
+    def test_eventos_agrupados_por_departamento(self):
+        """Eventos na janela de debounce enfileiram uma única passada"""
+        self._enfileirar(2)
+        segundo = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=self.ocupado.cliente,
+            atendente=self.atendente1,
+            chat_id='5511777777777',
+            numero_whatsapp='5511777777777',
+            status='em_atendimento'
+        )
+        
+        with patch('atendimento.tasks.distribuir_departamento.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ocupado.finalizar()
+                segundo.cancelar('teste')
+                PresenceStateService.set_status(self.atendente1.id, 'online')
+        
+        apply_async.assert_called_once_with(args=[self.departamento.id], countdown=2)
+    
+    def test_sem_fila_nao_agenda(self):
+        """Departamentos sem clientes aguardando não recebem passada"""
+        with patch('atendimento.tasks.distribuir_departamento.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ocupado.finalizar()
+        
+        apply_async.assert_not_called()
+    
+    def test_presenca_agenda_somente_ao_ficar_online(self):
+        """Apenas a transição para online agenda distribuição"""
+        scheduler = get_distribuicao_scheduler()
+        with patch.object(scheduler, 'agendar_para_atendente') as agendar:
+            PresenceStateService.set_status(self.atendente1.id, 'away')
+            PresenceStateService.set_status(self.atendente1.id, 'online')
+            PresenceStateService.set_status(self.atendente1.id, 'online')
+        
+        agendar.assert_called_once_with(self.atendente1.id, 'online')
+    
+    @override_settings(DISTRIBUICAO_DEBOUNCE_SECONDS=0)
+    def test_aumento_de_capacidade_distribui(self):
+        """Editar max_atendimentos_simultaneos distribui a fila do departamento"""
+        fila = self._enfileirar(1)[0]
+        client = APIClient()
+        client.force_authenticate(user=self.atendente1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/v1/atendimento/departamentos/{self.departamento.id}/',
+                {'max_atendimentos_simultaneos': 2},
+                format='json'
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        fila.refresh_from_db()
+        self.assertIsNotNone(fila.atribuido_em)
+
+
+class PosicaoFilaTests(TestCase):
+    """Testes da posição na fila e ETA (atendimento.queue_position)"""
+    
+    def setUp(self):
+        cache.clear()
+        self.posicoes = get_posicao_fila_service()
+        self.posicoes._backend = None  # conjunto ordenado novo (memória do processo)
+        self.departamento = Departamento.objects.create(
+            nome='Suporte',
+            max_atendimentos_simultaneos=3
+        )
+        self.atendente1 = User.objects.create_user(username='atendente1', password='pass123')
+        self.departamento.atendentes.add(self.atendente1)
+        ficar_online(self.atendente1)
+    
+    _enfileirar = DistribuicaoAutomaticaTests._enfileirar
+    
+    def _enfileirar_no_commit(self, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._enfileirar(*args, **kwargs)
+    
+    def test_posicao_segue_prioridade_e_eta(self):
+        """Posição respeita a ordem de atendimento; ETA = posição x TMA / vagas online"""
+        normal = self._enfileirar_no_commit(1)[0]
+        urgente = self._enfileirar_no_commit(1, prioridade='urgente', inicio=1)[0]
+        baixa = self._enfileirar_no_commit(1, prioridade='baixa', inicio=2)[0]
+        
+        posicoes = {
+            fila.chat_id: self.posicoes.posicao(fila.chat_id)['posicao']
+            for fila in (normal, urgente, baixa)
+        }
+        self.assertEqual(posicoes, {urgente.chat_id: 1, normal.chat_id: 2, baixa.chat_id: 3})
+        
+        dados = self.posicoes.posicao(normal.chat_id)
+        self.assertEqual(dados['total'], 3)
+        # TMA padrão de 600s dividido por 3 vagas (1 atendente online x capacidade 3)
+        self.assertEqual(dados['eta_segundos'], 400)
+    
+    def test_posicao_reconstruida_do_banco(self):
+        """Sem o conjunto em memória (outro processo, Redis reiniciado), a posição vem do banco"""
+        filas = self._enfileirar(2)
+        
+        self.assertEqual(self.posicoes.posicao(filas[1].chat_id)['posicao'], 2)
+        self.assertIsNone(self.posicoes.posicao('5511000000000'))
+    
+    def test_atribuicao_publica_novas_posicoes(self):
+        """Quem anda na fila recebe queue_position; quem foi atribuído recebe posição nula"""
+        self.departamento.max_atendimentos_simultaneos = 1
+        self.departamento.save()
+        primeira, segunda = self._enfileirar_no_commit(2)
+        
+        channel_layer = get_channel_layer()
+        canais = {}
+        for fila in (primeira, segunda):
+            canais[fila.chat_id] = async_to_sync(channel_layer.new_channel)()
+            async_to_sync(channel_layer.group_add)(chat_group_name(fila.chat_id), canais[fila.chat_id])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            get_distribuicao_service().distribuir_automaticamente(self.departamento.id)
+        
+        evento = async_to_sync(channel_layer.receive)(canais[primeira.chat_id])
+        self.assertEqual(evento['event'], 'queue_position')
+        self.assertIsNone(evento['data']['posicao'])
+        
+        evento = async_to_sync(channel_layer.receive)(canais[segunda.chat_id])
+        self.assertEqual(evento['data']['posicao'], 1)
+        self.assertEqual(evento['data']['total'], 1)
+        self.assertIsNone(self.posicoes.posicao(primeira.chat_id))
+    
+    def test_posicao_sem_consultas_com_cache_quente(self):
+        """Membros e capacidade do departamento vêm do cache em posicao()"""
+        fila = self._enfileirar_no_commit(1)[0]
+        self.posicoes.posicao(fila.chat_id)
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(self.posicoes.posicao(fila.chat_id)['eta_segundos'], 200)
+    
+    def test_gravacao_sem_mudar_ordem_nao_publica(self):
+        """Salvar uma fila sem alterar prioridade nem entrada não republica posições"""
+        fila = self._enfileirar_no_commit(1)[0]
+        
+        with patch.object(self.posicoes, '_publicar') as publicar:
+            with self.captureOnCommitCallbacks(execute=True):
+                fila.mensagem_inicial = 'Cliente retornou'
+                fila.save()
+            publicar.assert_not_called()
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                fila.prioridade = 'urgente'
+                fila.save()
+            publicar.assert_called_once_with(self.departamento.id, 0)
+    
+    def test_finalizar_atualiza_tempo_medio(self):
+        """A duração dos atendimentos finalizados alimenta a média móvel do departamento"""
+        atendimento = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=Cliente.objects.create(razao_social='Ativo', cnpj='98.765.432/0001-10'),
+            atendente=self.atendente1,
+            chat_id='5511888888888',
+            numero_whatsapp='5511888888888',
+            status='em_atendimento',
+            iniciado_em=timezone.now() - timedelta(seconds=300)
+        )
+        atendimento.finalizar()
+        
+        self.assertAlmostEqual(self.posicoes.tempo_medio_atendimento(self.departamento.id), 300, delta=1)
+    
+    def test_endpoint_posicao(self):
+        """GET /filas/posicao/?chat_id= devolve posição e ETA"""
+        fila = self._enfileirar_no_commit(1)[0]
+        client = APIClient()
+        client.force_authenticate(user=self.atendente1)
+        url = '/api/v1/atendimento/filas/posicao/'
+        
+        response = client.get(url, {'chat_id': fila.chat_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['posicao'], 1)
+        self.assertEqual(response.data['departamento_id'], self.departamento.id)
+        
+        self.assertEqual(client.get(url, {'chat_id': '5511000000000'}).status_code, 404)
+        self.assertEqual(client.get(url).status_code, 400)
+
+
+class DashboardTests(TestCase):
+    """Testes do painel por departamento (atendimento.dashboard)"""
+    
+    def setUp(self):
+        cache.clear()
+        get_posicao_fila_service()._backend = None
+        self.dashboard = get_dashboard_service()
+        self.departamento = Departamento.objects.create(
+            nome='Suporte',
+            max_atendimentos_simultaneos=2
+        )
+        self.atendente1 = User.objects.create_user(username='atendente1', password='pass123')
+        self.atendente2 = User.objects.create_user(username='atendente2', password='pass123')
+        self.departamento.atendentes.add(self.atendente1, self.atendente2)
+        ficar_online(self.atendente1, self.atendente2)
+    
+    _enfileirar = DistribuicaoAutomaticaTests._enfileirar
+    
+    def test_snapshot_sem_consultas_com_cache_quente(self):
+        """Fila, ativos e atendentes vêm do cache compartilhado"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self._enfileirar(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            get_distribuicao_service().distribuir_automaticamente(self.departamento.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._enfileirar(1, inicio=3)
+        self.dashboard.snapshot(self.departamento.id)
+        
+        with self.assertNumQueries(0):
+            snapshot = self.dashboard.snapshot(self.departamento.id)
+        
+        self.assertEqual(snapshot['fila'], 1)
+        self.assertEqual(snapshot['atendimentos_ativos'], 3)
+        self.assertEqual(snapshot['atendentes_online'], 2)
+        self.assertEqual(snapshot['atendentes_ocupados'], 2)
+    
+    def test_contador_de_ativos_segue_atendimentos(self):
+        """Criar e finalizar atendimentos ajusta o contador sem recontar"""
+        self.assertEqual(self.dashboard.ativos(self.departamento.id), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            atendimento = Atendimento.objects.create(
+                departamento=self.departamento,
+                cliente=Cliente.objects.create(razao_social='Ativo', cnpj='98.765.432/0001-10'),
+                atendente=self.atendente1,
+                chat_id='5511888888888',
+                numero_whatsapp='5511888888888',
+                status='em_atendimento',
+                iniciado_em=timezone.now()
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.dashboard.ativos(self.departamento.id), 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            atendimento.finalizar()
+        self.assertEqual(self.dashboard.ativos(self.departamento.id), 0)
+    
+    @patch('atendimento.tasks.publicar_dashboard.apply_async')
+    def test_rajada_publica_um_snapshot_por_janela(self, apply_async):
+        """O primeiro evento publica na hora; os demais viram uma única publicação ao fim da janela"""
+        channel_layer = get_channel_layer()
+        canal = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(dashboard_group_name(self.departamento.id), canal)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._enfileirar(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._enfileirar(4, inicio=1)
+        
+        evento = async_to_sync(channel_layer.receive)(canal)
+        self.assertEqual(evento['event'], 'dashboard_snapshot')
+        self.assertEqual(evento['data']['departamento_id'], self.departamento.id)
+        apply_async.assert_called_once_with(args=[self.departamento.id], countdown=1)
+        
+        # Ainda dentro da janela: a task adia; ao fim dela, publica o estado final
+        self.assertFalse(self.dashboard.publicar_pendente(self.departamento.id))
+        cache.delete(f'dashboard:{self.departamento.id}:janela')
+        self.assertTrue(self.dashboard.publicar_pendente(self.departamento.id))
+        
+        evento = async_to_sync(channel_layer.receive)(canal)
+        self.assertEqual(evento['data']['fila'], 5)
+    
+    def test_modo_eager_publica_pendente_na_hora(self):
+        """Com CELERY_TASK_ALWAYS_EAGER a task roda sem countdown e publica o estado final"""
+        channel_layer = get_channel_layer()
+        canal = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(dashboard_group_name(self.departamento.id), canal)
+        
+        conf = publicar_dashboard.app.conf
+        self.addCleanup(setattr, conf, 'task_always_eager', conf.task_always_eager)
+        conf.task_always_eager = True
+        
+        self.dashboard.notificar(self.departamento.id)
+        self.dashboard.notificar(self.departamento.id)
+        
+        for _ in range(2):
+            evento = async_to_sync(channel_layer.receive)(canal)
+            self.assertEqual(evento['event'], 'dashboard_snapshot')
+        self.assertIsNone(cache.get(f'dashboard:{self.departamento.id}:pendente'))
+    
+    def test_endpoint_dashboard(self):
+        """GET /departamentos/{id}/dashboard/ devolve o snapshot"""
+        client = APIClient()
+        client.force_authenticate(user=self.atendente1)
+        
+        response = client.get(f'/api/v1/atendimento/departamentos/{self.departamento.id}/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['atendentes_online'], 2)
+
+
+class DistribuicaoConcorrenteTests(TransactionTestCase):
+    """Vários distribuidores em paralelo no mesmo departamento (Postgres real)"""
+    
+    THREADS = 8
+    
+    def setUp(self):
+        cache.clear()
+        self.departamento = Departamento.objects.create(
+            nome='Suporte',
+            max_atendimentos_simultaneos=6
+        )
+        atendentes = [
+            User.objects.create_user(username=f'atendente{i}', password='pass123')
+            for i in range(5)
+        ]
+        self.departamento.atendentes.add(*atendentes)
+        ficar_online(*atendentes)
+        for i in range(40):
+            cliente = Cliente.objects.create(
+                razao_social=f'Cliente {i}',
+                cnpj=f'12.345.678/{i:04d}-90',
+                status='ativo'
+            )
+            FilaAtendimento.objects.create(
+                departamento=self.departamento,
+                cliente=cliente,
+                chat_id=f'55119000{i:05d}',
+                numero_whatsapp=f'55119000{i:05d}'
+            )
+    
+    @override_settings(DISTRIBUICAO_BATCH_SIZE=3)
+    def test_distribuidores_paralelos_sem_atribuicao_dupla(self):
+        """Nenhuma fila é atribuída duas vezes e ninguém passa da capacidade"""
+        barreira = threading.Barrier(self.THREADS)
+        resultados, erros = [], []
+        
+        def distribuir():
+            try:
+                barreira.wait()
+                resultados.append(
+                    get_distribuicao_service().distribuir_automaticamente(self.departamento.id)
+                )
+            except Exception as e:  # pragma: no cover - reportado abaixo
+                erros.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=distribuir) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(erros, [])
+        # 5 atendentes x capacidade 6 = 30 vagas para 40 filas
+        self.assertEqual(sum(resultados), 30)
+        self.assertEqual(Atendimento.objects.count(), 30)
+        self.assertEqual(
+            Atendimento.objects.values('chat_id').distinct().count(), 30
+        )
+        self.assertEqual(FilaAtendimento.objects.filter(atribuido_em__isnull=False).count(), 30)
+        for atendente in self.departamento.atendentes.all():
+            self.assertLessEqual(atendente.atendimentos_atendente.count(), 6)
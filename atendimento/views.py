@@ -8,7 +8,7 @@ from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 
-from .models import Departamento, FilaAtendimento, Atendimento, TransferenciaAtendimento
+from .models import ORDEM_FILA, Departamento, FilaAtendimento, Atendimento, TransferenciaAtendimento
 from .serializers import (
     DepartamentoSerializer,
     FilaAtendimentoSerializer,
@@ -17,7 +17,11 @@ from .serializers import (
     TransferenciaAtendimentoSerializer,
     TransferirAtendimentoSerializer
 )
+from .dashboard import get_dashboard_service
+from .queue_position import get_posicao_fila_service
+from .scheduler import get_distribuicao_scheduler
 from .service import get_distribuicao_service
+from core.event_stream import publish_user_event
 
 
 class DepartamentoViewSet(viewsets.ModelViewSet):
@@ -29,6 +33,24 @@ class DepartamentoViewSet(viewsets.ModelViewSet):
     filterset_fields = ['ativo']
     search_fields = ['nome', 'descricao']
     ordering = ['nome']
+    
+    # Campos cuja alteração pode abrir vagas para a fila
+    CAMPOS_CAPACIDADE = ('max_atendimentos_simultaneos', 'atendentes', 'ativo')
+    
+    def perform_update(self, serializer):
+        departamento = serializer.save()
+        if departamento.ativo and any(campo in serializer.validated_data for campo in self.CAMPOS_CAPACIDADE):
+            get_distribuicao_scheduler().agendar(departamento.id, 'departamento_atualizado')
+        if any(campo in serializer.validated_data for campo in ('atendentes', 'ativo')):
+            get_dashboard_service().invalidar_membros(departamento.id)
+        if 'max_atendimentos_simultaneos' in serializer.validated_data:
+            get_posicao_fila_service().invalidar_capacidade(departamento.id)
+    
+    @action(detail=True, methods=['get'])
+    def dashboard(self, request, pk=None):
+        """Snapshot atual do painel do departamento (o mesmo enviado pelo WebSocket)"""
+        departamento = self.get_object()
+        return Response(get_dashboard_service().snapshot(departamento.id))
 
 
 class FilaAtendimentoViewSet(viewsets.ModelViewSet):
@@ -38,8 +60,8 @@ class FilaAtendimentoViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['departamento', 'prioridade']
-    ordering_fields = ['entrou_na_fila_em', 'prioridade']
-    ordering = ['-prioridade', 'entrou_na_fila_em']
+    ordering_fields = ['entrou_na_fila_em', 'prioridade', 'prioridade_rank']
+    ordering = ORDEM_FILA
     
     @action(detail=False, methods=['post'], url_path='distribuir')
     def distribuir(self, request):
@@ -59,6 +81,26 @@ class FilaAtendimentoViewSet(viewsets.ModelViewSet):
             'message': f'{distribuidos} atendimentos distribuídos',
             'distribuidos': distribuidos
         }, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['get'], url_path='posicao')
+    def posicao(self, request):
+        """Posição na fila e tempo estimado de espera de um chat (?chat_id=)"""
+        chat_id = request.query_params.get('chat_id')
+        
+        if not chat_id:
+            return Response(
+                {'error': 'chat_id é obrigatório'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dados = get_posicao_fila_service().posicao(chat_id)
+        if dados is None:
+            return Response(
+                {'error': 'Chat não está aguardando na fila'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return Response(dados, status=status.HTTP_200_OK)
 
 
 class AtendimentoViewSet(viewsets.ModelViewSet):
@@ -144,7 +186,6 @@ class AtendimentoViewSet(viewsets.ModelViewSet):
         from django.contrib.auth import get_user_model
         from django.db import transaction
         from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
         
         logger = logging.getLogger(__name__)
         User = get_user_model()
@@ -233,6 +274,10 @@ class AtendimentoViewSet(viewsets.ModelViewSet):
                 f"{atendente_destino.username} "
                 f"(motivo: {motivo[:50]}...)"
             )
+            
+            # A saída do atendimento libera uma vaga do atendente de origem
+            if atendente_origem:
+                get_distribuicao_scheduler().agendar_para_atendente(atendente_origem.id, 'transferido')
         
         # Emite evento WebSocket para atendente destino (Issue #38)
         channel_layer = get_channel_layer()
@@ -250,10 +295,7 @@ class AtendimentoViewSet(viewsets.ModelViewSet):
                 "version": "v1"
             }
             
-            async_to_sync(channel_layer.group_send)(
-                f"user_{atendente_destino.id}_whatsapp",
-                {"type": "whatsapp.event", "event": event_payload}
-            )
+            publish_user_event(atendente_destino.id, event_payload)
             
             logger.info(f"Notificação de transferência enviada para {atendente_destino.username}")
         
@@ -0,0 +1,95 @@
+"""
+Atendimento ativo de cada chat no cache compartilhado.
+
+Toda mensagem recebida precisa do atendimento ativo do chat
+(ChatService.processar_nova_mensagem_recebida). Em vez de consultar
+Atendimento por chat_id e status a cada mensagem, os campos usados na
+ingestão ficam em cache por chat; a consulta ao banco só acontece quando o
+chat não está no cache.
+
+A entrada é descartada no commit de qualquer gravação que mude atendente,
+departamento ou status do atendimento (Atendimento.save: finalizar,
+cancelar, transferir, aceitar) e quando o distribuidor cria atendimentos em
+lote. CHAT_ATIVO_CACHE_TTL_SECONDS limita o tempo de vida de uma entrada
+que escape dessas invalidações (atualizações em massa).
+
+obter() devolve um ConversaAtiva imutável com esses campos; quem precisa
+gravar no atendimento ou ler outros campos carrega o modelo pelo id.
+
+Chave:
+- chat_ativo:{chat_id}              campos do atendimento ativo
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from atendimento.models import Atendimento
+
+KEY_PREFIX = 'chat_ativo'
+
+# Status de atendimento que mantêm a conversa aberta
+STATUS_ATIVOS = ('aguardando', 'em_atendimento', 'pausado')
+
+# Campos do atendimento guardados no cache (os usados na ingestão de mensagens)
+CAMPOS = ('id', 'chat_id', 'atendente_id', 'departamento_id', 'status', 'criado_em')
+
+
+@dataclass(frozen=True)
+class ConversaAtiva:
+    """Campos do atendimento ativo de um chat (CAMPOS), como guardados no cache"""
+    id: int
+    chat_id: str
+    atendente_id: Optional[int]
+    departamento_id: int
+    status: str
+    criado_em: datetime
+
+
+class ConversaAtivaService:
+    """Atendimento ativo por chat_id"""
+
+    @staticmethod
+    def ttl() -> int:
+        return getattr(settings, 'CHAT_ATIVO_CACHE_TTL_SECONDS', 300)
+
+    @staticmethod
+    def _key(chat_id: str) -> str:
+        return f"{KEY_PREFIX}:{chat_id}"
+
+    @staticmethod
+    def obter(chat_id: str) -> Optional[ConversaAtiva]:
+        """Atendimento ativo do chat (somente CAMPOS), ou None"""
+        key = ConversaAtivaService._key(chat_id)
+        valores = cache.get(key)
+        if valores is None:
+            valores = Atendimento.objects.filter(
+                chat_id=chat_id, status__in=STATUS_ATIVOS
+            ).values_list(*CAMPOS).first()
+            if valores is None:
+                # Chat novo: não guarda a ausência, o atendimento será criado em seguida
+                return None
+            # Só no commit: uma linha lida dentro de uma transação desfeita não vai ao cache
+            transaction.on_commit(lambda: cache.set(key, valores, timeout=ConversaAtivaService.ttl()))
+        return ConversaAtiva(*valores)
+
+    @staticmethod
+    def invalidar(chat_ids: Iterable[str]) -> None:
+        """Descarta o atendimento ativo em cache dos chats"""
+        cache.delete_many([ConversaAtivaService._key(chat_id) for chat_id in chat_ids])
+
+    @staticmethod
+    def invalidar_no_commit(chat_ids: Iterable[str]) -> None:
+        chat_ids = list(chat_ids)
+        transaction.on_commit(lambda: ConversaAtivaService.invalidar(chat_ids))
+
+
+_conversa_ativa_service = ConversaAtivaService()
+
+
+def get_conversa_ativa_service() -> ConversaAtivaService:
+    """Retorna instância global do serviço"""
+    return _conversa_ativa_service
@@ -0,0 +1,190 @@
+"""
+Delta-sync da API de chats (GET /chats/changes/?since=<token>).
+
+Cada gravação de Atendimento ou WhatsAppMessage que altera um campo exibido
+pela API (CAMPOS_ATENDIMENTO / CAMPOS_MENSAGEM) anexa uma linha em
+ChatChange; mensagens novas entram quando o ChatService as contabiliza, na
+transação da ingestão. O token opaco guarda o último seq entregue, o limite de transações da leitura
+e o instante em que foi emitido. O cliente recebe apenas os atendimentos e
+mensagens alterados desde o token, ou reset=true quando o token é anterior à
+retenção do log (CHAT_CHANGES_RETENTION_HOURS) e é preciso recarregar a
+lista completa.
+
+Um seq menor pode ficar visível depois de um maior (a transação que o gravou
+ainda estava aberta). Por isso o token guarda também o xid da transação mais
+antiga invisível à leitura (snapshot_bound): toda linha que a leitura não
+viu tem xid >= esse limite e é entregue na chamada seguinte, seja qual for o
+seq. Reentregas são inofensivas, pois o cliente aplica o estado atual de
+cada linha.
+"""
+import base64
+import binascii
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import ChatChange
+
+
+def _retention() -> timedelta:
+    return timedelta(hours=getattr(settings, 'CHAT_CHANGES_RETENTION_HOURS', 24))
+
+
+def _max_rows() -> int:
+    return getattr(settings, 'CHAT_CHANGES_MAX_ROWS', 1000)
+
+
+# Campos exibidos pela API de chats; save(update_fields=...) sem nenhum deles não entra no log
+CAMPOS_ATENDIMENTO = frozenset({
+    'status', 'prioridade', 'atendente', 'atendente_id', 'departamento', 'departamento_id',
+    'cliente', 'cliente_id', 'numero_whatsapp',
+})
+CAMPOS_MENSAGEM = frozenset({
+    'atendimento', 'atendimento_id', 'status', 'text_content', 'media_url', 'media_mime_type',
+    'contact_name', 'sent_at', 'delivered_at', 'read_at',
+})
+
+
+def altera_campos(update_fields: Optional[Iterable[str]], campos: frozenset) -> bool:
+    """True se um save() com esses update_fields (None: todos) grava algum dos campos"""
+    return update_fields is None or not campos.isdisjoint(update_fields)
+
+
+def record_chat_change(atendimento_id: Optional[int] = None, mensagem_id: Optional[int] = None) -> None:
+    """Anexa uma alteração ao log (chamado nas gravações de Atendimento e WhatsAppMessage)"""
+    if atendimento_id is None and mensagem_id is None:
+        return
+    ChatChange.objects.create(atendimento_id=atendimento_id, mensagem_id=mensagem_id)
+
+
+def record_chat_changes(atendimento_ids: Iterable[int]) -> None:
+    """Anexa uma alteração por atendimento com um único INSERT (gravações em lote)"""
+    ChatChange.objects.bulk_create([ChatChange(atendimento_id=pk) for pk in atendimento_ids])
+
+
+def encode_token(seq: int, xid: int, page: Optional[Tuple[int, int]] = None,
+                 issued_at: Optional[float] = None) -> str:
+    """
+    Token de (seq, xid); page = (último seq da página, xid da próxima
+    leitura) enquanto houver páginas pendentes da mesma leitura.
+    """
+    page_seq, page_xid = page or (0, 0)
+    issued_at = int(issued_at if issued_at is not None else time.time())
+    raw = f"v2:{seq}:{xid}:{page_seq}:{page_xid}:{issued_at}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token: str) -> Optional[Tuple[Tuple[int, int, Optional[Tuple[int, int]]], float]]:
+    """((seq, xid, page), emitido_em) do token, ou None se inválido"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        version, seq, xid, page_seq, page_xid, issued_at = (
+            base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        )
+        if version != 'v2':
+            return None
+        page = (int(page_seq), int(page_xid)) if int(page_seq) else None
+        return (int(seq), int(xid), page), float(issued_at)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def snapshot_bound() -> int:
+    """
+    xid da transação mais antiga invisível ao snapshot atual.
+
+    Linhas com xid menor já estão visíveis (confirmadas ou da própria
+    transação); as que ainda não aparecem têm xid maior ou igual.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT COALESCE(
+                (SELECT MIN(x::text::bigint) FROM pg_snapshot_xip(s) AS x),
+                pg_snapshot_xmax(s)::text::bigint
+            )
+            FROM pg_current_snapshot() AS s
+        """)
+        return cursor.fetchone()[0]
+
+
+class ChatChangeService:
+    """Leitura do log de alterações para o delta-sync"""
+
+    @staticmethod
+    def current_token() -> str:
+        """Token para quem acabou de carregar a lista completa"""
+        # O limite vem antes do seq: o que a leitura do seq não vê fica acima dele
+        xid = snapshot_bound()
+        seq = ChatChange.objects.aggregate(Max('seq'))['seq__max'] or 0
+        return encode_token(seq, xid)
+
+    @staticmethod
+    def is_expired(issued_at: float) -> bool:
+        """Token mais antigo que a retenção do log: alterações podem ter sido podadas"""
+        age = timedelta(seconds=max(0.0, time.time() - issued_at))
+        return age > _retention()
+
+    @staticmethod
+    def changes_since(cursor: Tuple[int, int, Optional[Tuple[int, int]]]) -> Dict:
+        """
+        Alterações com seq > seq do token ou gravadas por transações que a
+        leitura anterior não via (xid >= xid do token).
+
+        Returns:
+            {'atendimento_ids', 'mensagem_ids', 'token', 'has_more'}
+        """
+        seq, xid, page = cursor
+        if page:
+            page_seq, next_xid = page
+        else:
+            page_seq, next_xid = 0, snapshot_bound()
+
+        limit = _max_rows()
+        rows = list(
+            ChatChange.objects.filter(Q(seq__gt=seq) | Q(xid__gte=xid), seq__gt=page_seq)
+            .order_by('seq')
+            .values_list('seq', 'atendimento_id', 'mensagem_id')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        atendimento_ids: Set[int] = set()
+        mensagem_ids: Set[int] = set()
+        for _seq, atendimento_id, mensagem_id in rows:
+            if atendimento_id is not None:
+                atendimento_ids.add(atendimento_id)
+            if mensagem_id is not None:
+                mensagem_ids.add(mensagem_id)
+
+        last_seq = max(seq, page_seq, rows[-1][0] if rows else 0)
+        if has_more:
+            # Próxima página da mesma leitura, com o limite calculado na primeira
+            token = encode_token(seq, xid, page=(last_seq, next_xid))
+        else:
+            token = encode_token(last_seq, next_xid)
+
+        return {
+            'atendimento_ids': atendimento_ids,
+            'mensagem_ids': mensagem_ids,
+            'token': token,
+            'has_more': has_more,
+        }
+
+    @staticmethod
+    def prune() -> int:
+        """Remove alterações mais antigas que a retenção"""
+        deleted, _ = ChatChange.objects.filter(criado_em__lt=timezone.now() - _retention()).delete()
+        return deleted
+
+
+_change_service = ChatChangeService()
+
+
+def get_chat_change_service() -> ChatChangeService:
+    """Retorna instância global do serviço"""
+    return _change_service
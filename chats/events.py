@@ -0,0 +1,88 @@
+"""
+Eventos em tempo real por conversa (tópico chat_{chat_id}).
+
+Os sockets que estão com uma conversa aberta se inscrevem no grupo do chat
+(via mensagem {"type": "subscribe", "chat_id": ...} no WhatsAppConsumer) e
+recebem cada mensagem persistida e cada mudança de status, sem polling.
+"""
+import logging
+import re
+from typing import Dict
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+# Nomes de grupo do channel layer aceitam apenas ASCII alfanumérico, "-", "_" e "."
+_GROUP_INVALID_CHARS = re.compile(r'[^0-9A-Za-z_.\-]')
+_GROUP_MAX_LENGTH = 99
+
+
+def chat_group_name(chat_id: str) -> str:
+    """Retorna o nome do grupo do channel layer para um chat_id"""
+    safe_chat_id = _GROUP_INVALID_CHARS.sub('_', str(chat_id))
+    return f"chat_{safe_chat_id}"[:_GROUP_MAX_LENGTH]
+
+
+def build_message_data(mensagem) -> Dict:
+    """Serializa a mensagem no mesmo formato de GET /chats/{chat_id}/messages/"""
+    from .serializers import ChatMessageSerializer
+    return dict(ChatMessageSerializer(mensagem).data)
+
+
+def build_status_data(mensagem) -> Dict:
+    """Dados mínimos para atualização de status de uma mensagem"""
+    return {
+        'chat_id': mensagem.chat_id,
+        'message_id': mensagem.message_id,
+        'status': mensagem.status,
+        'sent_at': mensagem.sent_at.isoformat() if mensagem.sent_at else None,
+        'delivered_at': mensagem.delivered_at.isoformat() if mensagem.delivered_at else None,
+        'read_at': mensagem.read_at.isoformat() if mensagem.read_at else None,
+    }
+
+
+def emit_chat_event(chat_id: str, event: str, data: Dict) -> None:
+    """Envia evento para todos os sockets inscritos no chat"""
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+
+    try:
+        async_to_sync(channel_layer.group_send)(
+            chat_group_name(chat_id),
+            {'type': 'chat.event', 'event': event, 'data': data}
+        )
+    except Exception as e:
+        logger.error(f"Erro ao emitir evento '{event}' para chat {chat_id}: {e}")
+
+
+async def aemit_chat_event(chat_id: str, event: str, data: Dict) -> None:
+    """Versão async de emit_chat_event"""
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+
+    try:
+        await channel_layer.group_send(
+            chat_group_name(chat_id),
+            {'type': 'chat.event', 'event': event, 'data': data}
+        )
+    except Exception as e:
+        logger.error(f"Erro ao emitir evento '{event}' para chat {chat_id}: {e}")
+
+
+async def aemit_chat_message(mensagem) -> None:
+    """Publica uma mensagem persistida (inbound ou outbound) no tópico do chat"""
+    try:
+        data = await sync_to_async(build_message_data)(mensagem)
+    except Exception as e:
+        logger.error(f"Erro ao serializar mensagem {mensagem.message_id} para o chat: {e}")
+        return
+    await aemit_chat_event(mensagem.chat_id, 'chat_message', data)
+
+
+async def aemit_chat_message_status(mensagem) -> None:
+    """Publica a mudança de status de uma mensagem no tópico do chat"""
+    await aemit_chat_event(mensagem.chat_id, 'chat_message_status', build_status_data(mensagem))
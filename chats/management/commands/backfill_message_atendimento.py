@@ -0,0 +1,80 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+
+from atendimento.models import Atendimento
+from whatsapp.models import WhatsAppMessage
+
+# Cada mensagem sem vínculo recebe o atendimento mais recente do mesmo chat
+# criado até (created_at + tolerância). A tolerância cobre a mensagem que abre
+# a conversa, gravada instantes antes do atendimento que ela cria.
+BACKFILL_SQL = """
+UPDATE {messages} AS m
+   SET atendimento_id = v.atendimento_id
+  FROM (
+       SELECT msg.id,
+              (SELECT a.id
+                 FROM {atendimentos} AS a
+                WHERE a.chat_id = msg.chat_id
+                  AND a.criado_em <= msg.created_at + %s
+                ORDER BY a.criado_em DESC
+                LIMIT 1) AS atendimento_id
+         FROM {messages} AS msg
+        WHERE msg.id >= %s
+          AND msg.id < %s
+          AND msg.atendimento_id IS NULL
+       ) AS v
+ WHERE m.id = v.id
+   AND v.atendimento_id IS NOT NULL
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Preenche WhatsAppMessage.atendimento nas mensagens antigas, em lotes por "
+        "faixa de id (um UPDATE por lote, fora de transação longa). Idempotente: "
+        "só altera mensagens ainda sem vínculo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Mensagens (faixa de id) por lote")
+        parser.add_argument("--tolerance-seconds", type=float, default=5.0,
+                            help="Folga entre a mensagem inicial e a criação do atendimento")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Pausa entre lotes (segundos)")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        tolerance = timedelta(seconds=options["tolerance_seconds"])
+
+        bounds = WhatsAppMessage.objects.filter(atendimento__isnull=True).aggregate(
+            first=Min("id"), last=Max("id")
+        )
+        if bounds["first"] is None:
+            self.stdout.write("Nenhuma mensagem sem atendimento.")
+            return
+
+        sql = BACKFILL_SQL.format(
+            messages=WhatsAppMessage._meta.db_table,
+            atendimentos=Atendimento._meta.db_table,
+        )
+
+        started = time.perf_counter()
+        linked = 0
+        start = bounds["first"]
+        while start <= bounds["last"]:
+            end = start + batch_size
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [tolerance, start, end])
+                linked += cursor.rowcount
+            start = end
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{linked} mensagens vinculadas a atendimentos em {elapsed:.2f}s. "
+            f"Rode rebuild_chat_summaries para recalcular os resumos."
+        ))
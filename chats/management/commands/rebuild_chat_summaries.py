@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from atendimento.models import Atendimento
+from chats.summary import ACTIVE_STATUSES, get_chat_summary_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstrói os resumos de chat (ChatSummary) a partir de WhatsAppMessage, "
+        "corrigindo divergências dos contadores incrementais. Por padrão, apenas "
+        "atendimentos ativos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Inclui atendimentos finalizados")
+        parser.add_argument("--chat-id", help="Reconstrói apenas os atendimentos deste chat_id")
+        parser.add_argument("--batch-size", type=int, default=500, help="Atendimentos lidos por lote")
+
+    def handle(self, *args, **options):
+        atendimentos = Atendimento.objects.only("id", "chat_id", "criado_em").order_by("id")
+        if not options["all"]:
+            atendimentos = atendimentos.filter(status__in=ACTIVE_STATUSES)
+        if options["chat_id"]:
+            atendimentos = atendimentos.filter(chat_id=options["chat_id"])
+
+        started = time.perf_counter()
+        total = get_chat_summary_service().rebuild_many(
+            atendimentos.iterator(chunk_size=max(1, options["batch_size"]))
+        )
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} resumos de chat reconstruídos em {elapsed:.2f}s"
+        ))
@@ -0,0 +1,414 @@
+"""
+Cache quente das mensagens recentes por chat.
+
+Abrir uma conversa (primeira página de GET /chats/{chat_id}/messages/) é a
+leitura mais frequente da API. Cada chat tem um ring buffer no cache
+compartilhado com as últimas CHAT_RECENT_CACHE_SIZE mensagens já
+serializadas, mais os campos do atendimento usados na checagem de permissão;
+a primeira página é servida sem nenhuma consulta ao banco. Qualquer lacuna
+(slot expirado, chat fora do cache, página maior que o buffer) cai para o
+banco, que repopula o buffer.
+
+Estrutura por chat (mesmo esquema de slots de core.event_stream):
+- head: contador atômico (cache.incr) de mensagens anexadas ao chat
+- slot:{seq % N}: mensagem serializada com o seq que a gravou
+- msg:{id}: seq da mensagem, para atualizar o slot em mudanças de status
+- meta: atendimento (id, atendente, status), seq base e se há mensagens
+  mais antigas que o buffer
+
+Mensagens novas são anexadas na ingestão e no envio
+(ChatService._vincular_mensagem); mudanças de status atualizam o slot em
+WhatsAppMessage.save. Essas gravações rodam em transaction.on_commit: o
+cache compartilhado só recebe o que foi confirmado no banco, e nada de uma
+transação revertida. O incremento do head em toda mensagem também serve de
+versão: um preenchimento a partir do banco só é gravado se nenhuma mensagem
+chegou durante a consulta.
+
+O total é limitado por CHAT_RECENT_CACHE_MAX_BYTES: um índice LRU
+(aproximado, atualizado no preenchimento e no máximo uma vez a cada
+TOUCH_INTERVAL por chat nas leituras) remove os chats menos acessados. Com
+o cache em Redis, o índice é um sorted set (score = último acesso) mais um
+hash com o tamanho estimado de cada chat, atualizados e podados por um
+script Lua (atômico, uma ida ao Redis); sem Redis, estruturas equivalentes
+na memória do processo, como o próprio LocMemCache.
+
+Chaves do índice (Redis):
+- chat_recent:lru        sorted set chat_id -> último acesso (epoch)
+- chat_recent:lru:bytes  hash chat_id -> bytes estimados do buffer
+- chat_recent:lru:total  soma de chat_recent:lru:bytes
+"""
+import logging
+import pickle
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.metrics import Counter
+from core.pagination import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'chat_recent'
+LRU_KEY = f'{KEY_PREFIX}:lru'
+LRU_BYTES_KEY = f'{LRU_KEY}:bytes'
+LRU_TOTAL_KEY = f'{LRU_KEY}:total'
+
+# Intervalo mínimo entre atualizações do índice LRU para o mesmo chat
+TOUCH_INTERVAL = 30
+
+chat_cache_requests = Counter(
+    'chat_recent_cache_requests_total',
+    'Leituras da primeira página de mensagens de um chat, por resultado (hit/miss)'
+)
+chat_cache_evictions = Counter(
+    'chat_recent_cache_evictions_total',
+    'Chats removidos do cache de mensagens recentes pelo limite de memória'
+)
+
+
+class _LruMemoria:
+    """Índice LRU na memória do processo (sem Redis)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acessos: Dict[str, float] = {}
+        self._bytes: Dict[str, int] = {}
+        self._total = 0
+
+    def touch(self, chat_id: str, agora: float, nbytes: Optional[int], max_bytes: int) -> List[str]:
+        """Registra o acesso e remove do índice os chats excedentes; retorna os removidos"""
+        with self._lock:
+            self._acessos[chat_id] = agora
+            if nbytes is not None:
+                self._total += nbytes - self._bytes.get(chat_id, 0)
+                self._bytes[chat_id] = nbytes
+            if self._total <= max_bytes:
+                return []
+
+            removidos = []
+            for victim in sorted(self._acessos, key=self._acessos.get):
+                if self._total <= max_bytes:
+                    break
+                if victim == chat_id:
+                    continue
+                del self._acessos[victim]
+                self._total -= self._bytes.pop(victim, 0)
+                removidos.append(victim)
+            return removidos
+
+
+# KEYS: sorted set, hash de bytes, total; ARGV: chat_id, agora, bytes (-1: mantém), limite
+_TOUCH_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+local total
+local nbytes = tonumber(ARGV[3])
+if nbytes >= 0 then
+    local anterior = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+    redis.call('HSET', KEYS[2], ARGV[1], nbytes)
+    total = redis.call('INCRBY', KEYS[3], nbytes - anterior)
+else
+    total = tonumber(redis.call('GET', KEYS[3]) or '0')
+end
+
+local limite = tonumber(ARGV[4])
+local removidos = {}
+while total > limite do
+    local mais_antigos = redis.call('ZRANGE', KEYS[1], 0, 1)
+    local victim = mais_antigos[1]
+    if victim == ARGV[1] then
+        victim = mais_antigos[2]
+    end
+    if not victim then
+        break
+    end
+    redis.call('ZREM', KEYS[1], victim)
+    local victim_bytes = tonumber(redis.call('HGET', KEYS[2], victim) or '0')
+    redis.call('HDEL', KEYS[2], victim)
+    total = redis.call('DECRBY', KEYS[3], victim_bytes)
+    table.insert(removidos, victim)
+end
+return removidos
+"""
+
+
+class _LruRedis:
+    """Sorted set + hash de tamanhos no Redis do cache (django-redis)"""
+
+    def __init__(self, client):
+        self._touch = client.register_script(_TOUCH_LUA)
+
+    def touch(self, chat_id: str, agora: float, nbytes: Optional[int], max_bytes: int) -> List[str]:
+        removidos = self._touch(
+            keys=[LRU_KEY, LRU_BYTES_KEY, LRU_TOTAL_KEY],
+            args=[chat_id, agora, -1 if nbytes is None else nbytes, max_bytes],
+        )
+        return [victim.decode() for victim in removidos]
+
+
+class RecentMessagesCache:
+    """Ring buffer das mensagens recentes de cada chat no cache compartilhado"""
+
+    def __init__(self, size: int = None, ttl: int = None, max_bytes: int = None):
+        self._size = size
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._lru = None
+
+    @property
+    def size(self) -> int:
+        return self._size or getattr(settings, 'CHAT_RECENT_CACHE_SIZE', 50)
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl or getattr(settings, 'CHAT_RECENT_CACHE_TTL_SECONDS', 3600)
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes or getattr(settings, 'CHAT_RECENT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.max_bytes > 0
+
+    @property
+    def lru(self):
+        if self._lru is None:
+            if type(cache).__module__.startswith('django_redis'):
+                from django_redis import get_redis_connection
+                self._lru = _LruRedis(get_redis_connection('default'))
+            else:
+                self._lru = _LruMemoria()
+        return self._lru
+
+    # Chaves
+
+    def _key(self, chat_id: str, suffix: str) -> str:
+        return f'{KEY_PREFIX}:{chat_id}:{suffix}'
+
+    def _slot_key(self, chat_id: str, seq: int) -> str:
+        return self._key(chat_id, f'slot:{seq % self.size}')
+
+    def _msg_key(self, chat_id: str, mensagem_id: int) -> str:
+        return self._key(chat_id, f'msg:{mensagem_id}')
+
+    def _next_seq(self, chat_id: str, amount: int = 1) -> int:
+        key = self._key(chat_id, 'head')
+        try:
+            return cache.incr(key, amount)
+        except ValueError:
+            # Chave inexistente: inicializa sem sobrescrever concorrentes
+            cache.add(key, 0, timeout=self.ttl)
+            return cache.incr(key, amount)
+
+    @staticmethod
+    def _serialize(mensagem) -> Dict:
+        from .serializers import ChatMessageSerializer
+        return dict(ChatMessageSerializer(mensagem).data)
+
+    @staticmethod
+    def _slot(seq: int, mensagem, data: Dict) -> Dict:
+        return {
+            'seq': seq,
+            'id': mensagem.pk,
+            'created_at': mensagem.created_at.isoformat(),
+            'data': data,
+        }
+
+    @staticmethod
+    def _meta(atendimento, base: int, older: bool) -> Dict:
+        return {
+            'atendimento_id': atendimento.id,
+            'atendente_id': atendimento.atendente_id,
+            'status': atendimento.status,
+            'base': base,
+            'older': older,
+        }
+
+    # Leitura
+
+    def get_first_page(self, chat_id: str, limit: int) -> Optional[Dict]:
+        """
+        Primeira página (mais recentes) do chat, ou None se o cache não cobre.
+
+        Returns:
+            {'meta', 'results', 'has_older', 'before', 'after'}
+        """
+        if not self.enabled or limit > self.size:
+            return None
+
+        page = self._read(chat_id, limit)
+        chat_cache_requests.inc(result='hit' if page else 'miss')
+        if page and cache.add(self._key(chat_id, 'touch'), 1, timeout=TOUCH_INTERVAL):
+            self._touch(chat_id)
+        return page
+
+    def _read(self, chat_id: str, limit: int) -> Optional[Dict]:
+        head_key, meta_key = self._key(chat_id, 'head'), self._key(chat_id, 'meta')
+        stored = cache.get_many([head_key, meta_key])
+        head, meta = stored.get(head_key), stored.get(meta_key)
+        if head is None or meta is None or head < meta['base'] - 1:
+            return None
+
+        first = max(meta['base'], head - self.size + 1)
+        seqs = range(first, head + 1)
+        keys = [self._slot_key(chat_id, seq) for seq in seqs]
+        slots = cache.get_many(keys)
+
+        mensagens = {}
+        for seq, key in zip(seqs, keys):
+            slot = slots.get(key)
+            if not slot or slot['seq'] != seq:
+                # Slot expirado ou sobrescrito por uma mensagem mais nova
+                return None
+            mensagens[slot['id']] = slot
+
+        older = meta['older'] or first > meta['base']
+        if len(mensagens) < limit and older:
+            return None
+
+        ordered: List[Dict] = sorted(
+            mensagens.values(), key=lambda s: (s['created_at'], s['id']), reverse=True
+        )
+        page = ordered[:limit]
+        has_older = len(ordered) > limit or older
+
+        def cursor(slot):
+            return encode_cursor(datetime.fromisoformat(slot['created_at']), slot['id'])
+
+        return {
+            'meta': meta,
+            'results': [slot['data'] for slot in page],
+            'has_older': has_older,
+            'before': cursor(page[-1]) if page and has_older else None,
+            'after': cursor(page[0]) if page else None,
+        }
+
+    # Escrita
+
+    def begin_fill(self, chat_id: str) -> Optional[int]:
+        """Versão (head) do chat antes da consulta ao banco que vai preencher o cache"""
+        if not self.enabled:
+            return None
+        return cache.get(self._key(chat_id, 'head')) or 0
+
+    def fill(self, atendimento, mensagens: List, data: List[Dict], has_older: bool, version: Optional[int]) -> bool:
+        """
+        Grava a primeira página lida do banco (mais recentes primeiro).
+
+        Descartado se alguma mensagem foi anexada desde begin_fill: a página
+        lida pode não contê-la.
+        """
+        if version is None:
+            return False
+
+        chat_id = atendimento.chat_id
+        count = len(mensagens)
+        head = self._next_seq(chat_id, count)
+        if head != version + count:
+            return False
+
+        base = head - count + 1
+        entries = {}
+        for offset, (mensagem, item) in enumerate(zip(reversed(mensagens), reversed(data))):
+            seq = base + offset
+            entries[self._slot_key(chat_id, seq)] = self._slot(seq, mensagem, item)
+            entries[self._msg_key(chat_id, mensagem.pk)] = seq
+        entries[self._key(chat_id, 'meta')] = self._meta(
+            atendimento, base, has_older or count > self.size
+        )
+        cache.set_many(entries, timeout=self.ttl)
+        cache.touch(self._key(chat_id, 'head'), self.ttl)
+
+        slot_bytes = sum(
+            len(pickle.dumps(v)) for k, v in entries.items() if ':slot:' in k
+        )
+        per_message = slot_bytes // count if count else 512
+        self._touch(chat_id, per_message * self.size)
+        return True
+
+    def append(self, atendimento, mensagem) -> None:
+        """Anexa uma mensagem recém-vinculada ao atendimento (ingestão e envio), após o commit"""
+        if not self.enabled:
+            return
+        chat_id, atendimento_id = atendimento.chat_id, atendimento.id
+        slot = self._slot(0, mensagem, self._serialize(mensagem))
+        transaction.on_commit(lambda: self._append(chat_id, atendimento_id, slot))
+
+    def _append(self, chat_id: str, atendimento_id: int, slot: Dict) -> None:
+        meta = cache.get(self._key(chat_id, 'meta'))
+        seq = self._next_seq(chat_id)
+        if meta is None:
+            return
+        if meta['atendimento_id'] != atendimento_id:
+            # Novo atendimento no mesmo chat: o buffer é de outra conversa
+            self.invalidate(chat_id)
+            return
+        cache.set_many({
+            self._slot_key(chat_id, seq): dict(slot, seq=seq),
+            self._msg_key(chat_id, slot['id']): seq,
+        }, timeout=self.ttl)
+
+    def update_message(self, mensagem) -> None:
+        """Regrava o slot de uma mensagem já em cache (mudança de status), após o commit"""
+        if not self.enabled or not mensagem.pk:
+            return
+        chat_id = mensagem.chat_id
+        slot = self._slot(0, mensagem, self._serialize(mensagem))
+        transaction.on_commit(lambda: self._update_message(chat_id, slot))
+
+    def _update_message(self, chat_id: str, slot: Dict) -> None:
+        seq = cache.get(self._msg_key(chat_id, slot['id']))
+        if seq is None:
+            return
+        slot_key = self._slot_key(chat_id, seq)
+        atual = cache.get(slot_key)
+        if not atual or atual['seq'] != seq or atual['id'] != slot['id']:
+            return
+        cache.set(slot_key, dict(slot, seq=seq), timeout=self.ttl)
+
+    def update_atendimento(self, atendimento) -> None:
+        """Mantém atendente e status do meta alinhados ao atendimento (permissão), após o commit"""
+        if not self.enabled:
+            return
+        chat_id, atendimento_id = atendimento.chat_id, atendimento.id
+        atendente_id, status = atendimento.atendente_id, atendimento.status
+        transaction.on_commit(
+            lambda: self._update_atendimento(chat_id, atendimento_id, atendente_id, status)
+        )
+
+    def _update_atendimento(self, chat_id: str, atendimento_id: int, atendente_id, status: str) -> None:
+        meta_key = self._key(chat_id, 'meta')
+        meta = cache.get(meta_key)
+        if not meta or meta['atendimento_id'] != atendimento_id:
+            return
+        if meta['atendente_id'] == atendente_id and meta['status'] == status:
+            return
+        meta.update(atendente_id=atendente_id, status=status)
+        cache.set(meta_key, meta, timeout=self.ttl)
+
+    def invalidate(self, chat_id: str) -> None:
+        """Remove o buffer do chat (slots expiram pelo TTL)"""
+        cache.delete_many(
+            [self._key(chat_id, 'meta')]
+            + [self._key(chat_id, f'slot:{index}') for index in range(self.size)]
+        )
+
+    # Limite de memória (LRU entre chats)
+
+    def _touch(self, chat_id: str, nbytes: int = None) -> None:
+        for victim in self.lru.touch(chat_id, time.time(), nbytes, self.max_bytes):
+            self.invalidate(victim)
+            chat_cache_evictions.inc()
+
+
+_recent_messages_cache = RecentMessagesCache()
+
+
+def get_recent_messages_cache() -> RecentMessagesCache:
+    """Retorna instância global do cache"""
+    return _recent_messages_cache
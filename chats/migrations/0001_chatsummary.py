@@ -0,0 +1,35 @@
+# Generated by Django 4.2.13 on 2026-10-19 01:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('atendimento', '0002_add_transferencia_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSummary',
+            fields=[
+                ('atendimento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumo', serialize=False, to='atendimento.atendimento', verbose_name='Atendimento')),
+                ('chat_id', models.CharField(db_index=True, max_length=100, verbose_name='ID do Chat')),
+                ('ultima_mensagem_texto', models.TextField(blank=True, verbose_name='Prévia da Última Mensagem')),
+                ('ultima_mensagem_tipo', models.CharField(blank=True, max_length=20, verbose_name='Tipo da Última Mensagem')),
+                ('ultima_mensagem_direcao', models.CharField(blank=True, max_length=10, verbose_name='Direção da Última Mensagem')),
+                ('ultima_mensagem_em', models.DateTimeField(blank=True, null=True, verbose_name='Última Mensagem em')),
+                ('ultima_resposta_em', models.DateTimeField(blank=True, null=True, verbose_name='Última Resposta do Atendente em')),
+                ('total_mensagens', models.IntegerField(default=0, verbose_name='Total de Mensagens')),
+                ('mensagens_nao_lidas', models.IntegerField(default=0, help_text='Recebidas após a última resposta do atendente', verbose_name='Mensagens Não Lidas')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Chat',
+                'verbose_name_plural': 'Resumos de Chat',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-19 01:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_chatsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('atendimento_id', models.BigIntegerField(blank=True, null=True, verbose_name='Atendimento')),
+                ('mensagem_id', models.BigIntegerField(blank=True, null=True, verbose_name='Mensagem')),
+                ('criado_em', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Criado em')),
+            ],
+            options={
+                'verbose_name': 'Alteração de Chat',
+                'verbose_name_plural': 'Alterações de Chat',
+            },
+        ),
+    ]
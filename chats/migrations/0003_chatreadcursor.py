@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-19 01:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0002_add_transferencia_model'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chats', '0002_chatchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultima_mensagem_lida_id', models.BigIntegerField(blank=True, null=True, verbose_name='Última Mensagem Lida')),
+                ('mensagens_nao_lidas', models.IntegerField(default=0, verbose_name='Mensagens Não Lidas')),
+                ('lido_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Lido em')),
+                ('agente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cursores_leitura', to=settings.AUTH_USER_MODEL, verbose_name='Atendente')),
+                ('atendimento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cursores_leitura', to='atendimento.atendimento', verbose_name='Atendimento')),
+            ],
+            options={
+                'verbose_name': 'Cursor de Leitura',
+                'verbose_name_plural': 'Cursores de Leitura',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='chatreadcursor',
+            constraint=models.UniqueConstraint(fields=('agente', 'atendimento'), name='chat_read_cursor_agente_atendimento_uniq'),
+        ),
+    ]
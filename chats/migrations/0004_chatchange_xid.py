@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_chatreadcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatchange',
+            name='xid',
+            field=models.BigIntegerField(db_index=True, editable=False, null=True, verbose_name='Transação'),
+        ),
+        # A transação que grava a linha, inclusive em bulk_create (Postgres 13+)
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION chats_chatchange_set_xid() RETURNS trigger AS $$
+                BEGIN
+                    NEW.xid := pg_current_xact_id()::text::bigint;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER chats_chatchange_set_xid
+                    BEFORE INSERT ON chats_chatchange
+                    FOR EACH ROW EXECUTE FUNCTION chats_chatchange_set_xid();
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS chats_chatchange_set_xid ON chats_chatchange;
+                DROP FUNCTION IF EXISTS chats_chatchange_set_xid();
+            """,
+        ),
+    ]
@@ -1,3 +1,187 @@
+"""
+Modelos de leitura da API de Chats.
+
+ChatSummary guarda, por atendimento, o que a listagem e o detalhe de chats
+exibem (prévia da última mensagem e contadores). É atualizado de forma
+incremental na ingestão e no envio de mensagens (ChatSummaryService) e pode
+ser reconstruído com `python manage.py rebuild_chat_summaries`.
+
+ChatChange é o log de alterações consumido por GET /chats/changes/.
+
+ChatReadCursor guarda, por atendente e atendimento, a última mensagem lida e
+o contador de não lidas, mantido a cada mensagem recebida.
+"""
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class ChatSummary(models.Model):
+    """Resumo de uma conversa (um por atendimento)"""
+
+    atendimento = models.OneToOneField(
+        'atendimento.Atendimento',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='resumo',
+        verbose_name=_("Atendimento")
+    )
+
+    chat_id = models.CharField(
+        max_length=100,
+        verbose_name=_("ID do Chat"),
+        db_index=True
+    )
+
+    # Última mensagem
+    ultima_mensagem_texto = models.TextField(
+        blank=True,
+        verbose_name=_("Prévia da Última Mensagem")
+    )
+
+    ultima_mensagem_tipo = models.CharField(
+        max_length=20,
+        blank=True,
+        verbose_name=_("Tipo da Última Mensagem")
+    )
+
+    ultima_mensagem_direcao = models.CharField(
+        max_length=10,
+        blank=True,
+        verbose_name=_("Direção da Última Mensagem")
+    )
+
+    ultima_mensagem_em = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Última Mensagem em")
+    )
+
+    ultima_resposta_em = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Última Resposta do Atendente em")
+    )
+
+    # Contadores
+    total_mensagens = models.IntegerField(
+        default=0,
+        verbose_name=_("Total de Mensagens")
+    )
+
+    mensagens_nao_lidas = models.IntegerField(
+        default=0,
+        verbose_name=_("Mensagens Não Lidas"),
+        help_text=_("Recebidas após a última resposta do atendente")
+    )
+
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Atualizado em")
+    )
+
+    class Meta:
+        verbose_name = _("Resumo de Chat")
+        verbose_name_plural = _("Resumos de Chat")
+
+    def __str__(self) -> str:
+        return f"Resumo {self.chat_id} (atendimento {self.atendimento_id})"
+
+
+class ChatChange(models.Model):
+    """
+    Registro de alteração de atendimento ou mensagem (delta-sync).
+
+    seq é monotônico e alimenta o token de GET /chats/changes/. xid é a
+    transação que gravou a linha, preenchido por trigger no INSERT: seqs
+    menores podem ficar visíveis depois de seqs maiores, e o token usa xid
+    para reentregar o que transações ainda abertas gravaram. Colunas sem FK
+    de propósito: é um log de escrita apenas, podado por prune_chat_changes.
+    """
+
+    seq = models.BigAutoField(primary_key=True)
+
+    atendimento_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Atendimento")
+    )
+
+    mensagem_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Mensagem")
+    )
+
+    xid = models.BigIntegerField(
+        null=True,
+        editable=False,
+        db_index=True,
+        verbose_name=_("Transação")
+    )
+
+    criado_em = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name=_("Criado em")
+    )
+
+    class Meta:
+        verbose_name = _("Alteração de Chat")
+        verbose_name_plural = _("Alterações de Chat")
+
+    def __str__(self) -> str:
+        return f"#{self.seq} atendimento={self.atendimento_id} mensagem={self.mensagem_id}"
+
+
+class ChatReadCursor(models.Model):
+    """
+    Cursor de leitura de um atendente em um atendimento.
+
+    mensagens_nao_lidas é incrementado a cada mensagem recebida e zerado
+    quando o atendente lê a conversa (POST /chats/{chat_id}/read/) ou responde.
+    """
+
+    agente = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='cursores_leitura',
+        verbose_name=_("Atendente")
+    )
+
+    atendimento = models.ForeignKey(
+        'atendimento.Atendimento',
+        on_delete=models.CASCADE,
+        related_name='cursores_leitura',
+        verbose_name=_("Atendimento")
+    )
+
+    ultima_mensagem_lida_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Última Mensagem Lida")
+    )
+
+    mensagens_nao_lidas = models.IntegerField(
+        default=0,
+        verbose_name=_("Mensagens Não Lidas")
+    )
+
+    lido_em = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Lido em")
+    )
+
+    class Meta:
+        verbose_name = _("Cursor de Leitura")
+        verbose_name_plural = _("Cursores de Leitura")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['agente', 'atendimento'],
+                name='chat_read_cursor_agente_atendimento_uniq'
+            ),
+        ]
 
-# Create your models here.
+    def __str__(self) -> str:
+        return f"{self.agente_id} leu atendimento {self.atendimento_id} até {self.ultima_mensagem_lida_id}"
@@ -0,0 +1,95 @@
+"""
+Paginação por keyset da listagem de chats.
+
+A ordenação vem dos parâmetros sort/order da própria listagem e é sempre
+desempatada por id: usa o mesmo cursor (valor do campo, id) e a mesma busca
+por faixa de core.pagination.KeysetPagination. Assim chats com o mesmo valor
+(mesma prioridade, mesma atividade) não se repetem nem somem entre páginas,
+e a página não depende de OFFSET enquanto novas conversas chegam.
+"""
+from datetime import datetime
+
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.pagination import KeysetPagination, keyset_page
+
+
+class ChatCursorPagination(KeysetPagination):
+    """
+    Cursor sobre a listagem de chats.
+
+    Query params:
+    - cursor: posição devolvida em next/previous
+    - direction=previous: busca a página anterior ao cursor (vem em previous)
+    - page_size: itens por página (padrão: 50, máximo: 200)
+    - sort: lastMessage, priority, created, updated
+    - order: asc ou desc
+    """
+    limit_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    direction_query_param = 'direction'
+
+    ordering_map = {
+        'lastMessage': 'atividade_em',
+        'priority': 'prioridade',
+        'created': 'criado_em',
+        'updated': 'atualizado_em',
+    }
+    datetime_fields = ('atividade_em', 'criado_em', 'atualizado_em')
+
+    def get_ordering(self, request):
+        """(campo, decrescente) da listagem"""
+        field = self.ordering_map.get(request.query_params.get('sort'), 'atividade_em')
+        return field, request.query_params.get('order') != 'asc'
+
+    def parse_key(self, value: str):
+        if self.key_field in self.datetime_fields:
+            return datetime.fromisoformat(value)
+        return value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.key_field, descending = self.get_ordering(request)
+        limit = self.get_limit(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        reverse = bool(cursor) and request.query_params.get(self.direction_query_param) == 'previous'
+        page, has_more = keyset_page(
+            queryset, self.key_field, descending,
+            self.decode_cursor(cursor) if cursor else None, reverse, limit
+        )
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, bool(cursor)
+
+        self.page = page
+        return page
+
+    def _link(self, item, reverse: bool):
+        url = replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(item)
+        )
+        if reverse:
+            return replace_query_param(url, self.direction_query_param, 'previous')
+        return remove_query_param(url, self.direction_query_param)
+
+    def get_paginated_response(self, data):
+        first = self.page[0] if self.page else None
+        last = self.page[-1] if self.page else None
+        return Response({
+            'next': self._link(last, False) if self.has_next and last else None,
+            'previous': self._link(first, True) if self.has_previous and first else None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,130 @@
+"""
+Cursores de leitura por atendente (ChatReadCursor).
+
+O badge de não lidas de cada atendente é uma leitura direta do cursor:
+mensagens recebidas incrementam, com um único UPDATE, os cursores de todos
+os atendentes que já abriram o atendimento; ler a conversa ou responder
+move o cursor e recalcula o contador. Atendentes que nunca leram o
+atendimento usam o contador do ChatSummary (recebidas após a última
+resposta).
+
+Cada leitura é publicada no stream do próprio atendente (evento chat_read),
+para sincronizar o badge entre os dispositivos dele.
+"""
+import logging
+from typing import Dict, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from atendimento.models import Atendimento
+from core.event_stream import publish_user_event
+from whatsapp.models import WhatsAppMessage
+
+from .changes import record_chat_change
+from .models import ChatReadCursor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatReadService:
+    """Move cursores de leitura e mantém os contadores de não lidas"""
+
+    @staticmethod
+    def marcar_como_lido(
+        agente, atendimento: Atendimento, mensagem_id: Optional[int] = None
+    ) -> ChatReadCursor:
+        """
+        Marca o atendimento como lido pelo atendente até mensagem_id (padrão:
+        a última mensagem vinculada). O cursor nunca retrocede.
+        """
+        mensagens = WhatsAppMessage.objects.filter(atendimento_id=atendimento.id)
+        if mensagem_id is None:
+            mensagem_id = mensagens.order_by('-id').values_list('id', flat=True).first()
+
+        cursor = ChatReadCursor.objects.filter(agente=agente, atendimento_id=atendimento.id).first()
+        if cursor and mensagem_id is not None and cursor.ultima_mensagem_lida_id is not None \
+                and mensagem_id <= cursor.ultima_mensagem_lida_id:
+            return cursor
+
+        nao_lidas = mensagens.filter(direction='inbound')
+        if mensagem_id is not None:
+            nao_lidas = nao_lidas.filter(id__gt=mensagem_id)
+        fields = {
+            'ultima_mensagem_lida_id': mensagem_id,
+            'mensagens_nao_lidas': nao_lidas.count(),
+            'lido_em': timezone.now(),
+        }
+
+        try:
+            with transaction.atomic():
+                cursor, _ = ChatReadCursor.objects.update_or_create(
+                    agente=agente, atendimento_id=atendimento.id, defaults=fields
+                )
+        except IntegrityError:
+            # Outro dispositivo criou o cursor em paralelo
+            ChatReadCursor.objects.filter(agente=agente, atendimento_id=atendimento.id).update(**fields)
+            cursor = ChatReadCursor.objects.get(agente=agente, atendimento_id=atendimento.id)
+        record_chat_change(atendimento_id=atendimento.id)
+        return cursor
+
+    @staticmethod
+    def registrar_mensagem(atendimento: Atendimento, mensagem: WhatsAppMessage) -> None:
+        """
+        Recebida: +1 nos cursores existentes do atendimento.
+        Enviada: o remetente leu a conversa até a própria mensagem.
+        """
+        if mensagem.direction == 'inbound':
+            ChatReadCursor.objects.filter(atendimento_id=atendimento.id).update(
+                mensagens_nao_lidas=F('mensagens_nao_lidas') + 1
+            )
+        elif mensagem.usuario_id:
+            ChatReadCursor.objects.filter(
+                agente_id=mensagem.usuario_id, atendimento_id=atendimento.id
+            ).update(
+                ultima_mensagem_lida_id=mensagem.pk,
+                mensagens_nao_lidas=0,
+                lido_em=timezone.now(),
+            )
+
+    @staticmethod
+    def annotate_nao_lidas(queryset, agente):
+        """Anota nao_lidas_agente (cursor do atendente; None sem cursor)"""
+        return queryset.annotate(
+            nao_lidas_agente=Subquery(
+                ChatReadCursor.objects.filter(
+                    agente=agente, atendimento_id=OuterRef('pk')
+                ).values('mensagens_nao_lidas')[:1]
+            )
+        )
+
+    @staticmethod
+    def build_event_data(atendimento: Atendimento, cursor: ChatReadCursor) -> Dict:
+        return {
+            'chat_id': atendimento.chat_id,
+            'atendimento_id': atendimento.id,
+            'ultima_mensagem_lida_id': cursor.ultima_mensagem_lida_id,
+            'mensagens_nao_lidas': cursor.mensagens_nao_lidas,
+            'lido_em': cursor.lido_em.isoformat(),
+        }
+
+    @staticmethod
+    def publicar_leitura(agente, atendimento: Atendimento, cursor: ChatReadCursor) -> None:
+        """Sincroniza o cursor com os outros dispositivos do atendente"""
+        try:
+            publish_user_event(agente.id, {
+                'event': 'chat_read',
+                'data': ChatReadService.build_event_data(atendimento, cursor),
+                'version': 'v1',
+            })
+        except Exception as e:
+            logger.error(f"Erro ao publicar leitura do chat {atendimento.chat_id}: {e}")
+
+
+_read_service = ChatReadService()
+
+
+def get_chat_read_service() -> ChatReadService:
+    """Retorna instância global do serviço"""
+    return _read_service
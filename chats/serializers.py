@@ -4,13 +4,14 @@ Serializers para API de Chats (Issue #85).
 Agrupa mensagens e atendimentos em conversas únicas por chat_id.
 """
 from rest_framework import serializers
-from django.db.models import Q, Max, Count
 from django.utils import timezone
 
 from atendimento.models import Atendimento
 from whatsapp.models import WhatsAppMessage
 from clientes.models import Cliente
 
+from .summary import get_chat_summary_service
+
 
 class ChatListSerializer(serializers.Serializer):
     """
@@ -120,36 +121,20 @@ class ChatDetailSerializer(serializers.ModelSerializer):
         return None
     
     def get_total_mensagens(self, obj):
-        """Total de mensagens do chat atual"""
-        return WhatsAppMessage.objects.filter(
-            chat_id=obj.chat_id,
-            created_at__gte=obj.criado_em
-        ).count()
+        """Total de mensagens do chat atual (de ChatSummary)"""
+        resumo = get_chat_summary_service().get(obj)
+        return resumo.total_mensagens if resumo else 0
     
     def get_mensagens_nao_lidas(self, obj):
         """
-        Conta mensagens não lidas (recebidas após última mensagem do atendente).
+        Não lidas pelo atendente (cursor de leitura, anotado em nao_lidas_agente);
+        sem cursor, recebidas após a última resposta (ChatSummary).
         """
-        ultima_msg_atendente = WhatsAppMessage.objects.filter(
-            chat_id=obj.chat_id,
-            direction='outbound',
-            created_at__gte=obj.criado_em
-        ).aggregate(Max('created_at'))['created_at__max']
-        
-        if not ultima_msg_atendente:
-            # Se atendente nunca respondeu, conta todas as mensagens do cliente
-            return WhatsAppMessage.objects.filter(
-                chat_id=obj.chat_id,
-                direction='inbound',
-                created_at__gte=obj.criado_em
-            ).count()
-        
-        # Conta mensagens do cliente após última resposta do atendente
-        return WhatsAppMessage.objects.filter(
-            chat_id=obj.chat_id,
-            direction='inbound',
-            created_at__gt=ultima_msg_atendente
-        ).count()
+        nao_lidas = getattr(obj, 'nao_lidas_agente', None)
+        if nao_lidas is not None:
+            return nao_lidas
+        resumo = get_chat_summary_service().get(obj)
+        return resumo.mensagens_nao_lidas if resumo else 0
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -211,3 +196,8 @@ class EncerrarChatSerializer(serializers.Serializer):
     observacoes = serializers.CharField(required=False, allow_blank=True, help_text="Observações finais")
     solicitar_avaliacao = serializers.BooleanField(default=True, help_text="Enviar solicitação de avaliação ao cliente")
 
+
+
+class MarcarLidoSerializer(serializers.Serializer):
+    """Serializer para marcar um chat como lido"""
+    message_id = serializers.IntegerField(required=False, help_text="ID da última mensagem lida (opcional, usa a última do chat se não fornecido)")
@@ -3,16 +3,27 @@ Serviço para gerenciamento de chats e auto-criação de filas (Issue #85).
 """
 import logging
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import F
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 from atendimento.models import Atendimento, FilaAtendimento, Departamento
-from clientes.models import Cliente, ContatoCliente
+from clientes.models import Cliente
+from clientes.phone import get_cliente_por_numero_service, normalizar_telefone
+from core.event_stream import publish_user_event
 from whatsapp.models import WhatsAppMessage
 
+from .active_conversations import STATUS_ATIVOS, get_conversa_ativa_service
+from .changes import record_chat_change
+from .message_cache import get_recent_messages_cache
+from .read_cursors import get_chat_read_service
+from .summary import get_chat_summary_service
+
 logger = logging.getLogger(__name__)
 
+# Primeira chave do advisory lock de criação de conversa; a segunda é hashtext(chat_id)
+LOCK_NOVA_CONVERSA = 85
+
 
 class ChatService:
     """
@@ -29,6 +40,10 @@ class ChatService:
         2. Se não existe, cria Fila + Atendimento automaticamente
         3. Emite evento WebSocket para alertar atendentes
         
+        Mensagens simultâneas de um chat novo (mensagens em várias partes)
+        disputam um lock por chat_id; quem chega depois encontra o
+        atendimento já criado e segue como conversa existente.
+        
         Args:
             mensagem: Instância de WhatsAppMessage
         """
@@ -41,47 +56,44 @@ class ChatService:
         
         logger.info(f"Processando nova mensagem recebida de {numero} (chat: {chat_id})")
         
-        # Verificar se já existe atendimento ativo
-        atendimento_existente = Atendimento.objects.filter(
-            chat_id=chat_id,
-            status__in=['aguardando', 'em_atendimento', 'pausado']
-        ).first()
+        # Verificar se já existe atendimento ativo (cache por chat_id)
+        atendimento_existente = get_conversa_ativa_service().obter(chat_id)
         
         if atendimento_existente:
-            logger.debug(f"Chat {chat_id} já tem atendimento ativo (ID: {atendimento_existente.id})")
-            # Atualizar contador de mensagens
-            atendimento_existente.total_mensagens_cliente += 1
-            atendimento_existente.save(update_fields=['total_mensagens_cliente', 'atualizado_em'])
-            
-            # Emitir evento de nova mensagem (para atualizar badge)
-            ChatService._emit_new_message_event(atendimento_existente, mensagem)
+            ChatService._registrar_mensagem_existente(atendimento_existente, mensagem)
             return
         
-        # Nova conversa - criar atendimento
-        logger.info(f"Nova conversa detectada para {numero} (chat: {chat_id})")
-        
         with transaction.atomic():
+            # Só uma mensagem por chat cria a conversa; o lock é liberado no commit
+            ChatService._travar_chat(chat_id)
+            
+            atendimento_existente = ChatService._atendimento_ativo(chat_id)
+            if atendimento_existente:
+                ChatService._registrar_mensagem_existente(atendimento_existente, mensagem)
+                return
+            
+            # Nova conversa - criar atendimento
+            logger.info(f"Nova conversa detectada para {numero} (chat: {chat_id})")
+            
             # Buscar ou criar cliente pelo número
-            cliente = ChatService._get_or_create_cliente_by_numero(numero, mensagem.contact_name)
+            cliente_id = ChatService._get_or_create_cliente_id_by_numero(numero, mensagem.contact_name)
             
             # Buscar departamento padrão
             departamento = ChatService._get_departamento_padrao()
             
             # Criar atendimento
-            atendimento = Atendimento.objects.create(
-                departamento=departamento,
-                cliente=cliente,
-                chat_id=chat_id,
-                numero_whatsapp=numero,
-                status='aguardando',
-                prioridade='normal',
-                total_mensagens_cliente=1
-            )
+            atendimento = ChatService._criar_atendimento(departamento, cliente_id, chat_id, numero)
+            if atendimento is None:
+                # O LRU (clientes.phone) apontava para um cliente excluído em outro processo
+                logger.warning(f"Cliente {cliente_id} do número {numero} não existe mais; resolvendo de novo")
+                get_cliente_por_numero_service().invalidar(normalizar_telefone(numero))
+                cliente_id = ChatService._get_or_create_cliente_id_by_numero(numero, mensagem.contact_name)
+                atendimento = ChatService._criar_atendimento(departamento, cliente_id, chat_id, numero)
             
             # Adicionar à fila
             fila = FilaAtendimento.objects.create(
                 departamento=departamento,
-                cliente=cliente,
+                cliente_id=cliente_id,
                 chat_id=chat_id,
                 numero_whatsapp=numero,
                 mensagem_inicial=mensagem.text_content[:500] if mensagem.text_content else '',
@@ -93,25 +105,123 @@ class ChatService:
                 f"(ID: {fila.id}) para chat {chat_id}"
             )
             
+            ChatService._vincular_mensagem(atendimento, mensagem)
+            
             # Emitir evento de NOVO CHAT (com alerta sonoro)
             ChatService._emit_new_chat_event(atendimento, mensagem)
     
     @staticmethod
-    def _get_or_create_cliente_by_numero(numero: str, nome: str = None):
+    def _criar_atendimento(departamento, cliente_id: int, chat_id: str, numero: str):
         """
-        Busca ou cria cliente pelo número de WhatsApp.
+        Cria o atendimento da conversa nova, ou retorna None se cliente_id
+        não existe mais.
+        
+        O cliente_id pode vir do LRU de clientes.phone, gravado por outro
+        processo antes de o cliente ser excluído. A linha do cliente é
+        travada antes do INSERT (FOR NO KEY UPDATE, que não bloqueia outras
+        FKs para ela): se existe agora, não pode ser excluída até o commit.
+        """
+        if not Cliente.objects.select_for_update(no_key=True).filter(pk=cliente_id).exists():
+            return None
+        return Atendimento.objects.create(
+            departamento=departamento,
+            cliente_id=cliente_id,
+            chat_id=chat_id,
+            numero_whatsapp=numero,
+            status='aguardando',
+            prioridade='normal',
+            total_mensagens_cliente=1
+        )
+    
+    @staticmethod
+    def _atendimento_ativo(chat_id: str):
+        return Atendimento.objects.filter(chat_id=chat_id, status__in=STATUS_ATIVOS).first()
+    
+    @staticmethod
+    def _travar_chat(chat_id: str):
+        """
+        Advisory lock do Postgres (pg_advisory_xact_lock) para o chat_id.
+        
+        Vale até o fim da transação corrente e só bloqueia mensagens do mesmo
+        chat; conversas diferentes são criadas em paralelo.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, hashtext(%s))',
+                [LOCK_NOVA_CONVERSA, chat_id]
+            )
+    
+    @staticmethod
+    def _registrar_mensagem_existente(atendimento, mensagem: WhatsAppMessage):
         """
-        # Buscar contato existente (ContatoCliente não tem campo telefone, apenas whatsapp)
-        contato = ContatoCliente.objects.filter(whatsapp=numero).first()
+        Mensagem recebida em conversa que já tem atendimento ativo.
         
-        if contato and contato.cliente:
-            return contato.cliente
+        A mensagem já foi gravada no atendimento (WhatsAppSessionService).
+        Na mesma transação, o contador do cliente é um único UPDATE com F()
+        (sem carregar o atendimento) e a mensagem entra no log de
+        alterações, no resumo e nos cursores de leitura.
         
-        # Buscar cliente pelo telefone principal
-        cliente = Cliente.objects.filter(telefone_principal=numero).first()
+        Args:
+            atendimento: ConversaAtiva do cache ou Atendimento
+        """
+        logger.debug(f"Chat {atendimento.chat_id} já tem atendimento ativo (ID: {atendimento.id})")
+        with transaction.atomic():
+            Atendimento.objects.filter(pk=atendimento.id).update(
+                total_mensagens_cliente=F('total_mensagens_cliente') + 1,
+                atualizado_em=timezone.now()
+            )
+            ChatService._vincular_mensagem(atendimento, mensagem)
         
-        if cliente:
-            return cliente
+        # Emitir evento de nova mensagem (para atualizar badge)
+        ChatService._emit_new_message_event(atendimento, mensagem)
+    
+    @staticmethod
+    def registrar_mensagem_enviada(mensagem: WhatsAppMessage):
+        """
+        Vincula uma mensagem enviada (outbound) ao atendimento ativo do chat,
+        se houver, e atualiza o resumo da conversa.
+        """
+        atendimento = get_conversa_ativa_service().obter(mensagem.chat_id)
+        
+        if atendimento:
+            ChatService._vincular_mensagem(atendimento, mensagem)
+    
+    @staticmethod
+    def _gravar_vinculo(atendimento, mensagem: WhatsAppMessage):
+        """
+        Grava o atendimento na mensagem, se ela ainda não nasceu com ele
+        (primeira mensagem de uma conversa nova).
+        """
+        if mensagem.atendimento_id != atendimento.id:
+            WhatsAppMessage.objects.filter(pk=mensagem.pk).update(atendimento_id=atendimento.id)
+            mensagem.atendimento_id = atendimento.id
+    
+    @staticmethod
+    def _vincular_mensagem(atendimento, mensagem: WhatsAppMessage):
+        """
+        Vincula a mensagem ao atendimento e a contabiliza no log de
+        alterações, no ChatSummary, nos cursores de leitura e no cache de
+        mensagens recentes do chat. Basta o id e o chat_id do atendimento
+        (ConversaAtiva ou Atendimento).
+        """
+        ChatService._gravar_vinculo(atendimento, mensagem)
+        record_chat_change(atendimento_id=atendimento.id, mensagem_id=mensagem.pk)
+        get_chat_summary_service().registrar_mensagem(atendimento, mensagem)
+        get_chat_read_service().registrar_mensagem(atendimento, mensagem)
+        get_recent_messages_cache().append(atendimento, mensagem)
+    
+    @staticmethod
+    def _get_or_create_cliente_id_by_numero(numero: str, nome: str = None) -> int:
+        """
+        Busca ou cria cliente pelo número de WhatsApp.
+        
+        A busca compara o número normalizado (E.164) com o WhatsApp dos
+        contatos e o telefone principal dos clientes (clientes.phone).
+        """
+        numeros = get_cliente_por_numero_service()
+        cliente_id = numeros.resolver(numero)
+        if cliente_id is not None:
+            return cliente_id
         
         # Criar novo cliente "temporário"
         nome_cliente = nome or f"Cliente {numero}"
@@ -127,9 +237,11 @@ class ChatService:
             telefone_principal=numero,
             status='ativo'
         )
+        # No commit: um cliente de transação desfeita não entra no LRU
+        transaction.on_commit(lambda: numeros.registrar(numero, cliente.id))
         
         logger.info(f"Cliente temporário criado: {cliente.razao_social} (ID: {cliente.id})")
-        return cliente
+        return cliente.id
     
     @staticmethod
     def _get_departamento_padrao():
@@ -186,20 +298,14 @@ class ChatService:
         
         for atendente in atendentes:
             try:
-                async_to_sync(channel_layer.group_send)(
-                    f'user_{atendente.id}_whatsapp',
-                    {
-                        'type': 'whatsapp.event',
-                        'event': event_data
-                    }
-                )
+                publish_user_event(atendente.id, event_data)
             except Exception as e:
                 logger.error(f"Erro ao enviar evento para atendente {atendente.id}: {e}")
         
         logger.info(f"Evento 'new_chat' emitido para {atendentes.count()} atendentes do chat {atendimento.chat_id}")
     
     @staticmethod
-    def _emit_new_message_event(atendimento: Atendimento, mensagem: WhatsAppMessage):
+    def _emit_new_message_event(atendimento, mensagem: WhatsAppMessage):
         """
         Emite evento WebSocket de NOVA MENSAGEM (chat existente).
         """
@@ -218,18 +324,15 @@ class ChatService:
                 'tipo': mensagem.message_type,
                 'de': mensagem.contact_name or mensagem.contact_number,
                 'criado_em': mensagem.created_at.isoformat()
-            }
+            },
+            'version': 'v1'
         }
         
-        # Enviar para atendente responsável (se houver)
-        if atendimento.atendente:
-            async_to_sync(channel_layer.group_send)(
-                f'user_{atendimento.atendente_id}',
-                {
-                    'type': 'chat.event',
-                    **event_data
-                }
-            )
+        # Enviar para atendente responsável (se houver) - atualiza o badge.
+        # O conteúdo da mensagem em si chega aos sockets com a conversa aberta
+        # pelo tópico chat_{chat_id} (ver chats.events).
+        if atendimento.atendente_id:
+            publish_user_event(atendimento.atendente_id, event_data)
 
 
 # Instância global do serviço
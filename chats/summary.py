@@ -0,0 +1,124 @@
+"""
+Manutenção incremental de ChatSummary.
+
+Cada mensagem registrada atualiza o resumo do atendimento com um único
+UPDATE (contadores via F()); o resumo é criado a partir das mensagens
+vinculadas (WhatsAppMessage.atendimento) na primeira vez que o atendimento
+recebe ou envia algo.
+"""
+import logging
+from typing import Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from atendimento.models import Atendimento
+from whatsapp.models import WhatsAppMessage
+
+from .models import ChatSummary
+
+logger = logging.getLogger(__name__)
+
+# Tamanho da prévia da última mensagem
+PREVIEW_LENGTH = 200
+
+ACTIVE_STATUSES = ('aguardando', 'em_atendimento', 'pausado')
+
+
+class ChatSummaryService:
+    """Atualiza e reconstrói os resumos de chat"""
+
+    @staticmethod
+    def _preview(mensagem: WhatsAppMessage) -> str:
+        return (mensagem.text_content or '')[:PREVIEW_LENGTH]
+
+    @staticmethod
+    def registrar_mensagem(atendimento: Atendimento, mensagem: WhatsAppMessage) -> None:
+        """
+        Contabiliza uma mensagem nova no resumo do atendimento.
+
+        Recebidas incrementam as não lidas; enviadas zeram as não lidas e
+        registram a última resposta do atendente.
+        """
+        fields = {
+            'ultima_mensagem_texto': ChatSummaryService._preview(mensagem),
+            'ultima_mensagem_tipo': mensagem.message_type,
+            'ultima_mensagem_direcao': mensagem.direction,
+            'ultima_mensagem_em': mensagem.created_at,
+            'total_mensagens': F('total_mensagens') + 1,
+            'atualizado_em': timezone.now(),
+        }
+        if mensagem.direction == 'inbound':
+            fields['mensagens_nao_lidas'] = F('mensagens_nao_lidas') + 1
+        else:
+            fields['mensagens_nao_lidas'] = 0
+            fields['ultima_resposta_em'] = mensagem.created_at
+
+        if ChatSummary.objects.filter(atendimento_id=atendimento.id).update(**fields):
+            return
+
+        # Primeiro registro do atendimento: calcula a partir das mensagens vinculadas
+        ChatSummaryService.rebuild(atendimento)
+
+    @staticmethod
+    def rebuild(atendimento: Atendimento) -> ChatSummary:
+        """Recalcula o resumo de um atendimento a partir das mensagens vinculadas a ele"""
+        mensagens = WhatsAppMessage.objects.filter(atendimento_id=atendimento.id)
+        totais = mensagens.aggregate(
+            total=Count('id'),
+            ultima_resposta_em=Max('created_at', filter=Q(direction='outbound')),
+        )
+        nao_lidas = mensagens.filter(direction='inbound')
+        if totais['ultima_resposta_em']:
+            nao_lidas = nao_lidas.filter(created_at__gt=totais['ultima_resposta_em'])
+        ultima = mensagens.order_by('-created_at').only(
+            'text_content', 'message_type', 'direction', 'created_at'
+        ).first()
+
+        defaults = {
+            'chat_id': atendimento.chat_id,
+            'ultima_mensagem_texto': ChatSummaryService._preview(ultima) if ultima else '',
+            'ultima_mensagem_tipo': ultima.message_type if ultima else '',
+            'ultima_mensagem_direcao': ultima.direction if ultima else '',
+            'ultima_mensagem_em': ultima.created_at if ultima else None,
+            'ultima_resposta_em': totais['ultima_resposta_em'],
+            'total_mensagens': totais['total'],
+            'mensagens_nao_lidas': nao_lidas.count(),
+        }
+
+        try:
+            with transaction.atomic():
+                summary, _ = ChatSummary.objects.update_or_create(
+                    atendimento_id=atendimento.id, defaults=defaults
+                )
+        except IntegrityError:
+            # Criado em paralelo por outra mensagem: o resultado recalculado vale
+            ChatSummary.objects.filter(atendimento_id=atendimento.id).update(**defaults)
+            summary = ChatSummary.objects.get(atendimento_id=atendimento.id)
+        return summary
+
+    @staticmethod
+    def rebuild_many(atendimentos: Iterable[Atendimento]) -> int:
+        """Reconstrói vários resumos; retorna quantos foram recalculados"""
+        total = 0
+        for atendimento in atendimentos:
+            ChatSummaryService.rebuild(atendimento)
+            total += 1
+        return total
+
+    @staticmethod
+    def get(atendimento: Atendimento) -> Optional[ChatSummary]:
+        """Resumo já carregado (select_related) ou None"""
+        try:
+            return atendimento.resumo
+        except ChatSummary.DoesNotExist:
+            return None
+
+
+_summary_service = ChatSummaryService()
+
+
+def get_chat_summary_service() -> ChatSummaryService:
+    """Retorna instância global do serviço"""
+    return _summary_service
@@ -0,0 +1,22 @@
+"""
+Tasks Celery para chats.
+"""
+import logging
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def prune_chat_changes():
+    """
+    Task periódica que poda o log do delta-sync (ChatChange).
+    
+    Tokens anteriores à retenção recebem reset=true em /chats/changes/.
+    """
+    from chats.changes import get_chat_change_service
+    
+    deleted = get_chat_change_service().prune()
+    logger.info(f"[Task] {deleted} alterações de chat podadas")
+    return {'removidas': deleted}
+
@@ -1,15 +1,34 @@
 """
 Testes para API de Chats (Issue #85).
 """
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 
 from atendimento.models import Atendimento, Departamento, FilaAtendimento
-from clientes.models import Cliente
+from clientes.models import Cliente, ContatoCliente
+from clientes.phone import get_cliente_por_numero_service
 from whatsapp.models import WhatsAppSession, WhatsAppMessage
+from chats.active_conversations import get_conversa_ativa_service
+from chats.changes import encode_token
+from chats.message_cache import RecentMessagesCache, _LruMemoria, chat_cache_requests
+from chats.models import ChatChange, ChatReadCursor, ChatSummary
+from chats.read_cursors import get_chat_read_service
 from chats.service import ChatService
+from core.event_stream import user_group_name
+from chats.summary import get_chat_summary_service
 
 User = get_user_model()
 
@@ -57,13 +76,14 @@ class ChatAPITests(TestCase):
         )
         
         self.client.force_authenticate(user=self.atendente1)
+        cache.clear()
     
     def test_list_chats_empty(self):
         """Testa listagem de chats vazia"""
         response = self.client.get('/api/v1/chats/')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
     
     def test_list_chats_with_data(self):
         """Testa listagem de chats com dados"""
@@ -93,9 +113,380 @@ class ChatAPITests(TestCase):
         response = self.client.get('/api/v1/chats/')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['chat_id'], '5511999999999')
-        self.assertEqual(response.data[0]['status'], 'em_atendimento')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['chat_id'], '5511999999999')
+        self.assertEqual(response.data['results'][0]['status'], 'em_atendimento')
+    
+    def _criar_chats(self, quantidade, inicio=0):
+        """Cria atendimentos com uma mensagem recebida cada"""
+        for i in range(inicio, inicio + quantidade):
+            chat_id = f'55119000{i:05d}'
+            Atendimento.objects.create(
+                departamento=self.departamento,
+                cliente=self.cliente,
+                atendente=self.atendente1,
+                chat_id=chat_id,
+                numero_whatsapp=chat_id,
+                status='em_atendimento'
+            )
+            atendimento = Atendimento.objects.get(chat_id=chat_id)
+            mensagem = WhatsAppMessage.objects.create(
+                session=self.session,
+                usuario=self.atendente1,
+                atendimento=atendimento,
+                message_id=f'msg_lista_{i}',
+                direction='inbound',
+                message_type='text',
+                chat_id=chat_id,
+                contact_number=chat_id,
+                text_content=f'Mensagem {i}',
+                status='delivered'
+            )
+            get_chat_summary_service().registrar_mensagem(atendimento, mensagem)
+    
+    def test_list_chats_consultas_constantes(self):
+        """Listagem usa o mesmo número de consultas com 3 ou 30 chats"""
+        self._criar_chats(3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/chats/')
+        self.assertEqual(len(response.data['results']), 3)
+        
+        self._criar_chats(27, inicio=3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/chats/')
+        self.assertEqual(len(response.data['results']), 30)
+    
+    def test_list_chats_contadores(self):
+        """Total e não lidas contam apenas mensagens do atendimento atual"""
+        atendimento = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=self.cliente,
+            atendente=self.atendente1,
+            chat_id='5511999999999',
+            numero_whatsapp='5511999999999',
+            status='em_atendimento'
+        )
+        for i, direction in enumerate(['inbound', 'outbound', 'inbound', 'inbound']):
+            mensagem = WhatsAppMessage.objects.create(
+                session=self.session,
+                usuario=self.atendente1,
+                atendimento=atendimento,
+                message_id=f'msg_{i}',
+                direction=direction,
+                message_type='text',
+                chat_id='5511999999999',
+                contact_number='5511999999999',
+                text_content=f'Mensagem {i}',
+                status='delivered'
+            )
+            get_chat_summary_service().registrar_mensagem(atendimento, mensagem)
+        
+        chat = self.client.get('/api/v1/chats/').data['results'][0]
+        
+        self.assertEqual(chat['total_mensagens'], 4)
+        self.assertEqual(chat['mensagens_nao_lidas'], 2)
+        self.assertEqual(chat['ultima_mensagem_texto'], 'Mensagem 3')
+        
+        detalhe = self.client.get('/api/v1/chats/5511999999999/').data
+        self.assertEqual(detalhe['total_mensagens'], 4)
+        self.assertEqual(detalhe['mensagens_nao_lidas'], 2)
+        
+        # Divergência corrigida pela reconstrução
+        ChatSummary.objects.filter(atendimento=atendimento).update(total_mensagens=99, mensagens_nao_lidas=0)
+        get_chat_summary_service().rebuild(atendimento)
+        resumo = ChatSummary.objects.get(atendimento=atendimento)
+        self.assertEqual(resumo.total_mensagens, 4)
+        self.assertEqual(resumo.mensagens_nao_lidas, 2)
+    
+    def test_list_chats_paginacao_por_cursor(self):
+        """Páginas seguem o cursor sem repetir nem pular chats"""
+        self._criar_chats(5)
+        
+        response = self.client.get('/api/v1/chats/', {'page_size': 2, 'sort': 'created'})
+        vistos = [c['chat_id'] for c in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            vistos += [c['chat_id'] for c in response.data['results']]
+        
+        self.assertEqual(len(vistos), 5)
+        self.assertEqual(len(set(vistos)), 5)
+    
+    def test_list_chats_paginacao_com_empates(self):
+        """Valores iguais no campo de ordenação são desempatados por id (next e previous)"""
+        self._criar_chats(5)
+        
+        paginas = [self.client.get('/api/v1/chats/', {'page_size': 2, 'sort': 'priority'})]
+        while paginas[-1].data['next']:
+            paginas.append(self.client.get(paginas[-1].data['next']))
+        vistos = [c['chat_id'] for p in paginas for c in p.data['results']]
+        self.assertEqual(sorted(vistos), sorted(set(vistos)))
+        self.assertEqual(len(vistos), 5)
+        
+        anterior = self.client.get(paginas[-1].data['previous'])
+        self.assertEqual(
+            [c['chat_id'] for c in anterior.data['results']],
+            [c['chat_id'] for c in paginas[-2].data['results']]
+        )
+        self.assertEqual(self.client.get('/api/v1/chats/', {'cursor': 'lixo'}).status_code, 400)
+    
+    def test_changes_sem_token_pede_reset(self):
+        """Primeira chamada (ou token inválido) devolve reset e um token novo"""
+        self._criar_chats(2)
+        
+        for params in ({}, {'since': 'lixo'}):
+            response = self.client.get('/api/v1/chats/changes/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['reset'])
+            self.assertEqual(response.data['chats'], [])
+            self.assertTrue(response.data['token'])
+    
+    def test_changes_devolve_apenas_o_delta(self):
+        """Após o token, só o chat e a mensagem alterados são devolvidos"""
+        self._criar_chats(5)
+        token = self.client.get('/api/v1/chats/changes/').data['token']
+        
+        atendimento = Atendimento.objects.get(chat_id='5511900000003')
+        mensagem = WhatsAppMessage.objects.create(
+            session=self.session,
+            usuario=self.atendente1,
+            message_id='msg_delta',
+            direction='inbound',
+            message_type='text',
+            chat_id=atendimento.chat_id,
+            contact_number=atendimento.chat_id,
+            text_content='Nova',
+            status='delivered'
+        )
+        ChatService._vincular_mensagem(atendimento, mensagem)
+        
+        response = self.client.get('/api/v1/chats/changes/', {'since': token})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['reset'])
+        self.assertEqual([c['chat_id'] for c in response.data['chats']], [atendimento.chat_id])
+        self.assertEqual(response.data['chats'][0]['ultima_mensagem_texto'], 'Nova')
+        self.assertEqual([m['id'] for m in response.data['messages']], [mensagem.id])
+        
+        # Sem novas alterações, o próximo delta vem vazio
+        response = self.client.get('/api/v1/chats/changes/', {'since': response.data['token']})
+        self.assertEqual(response.data['chats'], [])
+        self.assertEqual(response.data['messages'], [])
+    
+    def test_changes_chat_encerrado_vem_em_removidos(self):
+        """Atendimento que saiu da listagem é sinalizado em removidos"""
+        self._criar_chats(1)
+        token = self.client.get('/api/v1/chats/changes/').data['token']
+        
+        atendimento = Atendimento.objects.get()
+        atendimento.status = 'finalizado'
+        atendimento.save()
+        
+        response = self.client.get('/api/v1/chats/changes/', {'since': token})
+        self.assertEqual(response.data['chats'], [])
+        self.assertEqual(response.data['removidos'], [atendimento.chat_id])
+    
+    def test_changes_reentrega_transacao_aberta_na_leitura_anterior(self):
+        """Seq menor que o do token volta quando sua transação era invisível à leitura"""
+        self._criar_chats(2)
+        atendimento = Atendimento.objects.get(chat_id='5511900000001')
+        atendimento.status = 'em_atendimento'
+        atendimento.atendente = self.atendente1
+        atendimento.save()
+        pendente = ChatChange.objects.filter(atendimento_id=atendimento.id).latest('seq')
+        self.assertIsNotNone(pendente.xid)
+        
+        # Leitura anterior já tinha passado desse seq, mas não via a transação dele
+        ultimo = ChatChange.objects.latest('seq').seq
+        token = encode_token(ultimo, pendente.xid)
+        response = self.client.get('/api/v1/chats/changes/', {'since': token})
+        
+        self.assertFalse(response.data['reset'])
+        self.assertIn(atendimento.chat_id, [c['chat_id'] for c in response.data['chats']])
+    
+    @override_settings(CHAT_CHANGES_RETENTION_HOURS=1)
+    def test_changes_token_expirado_pede_reset(self):
+        """Token anterior à retenção do log exige recarga completa"""
+        self._criar_chats(1)
+        antigo = encode_token(0, 0, issued_at=(timezone.now() - timedelta(hours=2)).timestamp())
+        
+        response = self.client.get('/api/v1/chats/changes/', {'since': antigo})
+        
+        self.assertTrue(response.data['reset'])
+    
+    @override_settings(CHAT_CHANGES_RETENTION_HOURS=1)
+    def test_prune_chat_changes(self):
+        """Poda remove apenas alterações mais antigas que a retenção"""
+        self._criar_chats(1)
+        ChatChange.objects.update(criado_em=timezone.now() - timedelta(hours=2))
+        ChatChange.objects.create(atendimento_id=1)
+        
+        from chats.tasks import prune_chat_changes
+        result = prune_chat_changes()
+        
+        self.assertGreater(result['removidas'], 0)
+        self.assertEqual(ChatChange.objects.count(), 1)
+    
+    def _receber_mensagem(self, atendimento, texto):
+        """Mensagem recebida vinculada ao atendimento (como na ingestão)"""
+        mensagem = WhatsAppMessage.objects.create(
+            session=self.session,
+            usuario=self.atendente1,
+            message_id=f'msg_{texto}',
+            direction='inbound',
+            message_type='text',
+            chat_id=atendimento.chat_id,
+            contact_number=atendimento.chat_id,
+            text_content=texto,
+            status='delivered'
+        )
+        ChatService._vincular_mensagem(atendimento, mensagem)
+        return mensagem
+    
+    def test_marcar_como_lido_por_atendente(self):
+        """Cursor de leitura zera o badge só de quem leu e conta as novas"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        atendimento.status = 'aguardando'
+        atendimento.save()
+        self._receber_mensagem(atendimento, 'segunda')
+        
+        response = self.client.post(f'/api/v1/chats/{atendimento.chat_id}/read/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['mensagens_nao_lidas'], 0)
+        
+        self._receber_mensagem(atendimento, 'terceira')
+        
+        lista = self.client.get('/api/v1/chats/').data['results']
+        self.assertEqual(lista[0]['mensagens_nao_lidas'], 1)
+        detalhe = self.client.get(f'/api/v1/chats/{atendimento.chat_id}/').data
+        self.assertEqual(detalhe['mensagens_nao_lidas'], 1)
+        
+        # Quem nunca leu continua com o contador do resumo
+        self.client.force_authenticate(user=self.atendente2)
+        lista = self.client.get('/api/v1/chats/').data['results']
+        self.assertEqual(lista[0]['mensagens_nao_lidas'], 3)
+    
+    def test_marcar_como_lido_nao_retrocede(self):
+        """Ler até uma mensagem anterior ao cursor não altera o cursor"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        primeira = WhatsAppMessage.objects.get()
+        segunda = self._receber_mensagem(atendimento, 'segunda')
+        url = f'/api/v1/chats/{atendimento.chat_id}/read/'
+        
+        self.client.post(url, {'message_id': primeira.id})
+        response = self.client.post(url, {'message_id': segunda.id})
+        self.assertEqual(response.data['ultima_mensagem_lida_id'], segunda.id)
+        
+        response = self.client.post(url, {'message_id': primeira.id})
+        self.assertEqual(response.data['ultima_mensagem_lida_id'], segunda.id)
+        self.assertEqual(response.data['mensagens_nao_lidas'], 0)
+        
+        response = self.client.post(url, {'message_id': 999999})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_leitura_sincronizada_entre_dispositivos(self):
+        """A leitura é publicada no stream do próprio atendente"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(user_group_name(self.atendente1.id), channel_name)
+        
+        self.client.post(f'/api/v1/chats/{atendimento.chat_id}/read/')
+        
+        event = async_to_sync(channel_layer.receive)(channel_name)['event']
+        self.assertEqual(event['event'], 'chat_read')
+        self.assertEqual(event['data']['chat_id'], atendimento.chat_id)
+        self.assertEqual(event['data']['mensagens_nao_lidas'], 0)
+    
+    def test_mensagens_primeira_pagina_do_cache(self):
+        """Após a primeira leitura, a página inicial sai do cache sem consultas"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        self._receber_mensagem(atendimento, 'segunda')
+        url = f'/api/v1/chats/{atendimento.chat_id}/messages/'
+        
+        do_banco = self.client.get(url).data
+        hits = chat_cache_requests.value(result='hit')
+        with self.assertNumQueries(0):
+            do_cache = self.client.get(url).data
+        
+        self.assertEqual(chat_cache_requests.value(result='hit'), hits + 1)
+        self.assertEqual(do_cache, do_banco)
+        self.assertEqual(
+            [m['text_content'] for m in do_cache['results']], ['segunda', 'Mensagem 0']
+        )
+    
+    def test_cache_de_mensagens_acompanha_ingestao_e_status(self):
+        """Mensagens novas e mudanças de status chegam ao cache"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        url = f'/api/v1/chats/{atendimento.chat_id}/messages/'
+        self.client.get(url)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            nova = self._receber_mensagem(atendimento, 'nova')
+            nova.mark_as_read()
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'limit': 1})
+        self.assertEqual(response.data['results'][0]['id'], nova.id)
+        self.assertEqual(response.data['results'][0]['status'], 'read')
+        self.assertTrue(response.data['has_older'])
+        
+        # A próxima página (cursor) vem do banco e continua de onde o cache parou
+        older = self.client.get(url, {'limit': 1, 'before': response.data['before']})
+        self.assertEqual(older.data['results'][0]['text_content'], 'Mensagem 0')
+    
+    def test_cache_de_mensagens_respeita_permissao(self):
+        """Chat em atendimento por outro atendente continua proibido via cache"""
+        self._criar_chats(1)
+        atendimento = Atendimento.objects.get()
+        url = f'/api/v1/chats/{atendimento.chat_id}/messages/'
+        self.client.get(url)
+        
+        self.client.force_authenticate(user=self.atendente2)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        # Transferência atualiza a permissão em cache, após o commit
+        with self.captureOnCommitCallbacks() as callbacks:
+            atendimento.atendente = self.atendente2
+            atendimento.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+    
+    def test_cache_de_mensagens_limite_de_memoria(self):
+        """Acima do orçamento, o chat acessado há mais tempo é removido"""
+        self._criar_chats(2)
+        recent = RecentMessagesCache(size=10, max_bytes=1)
+        for atendimento in Atendimento.objects.order_by('id'):
+            mensagens = list(WhatsAppMessage.objects.filter(atendimento=atendimento))
+            data = [recent._serialize(m) for m in mensagens]
+            version = recent.begin_fill(atendimento.chat_id)
+            self.assertTrue(recent.fill(atendimento, mensagens, data, False, version))
+        
+        primeiro, segundo = Atendimento.objects.order_by('id')
+        self.assertIsNone(recent.get_first_page(primeiro.chat_id, 10))
+        self.assertIsNotNone(recent.get_first_page(segundo.chat_id, 10))
+    
+    def test_indice_lru_poda_os_menos_acessados(self):
+        """O índice soma os bytes por chat e remove os de acesso mais antigo"""
+        lru = _LruMemoria()
+        self.assertEqual(lru.touch('a', 1, 40, 100), [])
+        self.assertEqual(lru.touch('b', 2, 40, 100), [])
+        # Regravar o mesmo chat substitui o tamanho em vez de somar
+        self.assertEqual(lru.touch('a', 3, 50, 100), [])
+        self.assertEqual(lru.touch('c', 4, 40, 100), ['b'])
+        # Leitura sem tamanho só atualiza o acesso
+        self.assertEqual(lru.touch('a', 5, None, 100), [])
+        self.assertEqual(lru.touch('d', 6, 60, 100), ['c', 'a'])
     
     def test_retrieve_chat(self):
         """Testa busca de um chat específico"""
@@ -130,6 +521,7 @@ class ChatAPITests(TestCase):
             WhatsAppMessage.objects.create(
                 session=self.session,
                 usuario=self.atendente1,
+                atendimento=atendimento,
                 message_id=f'msg_{i}',
                 direction='inbound',
                 message_type='text',
@@ -139,11 +531,15 @@ class ChatAPITests(TestCase):
                 status='delivered'
             )
         
-        response = self.client.get(f'/api/v1/chats/{atendimento.chat_id}/messages/')
+        response = self.client.get(
+            f'/api/v1/chats/{atendimento.chat_id}/messages/', {'include_total': 'true'}
+        )
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['estimated_total'], 3)
         self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['text_content'], 'Mensagem 2')
+        self.assertFalse(response.data['has_older'])
     
     def test_aceitar_chat(self):
         """Testa aceitar um chat em espera"""
@@ -211,6 +607,200 @@ class ChatServiceTests(TestCase):
         )
         
         self.service = ChatService()
+        cache.clear()
+        get_cliente_por_numero_service().limpar()
+    
+    def _receber(self, message_id, chat_id='5511888888888'):
+        mensagem = WhatsAppMessage.objects.create(
+            session=self.session,
+            usuario=self.atendente,
+            message_id=message_id,
+            direction='inbound',
+            message_type='text',
+            chat_id=chat_id,
+            contact_number=chat_id,
+            text_content=f'Mensagem {message_id}',
+            status='delivered'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.processar_nova_mensagem_recebida(mensagem)
+        return mensagem
+    
+    def _atendimento_em_andamento(self):
+        return Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=Cliente.objects.create(
+                razao_social='Cliente Teste',
+                cnpj='98.765.432/0001-10',
+                status='ativo'
+            ),
+            atendente=self.atendente,
+            chat_id='5511888888888',
+            numero_whatsapp='5511888888888',
+            status='em_atendimento'
+        )
+    
+    def test_mensagem_em_conversa_existente_sem_consultar_atendimento(self):
+        """Com o chat em cache, o atendimento não é lido e o contador é um UPDATE com F()"""
+        atendimento = self._atendimento_em_andamento()
+        self._receber('msg_1')
+        
+        with CaptureQueriesContext(connection) as queries:
+            self._receber('msg_2')
+        
+        atendimento_sql = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'atendimento_atendimento' in q['sql']
+        ]
+        self.assertEqual(atendimento_sql, [])
+        atendimento.refresh_from_db()
+        self.assertEqual(atendimento.total_mensagens_cliente, 2)
+        self.assertEqual(atendimento.mensagens.count(), 2)
+    
+    def test_mensagem_recebida_criada_ja_vinculada(self):
+        """Em conversa existente, a mensagem nasce com o atendimento (sem UPDATE depois)"""
+        from whatsapp.service import get_whatsapp_session_service
+        atendimento = self._atendimento_em_andamento()
+        self._receber('msg_1')
+        
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                mensagem = async_to_sync(get_whatsapp_session_service().handle_incoming_message)(
+                    user_id=self.atendente.id,
+                    from_number='5511888888888',
+                    chat_id='5511888888888',
+                    payload={'type': 'text', 'text': 'Oi'}
+                )
+                self.service.processar_nova_mensagem_recebida(mensagem)
+        
+        self.assertEqual(mensagem.atendimento_id, atendimento.id)
+        self.assertEqual(WhatsAppMessage.objects.get(pk=mensagem.pk).atendimento_id, atendimento.id)
+        self.assertFalse([
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE') and 'atendimento_id' in q['sql'].split('WHERE')[0]
+        ])
+    
+    def test_uma_alteracao_no_log_por_mensagem(self):
+        """Cada mensagem gera uma linha em ChatChange; gravações fora da API não geram"""
+        atendimento = self._atendimento_em_andamento()
+        self._receber('msg_1')
+        ultimo_seq = ChatChange.objects.order_by('-seq').values_list('seq', flat=True).first()
+        novas = ChatChange.objects.filter(seq__gt=ultimo_seq)
+        
+        self._receber('msg_2')
+        mensagem = WhatsAppMessage.objects.get(message_id='msg_2')
+        self.assertEqual(
+            list(novas.values_list('atendimento_id', 'mensagem_id')), [(atendimento.id, mensagem.id)]
+        )
+        
+        atendimento.avaliacao = 5
+        atendimento.save(update_fields=['avaliacao', 'atualizado_em'])
+        mensagem.save(update_fields=['payload'])
+        self.assertEqual(novas.count(), 1)
+        
+        mensagem.mark_as_read()
+        self.assertEqual(novas.count(), 2)
+    
+    def test_mensagem_em_conversa_existente_gravada_na_transacao_da_ingestao(self):
+        """Contador, resumo, cursores e log saem na própria ingestão, sem depender de cache nem broker"""
+        atendimento = self._atendimento_em_andamento()
+        self._receber('msg_1')
+        get_chat_read_service().marcar_como_lido(self.atendente, atendimento)
+        ultimo_seq = ChatChange.objects.order_by('-seq').values_list('seq', flat=True).first()
+        
+        mensagens = []
+        with CaptureQueriesContext(connection) as queries:
+            for texto in ('Oi', 'Tudo bem?'):
+                mensagem = WhatsAppMessage.objects.create(
+                    session=self.session,
+                    usuario=self.atendente,
+                    atendimento=atendimento,
+                    message_id=f'msg_{texto}',
+                    direction='inbound',
+                    chat_id='5511888888888',
+                    contact_number='5511888888888',
+                    text_content=texto,
+                    status='delivered'
+                )
+                self.service.processar_nova_mensagem_recebida(mensagem)
+                mensagens.append(mensagem)
+        
+        # Um UPDATE com F() por mensagem; o atendimento nunca é lido
+        atendimento_sql = [q['sql'] for q in queries.captured_queries if 'atendimento_atendimento' in q['sql']]
+        self.assertEqual([sql.split()[0] for sql in atendimento_sql], ['UPDATE', 'UPDATE'])
+        self.assertIn('"total_mensagens_cliente" + 1', atendimento_sql[0])
+        
+        atendimento.refresh_from_db()
+        self.assertEqual(atendimento.total_mensagens_cliente, 3)
+        resumo = ChatSummary.objects.get(atendimento=atendimento)
+        self.assertEqual(resumo.total_mensagens, 3)
+        self.assertEqual(resumo.mensagens_nao_lidas, 3)
+        self.assertEqual(resumo.ultima_mensagem_texto, 'Tudo bem?')
+        cursor = ChatReadCursor.objects.get(agente=self.atendente, atendimento=atendimento)
+        self.assertEqual(cursor.mensagens_nao_lidas, 2)
+        self.assertEqual(
+            sorted(ChatChange.objects.filter(seq__gt=ultimo_seq).values_list('mensagem_id', flat=True)),
+            [m.pk for m in mensagens]
+        )
+    
+    def test_conversa_ativa_e_um_registro_imutavel(self):
+        """obter() devolve os campos em cache, não um modelo parcial"""
+        atendimento = self._atendimento_em_andamento()
+        conversa = get_conversa_ativa_service().obter('5511888888888')
+        
+        self.assertNotIsInstance(conversa, Atendimento)
+        self.assertEqual(
+            (conversa.id, conversa.atendente_id, conversa.departamento_id, conversa.status),
+            (atendimento.id, self.atendente.id, self.departamento.id, 'em_atendimento')
+        )
+        with self.assertRaises(AttributeError):
+            conversa.status = 'finalizado'
+    
+    def test_numero_formatado_encontra_cliente_existente(self):
+        """O número do chat encontra o contato cadastrado em outro formato"""
+        cliente = Cliente.objects.create(
+            razao_social='Cliente Teste',
+            cnpj='98.765.432/0001-10',
+            status='ativo'
+        )
+        ContatoCliente.objects.create(cliente=cliente, nome='João Silva', whatsapp='+55 (11) 88888-8888')
+        
+        self._receber('msg_1')
+        
+        atendimento = Atendimento.objects.get(chat_id='5511888888888')
+        self.assertEqual(atendimento.cliente_id, cliente.id)
+        self.assertEqual(Cliente.objects.count(), 1)
+    
+    def test_cliente_excluido_em_outro_processo_e_resolvido_de_novo(self):
+        """Um cliente_id obsoleto no LRU é descartado e o número resolvido outra vez"""
+        cliente = Cliente.objects.create(
+            razao_social='Cliente Teste',
+            cnpj='98.765.432/0001-10',
+            telefone_principal='5511888888888',
+            status='ativo'
+        )
+        # Entrada gravada por outro processo antes da exclusão do cliente
+        get_cliente_por_numero_service().registrar('5511888888888', cliente.id + 1000)
+        
+        self._receber('msg_1')
+        
+        atendimento = Atendimento.objects.get(chat_id='5511888888888')
+        self.assertEqual(atendimento.cliente_id, cliente.id)
+        self.assertEqual(get_cliente_por_numero_service().resolver('5511888888888'), cliente.id)
+    
+    def test_finalizar_descarta_conversa_em_cache(self):
+        """Depois de finalizado, a próxima mensagem do chat abre um novo atendimento"""
+        atendimento = self._atendimento_em_andamento()
+        self._receber('msg_1')
+        self.assertEqual(get_conversa_ativa_service().obter('5511888888888').id, atendimento.id)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            atendimento.finalizar()
+        self._receber('msg_2')
+        
+        novo = get_conversa_ativa_service().obter('5511888888888')
+        self.assertNotEqual(novo.id, atendimento.id)
+        self.assertEqual(novo.status, 'aguardando')
     
     def test_processar_nova_mensagem_cria_atendimento(self):
         """Testa que nova mensagem cria atendimento automaticamente"""
@@ -240,6 +830,16 @@ class ChatServiceTests(TestCase):
         # Verificar que foi adicionado à fila
         fila = FilaAtendimento.objects.filter(chat_id='5511888888888').first()
         self.assertIsNotNone(fila)
+        
+        # Mensagem que abriu a conversa fica vinculada ao atendimento
+        mensagem.refresh_from_db()
+        self.assertEqual(mensagem.atendimento_id, atendimento.id)
+        
+        # Resumo inclui a mensagem que abriu a conversa
+        resumo = ChatSummary.objects.get(atendimento=atendimento)
+        self.assertEqual(resumo.total_mensagens, 1)
+        self.assertEqual(resumo.mensagens_nao_lidas, 1)
+        self.assertEqual(resumo.ultima_mensagem_texto, 'Preciso de ajuda')
     
     def test_processar_mensagem_atendimento_existente_nao_duplica(self):
         """Testa que mensagem em chat existente não cria novo atendimento"""
@@ -277,3 +877,152 @@ class ChatServiceTests(TestCase):
         # Verificar que não duplicou
         count = Atendimento.objects.filter(chat_id='5511888888888').count()
         self.assertEqual(count, 1)
+    
+    def test_mensagem_enviada_vinculada_ao_atendimento_ativo(self):
+        """Mensagem enviada é vinculada ao atendimento ativo e zera não lidas"""
+        cliente = Cliente.objects.create(
+            razao_social='Cliente Teste',
+            cnpj='98.765.432/0001-10',
+            status='ativo'
+        )
+        atendimento = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=cliente,
+            chat_id='5511888888888',
+            numero_whatsapp='5511888888888',
+            status='em_atendimento'
+        )
+        for i, direction in enumerate(['inbound', 'outbound']):
+            mensagem = WhatsAppMessage.objects.create(
+                session=self.session,
+                usuario=self.atendente,
+                message_id=f'msg_{i}',
+                direction=direction,
+                message_type='text',
+                chat_id='5511888888888',
+                contact_number='5511888888888',
+                text_content=f'Mensagem {i}',
+                status='delivered'
+            )
+            if direction == 'inbound':
+                self.service.processar_nova_mensagem_recebida(mensagem)
+            else:
+                self.service.registrar_mensagem_enviada(mensagem)
+        
+        self.assertEqual(atendimento.mensagens.count(), 2)
+        resumo = ChatSummary.objects.get(atendimento=atendimento)
+        self.assertEqual(resumo.total_mensagens, 2)
+        self.assertEqual(resumo.mensagens_nao_lidas, 0)
+        self.assertEqual(resumo.ultima_mensagem_direcao, 'outbound')
+
+
+class ChatServiceConcorrenteTests(TransactionTestCase):
+    """Primeiras mensagens simultâneas do mesmo chat (Postgres real)"""
+    
+    THREADS = 50
+    
+    def setUp(self):
+        cache.clear()
+        get_cliente_por_numero_service().limpar()
+        self.atendente = User.objects.create_user(username='atendente', password='pass123')
+        Departamento.objects.create(nome='Suporte', ativo=True)
+        self.session = WhatsAppSession.objects.create(usuario=self.atendente, status='ready')
+    
+    def test_mensagens_paralelas_criam_um_atendimento(self):
+        """Só uma mensagem cria a conversa; as demais entram no mesmo atendimento"""
+        mensagens = [
+            WhatsAppMessage.objects.create(
+                session=self.session,
+                usuario=self.atendente,
+                message_id=f'msg_{i}',
+                direction='inbound',
+                message_type='text',
+                chat_id='5511888888888',
+                contact_number='5511888888888',
+                text_content=f'Parte {i}',
+                status='delivered'
+            )
+            for i in range(self.THREADS)
+        ]
+        barreira = threading.Barrier(self.THREADS)
+        erros = []
+        
+        def processar(mensagem):
+            try:
+                barreira.wait()
+                ChatService.processar_nova_mensagem_recebida(mensagem)
+            except Exception as e:  # pragma: no cover - reportado abaixo
+                erros.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=processar, args=(mensagem,)) for mensagem in mensagens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(erros, [])
+        atendimento = Atendimento.objects.get(chat_id='5511888888888')
+        self.assertEqual(FilaAtendimento.objects.filter(chat_id='5511888888888').count(), 1)
+        self.assertEqual(Cliente.objects.count(), 1)
+        self.assertEqual(atendimento.mensagens.count(), self.THREADS)
+
+
+class BackfillMessageAtendimentoTests(TestCase):
+    """Testes do comando backfill_message_atendimento"""
+    
+    def test_backfill_por_atendimento(self):
+        atendente = User.objects.create_user(username='atendente', password='pass123')
+        departamento = Departamento.objects.create(nome='Suporte', ativo=True)
+        session = WhatsAppSession.objects.create(usuario=atendente, status='ready')
+        cliente = Cliente.objects.create(
+            razao_social='Cliente Teste',
+            cnpj='12.345.678/0001-90',
+            status='ativo'
+        )
+        
+        def mensagem(message_id, chat_id, criada_em):
+            msg = WhatsAppMessage.objects.create(
+                session=session,
+                usuario=atendente,
+                message_id=message_id,
+                direction='inbound',
+                message_type='text',
+                chat_id=chat_id,
+                contact_number=chat_id,
+                text_content=message_id,
+            )
+            WhatsAppMessage.objects.filter(pk=msg.pk).update(created_at=criada_em)
+            return msg
+        
+        def atendimento(chat_id, criado_em):
+            atend = Atendimento.objects.create(
+                departamento=departamento,
+                cliente=cliente,
+                chat_id=chat_id,
+                numero_whatsapp=chat_id,
+                status='finalizado'
+            )
+            Atendimento.objects.filter(pk=atend.pk).update(criado_em=criado_em)
+            return atend
+        
+        agora = timezone.now()
+        antigo = atendimento('5511000000001', agora - timedelta(days=10))
+        atual = atendimento('5511000000001', agora - timedelta(days=1))
+        
+        # A mensagem inicial é gravada instantes antes do atendimento
+        inicial = mensagem('m1', '5511000000001', agora - timedelta(days=10, seconds=1))
+        do_antigo = mensagem('m2', '5511000000001', agora - timedelta(days=5))
+        do_atual = mensagem('m3', '5511000000001', agora - timedelta(hours=2))
+        sem_atendimento = mensagem('m4', '5511000000002', agora)
+        
+        out = StringIO()
+        call_command('backfill_message_atendimento', '--batch-size', '2', stdout=out)
+        
+        self.assertIn('3 mensagens vinculadas', out.getvalue())
+        vinculos = dict(WhatsAppMessage.objects.values_list('message_id', 'atendimento_id'))
+        self.assertEqual(vinculos[inicial.message_id], antigo.id)
+        self.assertEqual(vinculos[do_antigo.message_id], antigo.id)
+        self.assertEqual(vinculos[do_atual.message_id], atual.id)
+        self.assertIsNone(vinculos[sem_atendimento.message_id])
@@ -8,7 +8,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Max, Count, OuterRef, Subquery, F, CharField, Value
+from django.db.models import Q
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
@@ -17,14 +17,22 @@ from asgiref.sync import async_to_sync
 import logging
 
 from atendimento.models import Atendimento, Departamento, FilaAtendimento
+from atendimento.scheduler import get_distribuicao_scheduler
+from core.pagination import KeysetPagination
 from whatsapp.models import WhatsAppMessage
+from .pagination import ChatCursorPagination
+from .changes import decode_token, get_chat_change_service
+from .message_cache import get_recent_messages_cache
+from .read_cursors import get_chat_read_service
+from .summary import get_chat_summary_service
 from .serializers import (
     ChatListSerializer,
     ChatDetailSerializer,
     ChatMessageSerializer,
     AceitarChatSerializer,
     TransferirChatSerializer,
-    EncerrarChatSerializer
+    EncerrarChatSerializer,
+    MarcarLidoSerializer
 )
 
 logger = logging.getLogger(__name__)
@@ -36,26 +44,49 @@ class ChatViewSet(viewsets.ViewSet):
     
     Endpoints:
     - GET /chats/ - Lista todos os chats
+    - GET /chats/changes/?since=<token> - Alterações desde o token (delta-sync)
     - GET /chats/{chat_id}/ - Detalhes de um chat
     - GET /chats/{chat_id}/messages/ - Mensagens do chat
+    - POST /chats/{chat_id}/read/ - Marcar chat como lido
     - POST /chats/{chat_id}/aceitar/ - Aceitar atendimento
     - POST /chats/{chat_id}/transferir/ - Transferir para outro atendente
     - POST /chats/{chat_id}/encerrar/ - Encerrar atendimento
     """
     permission_classes = [IsAuthenticated]
     
+    # Atendimentos cujas mensagens podem ser consultadas
+    MESSAGES_STATUSES = ['aguardando', 'em_atendimento', 'pausado', 'finalizado']
+    
     def list(self, request):
         """
-        Lista todos os chats disponíveis.
+        Lista os chats disponíveis, paginados por cursor.
+        
+        Última mensagem e contadores vêm de ChatSummary, na mesma consulta
+        dos atendimentos, independentemente do número de conversas.
         
         Query params:
         - status: aguardando, em_atendimento, finalizado
         - atendente: filtrar por ID do atendente
         - departamento: filtrar por ID do departamento
-        - sort: campo de ordenação (lastMessage, priority, created)
+        - sort: campo de ordenação (lastMessage, priority, created, updated)
         - order: asc ou desc
+        - cursor / page_size: paginação (ver ChatCursorPagination)
         """
-        # Filtros
+        atendimentos = self._annotate_chat_list(
+            Atendimento.objects.filter(self._list_filters(request)).select_related(
+                'cliente', 'atendente', 'departamento'
+            ),
+            request.user
+        )
+        
+        paginator = ChatCursorPagination()
+        page = paginator.paginate_queryset(atendimentos, request, view=self)
+        serializer = ChatListSerializer([self._chat_row(atend) for atend in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    @staticmethod
+    def _list_filters(request):
+        """Filtros da listagem (query params + visibilidade do usuário)"""
         filters = Q()
         
         status_filter = request.query_params.get('status')
@@ -77,106 +108,125 @@ class ChatViewSet(viewsets.ViewSet):
         if not request.user.is_superuser:
             filters &= (Q(atendente=request.user) | Q(status='aguardando'))
         
-        # Subquery para última mensagem
-        ultima_msg = WhatsAppMessage.objects.filter(
-            chat_id=OuterRef('chat_id'),
-            created_at__gte=OuterRef('criado_em')
-        ).order_by('-created_at')
-        
-        # Query principal
-        atendimentos = Atendimento.objects.filter(filters).select_related(
-            'cliente', 'atendente', 'departamento'
-        ).annotate(
-            ultima_mensagem_texto=Subquery(ultima_msg.values('text_content')[:1]),
-            ultima_mensagem_em=Subquery(ultima_msg.values('created_at')[:1]),
-            ultima_mensagem_tipo=Subquery(ultima_msg.values('message_type')[:1]),
-            ultima_mensagem_direcao=Subquery(ultima_msg.values('direction')[:1]),
-            total_mensagens=Count('chat_id'),  # Simplified
+        return filters
+    
+    @staticmethod
+    def _annotate_chat_list(queryset, agente):
+        """
+        Junta o resumo do chat (ChatSummary), as não lidas do cursor de leitura
+        do atendente e a chave de ordenação por atividade; nenhuma leitura de
+        WhatsAppMessage.
+        """
+        queryset = get_chat_read_service().annotate_nao_lidas(queryset, agente)
+        return queryset.select_related('resumo').annotate(
+            atividade_em=Coalesce('resumo__ultima_mensagem_em', 'criado_em'),
         )
-        
-        # Ordenação
-        sort_field = request.query_params.get('sort', 'lastMessage')
-        order = request.query_params.get('order', 'desc')
-        
-        ordering_map = {
-            'lastMessage': 'ultima_mensagem_em',
-            'priority': 'prioridade',
-            'created': 'criado_em',
-            'updated': 'atualizado_em'
+    
+    @staticmethod
+    def _chat_row(atend):
+        """Linha da listagem a partir de um atendimento com o resumo carregado"""
+        resumo = get_chat_summary_service().get(atend)
+        return {
+            'chat_id': atend.chat_id,
+            'numero_whatsapp': atend.numero_whatsapp,
+            # Cliente
+            'cliente_id': atend.cliente_id,
+            'cliente_nome': atend.cliente.razao_social if atend.cliente else None,
+            'cliente_email': atend.cliente.email_principal if atend.cliente else None,
+            # Atendimento
+            'atendimento_id': atend.id,
+            'status': atend.status,
+            'prioridade': atend.prioridade,
+            # Atendente
+            'atendente_id': atend.atendente_id,
+            'atendente_nome': atend.atendente.display_name if atend.atendente else None,
+            # Departamento
+            'departamento_id': atend.departamento_id,
+            'departamento_nome': atend.departamento.nome if atend.departamento else None,
+            # Última mensagem
+            'ultima_mensagem_texto': resumo.ultima_mensagem_texto if resumo else None,
+            'ultima_mensagem_em': resumo.ultima_mensagem_em if resumo else None,
+            'ultima_mensagem_tipo': resumo.ultima_mensagem_tipo if resumo else None,
+            'ultima_mensagem_direcao': resumo.ultima_mensagem_direcao if resumo else None,
+            # Contadores
+            'total_mensagens': resumo.total_mensagens if resumo else 0,
+            'mensagens_nao_lidas': (
+                atend.nao_lidas_agente if atend.nao_lidas_agente is not None
+                else resumo.mensagens_nao_lidas if resumo else 0
+            ),
+            # Timestamps
+            'criado_em': atend.criado_em,
+            'atualizado_em': atend.atualizado_em,
         }
-        
-        order_field = ordering_map.get(sort_field, 'ultima_mensagem_em')
-        if order == 'asc':
-            atendimentos = atendimentos.order_by(order_field)
-        else:
-            atendimentos = atendimentos.order_by(f'-{order_field}')
-        
-        # Construir resposta
-        chats = []
-        for atend in atendimentos:
-            # Calcular mensagens não lidas
-            ultima_msg_atendente = WhatsAppMessage.objects.filter(
-                chat_id=atend.chat_id,
-                direction='outbound',
-                created_at__gte=atend.criado_em
-            ).aggregate(Max('created_at'))['created_at__max']
-            
-            if ultima_msg_atendente:
-                nao_lidas = WhatsAppMessage.objects.filter(
-                    chat_id=atend.chat_id,
-                    direction='inbound',
-                    created_at__gt=ultima_msg_atendente
-                ).count()
-            else:
-                nao_lidas = WhatsAppMessage.objects.filter(
-                    chat_id=atend.chat_id,
-                    direction='inbound',
-                    created_at__gte=atend.criado_em
-                ).count()
-            
-            chats.append({
-                'chat_id': atend.chat_id,
-                'numero_whatsapp': atend.numero_whatsapp,
-                # Cliente
-                'cliente_id': atend.cliente_id,
-                'cliente_nome': atend.cliente.razao_social if atend.cliente else None,
-                'cliente_email': atend.cliente.email_principal if atend.cliente else None,
-                # Atendimento
-                'atendimento_id': atend.id,
-                'status': atend.status,
-                'prioridade': atend.prioridade,
-                # Atendente
-                'atendente_id': atend.atendente_id,
-                'atendente_nome': atend.atendente.display_name if atend.atendente else None,
-                # Departamento
-                'departamento_id': atend.departamento_id,
-                'departamento_nome': atend.departamento.nome if atend.departamento else None,
-                # Última mensagem
-                'ultima_mensagem_texto': atend.ultima_mensagem_texto,
-                'ultima_mensagem_em': atend.ultima_mensagem_em,
-                'ultima_mensagem_tipo': atend.ultima_mensagem_tipo,
-                'ultima_mensagem_direcao': atend.ultima_mensagem_direcao,
-                # Contadores
-                'total_mensagens': WhatsAppMessage.objects.filter(
-                    chat_id=atend.chat_id,
-                    created_at__gte=atend.criado_em
-                ).count(),
-                'mensagens_nao_lidas': nao_lidas,
-                # Timestamps
-                'criado_em': atend.criado_em,
-                'atualizado_em': atend.atualizado_em,
-            })
-        
-        serializer = ChatListSerializer(chats, many=True)
-        return Response(serializer.data)
     
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        """
+        Delta-sync: atendimentos e mensagens alterados desde o token.
+
+        Query params:
+        - since: token devolvido pela chamada anterior (ausente na primeira)
+        - status / atendente / departamento: mesmos filtros da listagem
+
+        Sem token, com token inválido ou anterior à retenção do log, devolve
+        reset=true e um token novo: o cliente recarrega a lista completa.
+        Atendimentos alterados que saíram do filtro vêm em `removidos`.
+        """
+        service = get_chat_change_service()
+        since = request.query_params.get('since')
+        decoded = decode_token(since) if since else None
+        if decoded is None or service.is_expired(decoded[1]):
+            return Response({
+                'reset': True,
+                'token': service.current_token(),
+                'has_more': False,
+                'chats': [],
+                'removidos': [],
+                'messages': [],
+            })
+
+        delta = service.changes_since(decoded[0])
+        atendimento_ids = set(delta['atendimento_ids'])
+        mensagens = list(
+            WhatsAppMessage.objects.filter(id__in=delta['mensagem_ids'])
+            .select_related('usuario')
+            .order_by('created_at', 'id')
+        ) if delta['mensagem_ids'] else []
+        atendimento_ids.update(m.atendimento_id for m in mensagens if m.atendimento_id)
+
+        atendimentos = list(self._annotate_chat_list(
+            Atendimento.objects.filter(self._list_filters(request), id__in=atendimento_ids)
+            .select_related('cliente', 'atendente', 'departamento'),
+            request.user
+        ).order_by('-atividade_em', 'id')) if atendimento_ids else []
+        visiveis = {atend.id for atend in atendimentos}
+        ocultos = atendimento_ids - visiveis
+        removidos = set(
+            Atendimento.objects.filter(id__in=ocultos).values_list('chat_id', flat=True)
+        ) if ocultos else set()
+
+        mensagens = [m for m in mensagens if m.atendimento_id in visiveis]
+        return Response({
+            'reset': False,
+            'token': delta['token'],
+            'has_more': delta['has_more'],
+            'chats': ChatListSerializer(
+                [self._chat_row(atend) for atend in atendimentos], many=True
+            ).data,
+            'removidos': sorted(removidos - {atend.chat_id for atend in atendimentos}),
+            'messages': ChatMessageSerializer(mensagens, many=True).data,
+        })
+
     def retrieve(self, request, pk=None):
         """
         Retorna detalhes de um chat específico (por chat_id).
         """
         # Buscar atendimento ativo por chat_id
         atendimento = get_object_or_404(
-            Atendimento.objects.select_related('cliente', 'atendente', 'departamento'),
+            get_chat_read_service().annotate_nao_lidas(
+                Atendimento.objects.select_related('cliente', 'atendente', 'departamento', 'resumo'),
+                request.user
+            ),
             chat_id=pk,
             status__in=['aguardando', 'em_atendimento', 'pausado']
         )
@@ -198,48 +248,118 @@ class ChatViewSet(viewsets.ViewSet):
         """
         Lista mensagens de um chat específico (apenas do atendimento atual).
         
-        Query params:
+        Query params (ver core.pagination.KeysetPagination):
         - limit: número de mensagens (padrão: 50)
-        - offset: paginação
+        - before / after: cursores para mensagens mais antigas / mais novas
+        - include_total: inclui estimated_total
+        
+        A primeira página (sem cursores) vem do cache de mensagens recentes
+        do chat quando disponível, sem consultas ao banco.
         """
+        paginator = KeysetPagination()
+        recent = get_recent_messages_cache()
+        primeira_pagina = not any(
+            request.query_params.get(param) for param in ('before', 'after', 'include_total')
+        )
+        
+        version = None
+        if primeira_pagina:
+            cached = recent.get_first_page(pk, paginator.get_limit(request))
+            if cached and cached['meta']['status'] in self.MESSAGES_STATUSES:
+                meta = cached['meta']
+                if not self._pode_ver_mensagens(request.user, meta['atendente_id'], meta['status']):
+                    return self._mensagens_forbidden()
+                return Response({
+                    'results': cached['results'],
+                    'before': cached['before'],
+                    'after': cached['after'],
+                    'has_older': cached['has_older'],
+                    'has_newer': False,
+                })
+            version = recent.begin_fill(pk)
+        
         # Buscar atendimento
         atendimento = get_object_or_404(
             Atendimento,
             chat_id=pk,
-            status__in=['aguardando', 'em_atendimento', 'pausado', 'finalizado']
+            status__in=self.MESSAGES_STATUSES
         )
         
+        # Verificar permissão
+        if not self._pode_ver_mensagens(request.user, atendimento.atendente_id, atendimento.status):
+            return self._mensagens_forbidden()
+        
+        # Buscar mensagens APENAS deste atendimento
+        mensagens = WhatsAppMessage.objects.filter(
+            atendimento=atendimento
+        ).select_related('usuario')
+        
+        page = paginator.paginate_queryset(mensagens, request, view=self)
+        serializer = ChatMessageSerializer(page, many=True)
+        if primeira_pagina:
+            recent.fill(atendimento, page, serializer.data, paginator.has_older, version)
+        return paginator.get_paginated_response(serializer.data)
+    
+    @staticmethod
+    def _pode_ver_mensagens(user, atendente_id, status_atendimento):
+        """Chat de outro atendente só é visível aguardando ou finalizado"""
+        if user.is_superuser or not atendente_id or atendente_id == user.id:
+            return True
+        return status_atendimento in ['aguardando', 'finalizado']
+    
+    @staticmethod
+    def _mensagens_forbidden():
+        return Response(
+            {'error': 'Você não tem permissão para visualizar este chat'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    @action(detail=True, methods=['post'], url_path='read')
+    def read(self, request, pk=None):
+        """
+        Marca o chat como lido pelo usuário atual.
+
+        Body:
+        {
+            "message_id": 150  // opcional, padrão: última mensagem do chat
+        }
+
+        O cursor nunca retrocede; a leitura é enviada (evento chat_read) aos
+        outros dispositivos do usuário.
+        """
+        serializer = MarcarLidoSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        atendimento = get_object_or_404(
+            Atendimento,
+            chat_id=pk,
+            status__in=['aguardando', 'em_atendimento', 'pausado']
+        )
+
         # Verificar permissão
         if not request.user.is_superuser:
             if atendimento.atendente and atendimento.atendente != request.user:
-                if atendimento.status not in ['aguardando', 'finalizado']:
+                if atendimento.status != 'aguardando':
                     return Response(
                         {'error': 'Você não tem permissão para visualizar este chat'},
                         status=status.HTTP_403_FORBIDDEN
                     )
-        
-        # Buscar mensagens APENAS deste atendimento
-        mensagens = WhatsAppMessage.objects.filter(
-            chat_id=pk,
-            created_at__gte=atendimento.criado_em
-        ).select_related('usuario').order_by('-created_at')
-        
-        # Paginação simples
-        limit = int(request.query_params.get('limit', 50))
-        offset = int(request.query_params.get('offset', 0))
-        
-        total = mensagens.count()
-        mensagens = mensagens[offset:offset + limit]
-        
-        serializer = ChatMessageSerializer(mensagens, many=True)
-        
-        return Response({
-            'total': total,
-            'limit': limit,
-            'offset': offset,
-            'results': serializer.data
-        })
-    
+
+        message_id = serializer.validated_data.get('message_id')
+        if message_id is not None and not WhatsAppMessage.objects.filter(
+            id=message_id, atendimento=atendimento
+        ).exists():
+            return Response(
+                {'error': 'Mensagem não pertence a este chat'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        service = get_chat_read_service()
+        cursor = service.marcar_como_lido(request.user, atendimento, message_id)
+        service.publicar_leitura(request.user, atendimento, cursor)
+
+        return Response(service.build_event_data(atendimento, cursor))
+
     @action(detail=True, methods=['post'], url_path='aceitar')
     def aceitar(self, request, pk=None):
         """
@@ -365,6 +485,9 @@ class ChatViewSet(viewsets.ViewSet):
             atendimento.departamento = departamento_destino
         atendimento.save()
         
+        # A saída do chat libera uma vaga do atendente de origem
+        get_distribuicao_scheduler().agendar_para_atendente(transferencia.atendente_origem_id, 'transferido')
+        
         # Emitir evento WebSocket
         self._emit_event('chat_transferred', {
             'chat_id': pk,
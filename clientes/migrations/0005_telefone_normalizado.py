@@ -0,0 +1,79 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:52
+
+import re
+
+from django.db import migrations, models
+
+LOTE = 1000
+
+# Cópia de clientes.phone no momento da migração
+DDI_PADRAO = '55'
+NACIONAL_BR = (10, 11)
+
+
+def normalizar_telefone(numero):
+    if not numero:
+        return None
+
+    numero = str(numero).split('@', 1)[0].strip()
+    internacional = numero.startswith('+')
+    digitos = re.sub(r'\D', '', numero)
+
+    if not internacional and digitos.startswith('00'):
+        digitos, internacional = digitos[2:], True
+    if not internacional:
+        nacional = digitos.lstrip('0')
+        if len(nacional) in NACIONAL_BR:
+            digitos = DDI_PADRAO + nacional
+
+    if not 8 <= len(digitos) <= 15:
+        return None
+    return f"+{digitos}"
+
+
+def _preencher(model, origem, destino):
+    pendentes = []
+    queryset = model.objects.exclude(**{f'{origem}__isnull': True}).exclude(**{origem: ''})
+    for obj in queryset.only('id', origem).iterator(chunk_size=LOTE):
+        setattr(obj, destino, normalizar_telefone(getattr(obj, origem)))
+        pendentes.append(obj)
+        if len(pendentes) >= LOTE:
+            model.objects.bulk_update(pendentes, [destino])
+            pendentes = []
+    if pendentes:
+        model.objects.bulk_update(pendentes, [destino])
+
+
+def preencher_telefones_normalizados(apps, schema_editor):
+    """Normaliza os telefones já cadastrados, em lotes de LOTE linhas"""
+    _preencher(apps.get_model('clientes', 'Cliente'), 'telefone_principal', 'telefone_normalizado')
+    _preencher(apps.get_model('clientes', 'ContatoCliente'), 'whatsapp', 'whatsapp_normalizado')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0004_remove_cliente_clientes_cl_documen_76f212_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='telefone_normalizado',
+            field=models.CharField(blank=True, editable=False, help_text='Telefone principal em E.164, usado para localizar o cliente pelo número do chat', max_length=16, null=True, verbose_name='Telefone Normalizado'),
+        ),
+        migrations.AddField(
+            model_name='contatocliente',
+            name='whatsapp_normalizado',
+            field=models.CharField(blank=True, editable=False, help_text='WhatsApp em E.164, usado para localizar o cliente pelo número do chat', max_length=16, null=True, verbose_name='WhatsApp Normalizado'),
+        ),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['telefone_normalizado'], name='clientes_cl_telefon_94e189_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contatocliente',
+            index=models.Index(fields=['whatsapp_normalizado'], name='clientes_co_whatsap_f8cf35_idx'),
+        ),
+        migrations.RunPython(preencher_telefones_normalizados, migrations.RunPython.noop),
+    ]
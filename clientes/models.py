@@ -211,6 +211,15 @@ class Cliente(models.Model):
         help_text="Telefone principal da empresa"
     )
     
+    telefone_normalizado = models.CharField(
+        max_length=16,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="Telefone Normalizado",
+        help_text="Telefone principal em E.164, usado para localizar o cliente pelo número do chat"
+    )
+    
     # Endereço
     endereco = models.TextField(
         blank=True,
@@ -349,11 +358,27 @@ class Cliente(models.Model):
             models.Index(fields=['nome_fantasia']),
             models.Index(fields=['status']),
             models.Index(fields=['criado_em']),
+            models.Index(fields=['telefone_normalizado']),
         ]
     
     def __str__(self):
         return f"{self.razao_social} ({self.cnpj})"
     
+    def save(self, *args, **kwargs):
+        from .phone import get_cliente_por_numero_service, normalizar_telefone
+        anterior = self.telefone_normalizado
+        self.telefone_normalizado = normalizar_telefone(self.telefone_principal)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'telefone_principal' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'telefone_normalizado'}
+        super().save(*args, **kwargs)
+        get_cliente_por_numero_service().invalidar(anterior, self.telefone_normalizado)
+    
+    def delete(self, *args, **kwargs):
+        from .phone import get_cliente_por_numero_service
+        get_cliente_por_numero_service().invalidar(self.telefone_normalizado)
+        return super().delete(*args, **kwargs)
+    
     def clean(self):
         """Validações customizadas do modelo"""
         from django.core.exceptions import ValidationError
@@ -512,6 +537,15 @@ class ContatoCliente(models.Model):
         help_text="WhatsApp da pessoa (obrigatório para chat)"
     )
     
+    whatsapp_normalizado = models.CharField(
+        max_length=16,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="WhatsApp Normalizado",
+        help_text="WhatsApp em E.164, usado para localizar o cliente pelo número do chat"
+    )
+    
     email = models.EmailField(
         blank=True,
         null=True,
@@ -553,6 +587,7 @@ class ContatoCliente(models.Model):
         indexes = [
             models.Index(fields=['cliente', 'ativo']),
             models.Index(fields=['whatsapp']),
+            models.Index(fields=['whatsapp_normalizado']),
             models.Index(fields=['nome']),
         ]
         # Uma pessoa pode ter o mesmo WhatsApp em empresas diferentes do mesmo grupo
@@ -561,6 +596,21 @@ class ContatoCliente(models.Model):
     def __str__(self):
         return f"{self.nome} - {self.cliente.razao_social}"
     
+    def save(self, *args, **kwargs):
+        from .phone import get_cliente_por_numero_service, normalizar_telefone
+        anterior = self.whatsapp_normalizado
+        self.whatsapp_normalizado = normalizar_telefone(self.whatsapp)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'whatsapp' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'whatsapp_normalizado'}
+        super().save(*args, **kwargs)
+        get_cliente_por_numero_service().invalidar(anterior, self.whatsapp_normalizado)
+    
+    def delete(self, *args, **kwargs):
+        from .phone import get_cliente_por_numero_service
+        get_cliente_por_numero_service().invalidar(self.whatsapp_normalizado)
+        return super().delete(*args, **kwargs)
+    
     @property
     def contatos_disponiveis(self):
         """Retorna lista de contatos disponíveis"""
@@ -0,0 +1,166 @@
+"""
+Normalização de telefones (E.164) e resolução de cliente por número.
+
+Mensagens do WhatsApp chegam com o número em formatos variados
+("5511999999999", "+55 11 99999-9999", "5511999999999@c.us") e os cadastros
+guardam o que o usuário digitou. Para que o mesmo número sempre encontre o
+mesmo cliente, Cliente e ContatoCliente mantêm uma coluna indexada com o
+número em E.164 (telefone_normalizado / whatsapp_normalizado), preenchida no
+save a partir de normalizar_telefone().
+
+ClientePorNumeroService resolve número -> cliente_id com uma consulta (as
+duas colunas normalizadas numa única ida ao banco) e guarda o resultado num
+LRU em memória do processo (CLIENTE_NUMERO_LRU_SIZE entradas, válidas por
+CLIENTE_NUMERO_LRU_TTL_SECONDS). Gravações de telefone no próprio processo
+descartam a entrada; nos demais processos ela expira pelo TTL.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import IntegerField, Value
+
+# Código do país assumido para números sem DDI (DDD + número)
+DDI_PADRAO = '55'
+
+# Comprimento de números nacionais brasileiros: DDD + 8 (fixo) ou 9 (celular) dígitos
+NACIONAL_BR = (10, 11)
+
+
+def normalizar_telefone(numero: Optional[str]) -> Optional[str]:
+    """
+    Número em E.164 ("+5511999999999"), ou None se não parecer um telefone.
+
+    - "+55 (11) 99999-9999", "5511999999999" e "005511999999999" são o mesmo número
+    - sem DDI, "11999999999" e "011999999999" recebem o DDI_PADRAO
+    - sufixos de JID do WhatsApp ("@c.us", "@s.whatsapp.net") são ignorados
+    """
+    if not numero:
+        return None
+
+    numero = str(numero).split('@', 1)[0].strip()
+    internacional = numero.startswith('+')
+    digitos = re.sub(r'\D', '', numero)
+
+    if not internacional and digitos.startswith('00'):
+        # Prefixo de discagem internacional
+        digitos, internacional = digitos[2:], True
+    if not internacional:
+        nacional = digitos.lstrip('0')
+        if len(nacional) in NACIONAL_BR:
+            digitos = DDI_PADRAO + nacional
+
+    if not 8 <= len(digitos) <= 15:
+        return None
+    return f"+{digitos}"
+
+
+class _LRU:
+    """LRU com TTL, seguro entre threads"""
+
+    def __init__(self):
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl: int):
+        with self._lock:
+            item = self._dados.get(key)
+            if item is None:
+                return None
+            valor, gravado_em = item
+            if time.monotonic() - gravado_em > ttl:
+                del self._dados[key]
+                return None
+            self._dados.move_to_end(key)
+            return valor
+
+    def set(self, key, valor, size: int) -> None:
+        with self._lock:
+            self._dados[key] = (valor, time.monotonic())
+            self._dados.move_to_end(key)
+            while len(self._dados) > size:
+                self._dados.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._dados.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dados.clear()
+
+
+class ClientePorNumeroService:
+    """Resolução número (E.164) -> cliente_id com LRU em memória"""
+
+    def __init__(self):
+        self._lru = _LRU()
+
+    @staticmethod
+    def size() -> int:
+        return getattr(settings, 'CLIENTE_NUMERO_LRU_SIZE', 10000)
+
+    @staticmethod
+    def ttl() -> int:
+        return getattr(settings, 'CLIENTE_NUMERO_LRU_TTL_SECONDS', 300)
+
+    def resolver(self, numero: str) -> Optional[int]:
+        """
+        cliente_id do número: contato com esse WhatsApp ou, na falta dele,
+        cliente com esse telefone principal. None se nenhum.
+        """
+        normalizado = normalizar_telefone(numero)
+        if not normalizado:
+            return None
+
+        cliente_id = self._lru.get(normalizado, self.ttl())
+        if cliente_id is not None:
+            return cliente_id
+
+        cliente_id = self._buscar(normalizado)
+        if cliente_id is not None:
+            # No commit: uma linha vista só dentro de uma transação desfeita não entra no LRU
+            transaction.on_commit(lambda: self._lru.set(normalizado, cliente_id, self.size()))
+        return cliente_id
+
+    @staticmethod
+    def _buscar(normalizado: str) -> Optional[int]:
+        from .models import Cliente, ContatoCliente
+
+        # Uma consulta: os dois índices, com preferência pelo contato
+        contatos = ContatoCliente.objects.filter(whatsapp_normalizado=normalizado).annotate(
+            origem=Value(0, output_field=IntegerField())
+        ).values_list('cliente_id', 'origem')
+        clientes = Cliente.objects.filter(telefone_normalizado=normalizado).annotate(
+            origem=Value(1, output_field=IntegerField())
+        ).values_list('id', 'origem')
+
+        encontrado = contatos.order_by().union(clientes.order_by(), all=True).order_by('origem').first()
+        return encontrado[0] if encontrado else None
+
+    def registrar(self, numero: str, cliente_id: int) -> None:
+        """Associa o número a um cliente recém-criado"""
+        normalizado = normalizar_telefone(numero)
+        if normalizado:
+            self._lru.set(normalizado, cliente_id, self.size())
+
+    def invalidar(self, *numeros_normalizados: Optional[str]) -> None:
+        """Descarta números cujo cadastro mudou (apenas neste processo)"""
+        for numero in numeros_normalizados:
+            if numero:
+                self._lru.delete(numero)
+
+    def limpar(self) -> None:
+        self._lru.clear()
+
+
+_cliente_por_numero_service = ClientePorNumeroService()
+
+
+def get_cliente_por_numero_service() -> ClientePorNumeroService:
+    """Retorna instância global do serviço"""
+    return _cliente_por_numero_service
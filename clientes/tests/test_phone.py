@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase, TestCase
+
+from clientes.models import Cliente, ContatoCliente
+from clientes.phone import get_cliente_por_numero_service, normalizar_telefone
+
+
+class NormalizarTelefoneTests(SimpleTestCase):
+    """Testes da normalização E.164."""
+    
+    def test_formatos_do_mesmo_numero(self):
+        """Formatações diferentes do mesmo número resultam no mesmo E.164."""
+        for numero in [
+            '5511999999999',
+            '+55 (11) 99999-9999',
+            '005511999999999',
+            '11 99999-9999',
+            '011999999999',
+            '5511999999999@c.us',
+        ]:
+            with self.subTest(numero=numero):
+                self.assertEqual(normalizar_telefone(numero), '+5511999999999')
+    
+    def test_numero_fixo_e_estrangeiro(self):
+        self.assertEqual(normalizar_telefone('(11) 3333-4444'), '+551133334444')
+        self.assertEqual(normalizar_telefone('+1 415 555 2671'), '+14155552671')
+    
+    def test_valores_invalidos(self):
+        for numero in [None, '', 'abc', '123', '+1234567890123456']:
+            with self.subTest(numero=numero):
+                self.assertIsNone(normalizar_telefone(numero))
+
+
+class ClientePorNumeroTests(TestCase):
+    """Testes da resolução de cliente pelo número do chat."""
+    
+    def setUp(self):
+        self.numeros = get_cliente_por_numero_service()
+        self.numeros.limpar()
+        self.cliente = Cliente.objects.create(
+            razao_social='Empresa Teste LTDA',
+            cnpj='12.345.678/0001-90',
+            telefone_principal='+551133334444'
+        )
+    
+    def test_colunas_normalizadas_preenchidas_no_save(self):
+        contato = ContatoCliente.objects.create(
+            cliente=self.cliente,
+            nome='João Silva',
+            whatsapp='+5511999999999'
+        )
+        self.assertEqual(contato.whatsapp_normalizado, '+5511999999999')
+        self.assertEqual(self.cliente.telefone_normalizado, '+551133334444')
+        
+        self.cliente.telefone_principal = '11 2222-3333'
+        self.cliente.save(update_fields=['telefone_principal'])
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.cliente.telefone_normalizado, '+551122223333')
+    
+    def test_resolve_contato_e_telefone_principal(self):
+        """WhatsApp do contato tem preferência; formatos diferentes se encontram."""
+        outro = Cliente.objects.create(
+            razao_social='Outra Empresa',
+            cnpj='98.765.432/0001-10',
+            telefone_principal='5511999999999'
+        )
+        ContatoCliente.objects.create(cliente=self.cliente, nome='João Silva', whatsapp='+5511999999999')
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(self.numeros.resolver('5511999999999@c.us'), self.cliente.id)
+        self.assertEqual(self.numeros.resolver('(11) 3333-4444'), self.cliente.id)
+        self.assertIsNone(self.numeros.resolver('5521988887777'))
+        self.assertNotEqual(outro.id, self.cliente.id)
+    
+    def test_lru_evita_consulta(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.numeros.resolver('551133334444')
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(self.numeros.resolver('+55 11 3333-4444'), self.cliente.id)
+        
+        # Mudança de telefone no processo descarta a entrada
+        self.cliente.telefone_principal = '551122223333'
+        self.cliente.save()
+        self.assertIsNone(self.numeros.resolver('551133334444'))
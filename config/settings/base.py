@@ -105,9 +105,112 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Cache (compartilhado entre processos via Redis quando REDIS_URL estiver definido)
+REDIS_URL = env("REDIS_URL", default="")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            # O padrão (300) é pequeno para os buffers de replay e o cache de auth
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        }
+    }
+
+# Token do scrape de /metrics (header "Authorization: Metrics <token>"); sem ele, só administradores
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+
+# WebSocket - replay de eventos após reconexão (?since=<seq>)
+WS_REPLAY_BUFFER_SIZE = env.int("WS_REPLAY_BUFFER_SIZE", default=500)
+WS_REPLAY_TTL_SECONDS = env.int("WS_REPLAY_TTL_SECONDS", default=600)
+# Eventos pendentes de envio por conexão antes de descartar os mais antigos
+WS_OUTBOUND_QUEUE_SIZE = env.int("WS_OUTBOUND_QUEUE_SIZE", default=256)
+# Tempo máximo esperando o cliente ler (ou um envio terminar) antes de desconectar
+WS_SEND_TIMEOUT_SECONDS = env.int("WS_SEND_TIMEOUT_SECONDS", default=10)
+
+# Usuário autenticado no WebSocket fica em cache por (user_id, token_version)
+WS_AUTH_CACHE_TTL_SECONDS = env.int("WS_AUTH_CACHE_TTL_SECONDS", default=60)
+
+# Indicadores de digitação (estado só no cache)
+TYPING_TTL_SECONDS = env.int("TYPING_TTL_SECONDS", default=6)
+TYPING_THROTTLE_SECONDS = env.int("TYPING_THROTTLE_SECONDS", default=3)
+# Fração dos eventos de digitação gravada em TypingIndicator para análise (0 = nenhum)
+TYPING_DB_SAMPLE_RATE = env.float("TYPING_DB_SAMPLE_RATE", default=0.0)
+
+# Presença: heartbeat expira no cache após este tempo (agente é marcado offline)
+PRESENCE_HEARTBEAT_TTL_SECONDS = env.int("PRESENCE_HEARTBEAT_TTL_SECONDS", default=120)
+
+# Delta-sync de chats (GET /chats/changes/): retenção do log de alterações e linhas por resposta
+CHAT_CHANGES_RETENTION_HOURS = env.int("CHAT_CHANGES_RETENTION_HOURS", default=24)
+CHAT_CHANGES_MAX_ROWS = env.int("CHAT_CHANGES_MAX_ROWS", default=1000)
+
+# Cache das mensagens recentes por chat (primeira página de /chats/{id}/messages/):
+# mensagens por chat, TTL e limite total de memória (bytes, LRU entre chats)
+CHAT_RECENT_CACHE_SIZE = env.int("CHAT_RECENT_CACHE_SIZE", default=50)
+CHAT_RECENT_CACHE_TTL_SECONDS = env.int("CHAT_RECENT_CACHE_TTL_SECONDS", default=3600)
+CHAT_RECENT_CACHE_MAX_BYTES = env.int("CHAT_RECENT_CACHE_MAX_BYTES", default=64 * 1024 * 1024)
+
+# Atendimento ativo por chat em cache (mensagens recebidas)
+CHAT_ATIVO_CACHE_TTL_SECONDS = env.int("CHAT_ATIVO_CACHE_TTL_SECONDS", default=300)
+
+# Cliente por número de WhatsApp: LRU em memória de cada processo (entradas e validade em segundos)
+CLIENTE_NUMERO_LRU_SIZE = env.int("CLIENTE_NUMERO_LRU_SIZE", default=10000)
+CLIENTE_NUMERO_LRU_TTL_SECONDS = env.int("CLIENTE_NUMERO_LRU_TTL_SECONDS", default=300)
+
+# Distribuição automática: filas reivindicadas (SELECT ... SKIP LOCKED) por transação
+DISTRIBUICAO_BATCH_SIZE = env.int("DISTRIBUICAO_BATCH_SIZE", default=50)
+# Janela (segundos) que agrupa eventos de capacidade em uma passada por departamento; 0 distribui no commit
+DISTRIBUICAO_DEBOUNCE_SECONDS = env.int("DISTRIBUICAO_DEBOUNCE_SECONDS", default=2)
+# Validade (segundos) da carga dos atendentes em cache; ao expirar é recalculada do banco
+DISPONIBILIDADE_CARGA_TTL_SECONDS = env.int("DISPONIBILIDADE_CARGA_TTL_SECONDS", default=300)
+# Posição na fila: quantas posições do topo são publicadas a cada mudança (evento queue_position)
+FILA_POSICAO_PUSH_LIMITE = env.int("FILA_POSICAO_PUSH_LIMITE", default=50)
+# Intervalo (segundos) para reconstruir a posição na fila a partir do banco
+FILA_POSICAO_RESYNC_SECONDS = env.int("FILA_POSICAO_RESYNC_SECONDS", default=3600)
+# Tempo médio de atendimento (segundos) assumido antes do primeiro atendimento finalizado
+FILA_TMA_PADRAO_SECONDS = env.int("FILA_TMA_PADRAO_SECONDS", default=600)
+# Painel por departamento: no máximo um snapshot publicado por intervalo (segundos)
+DASHBOARD_INTERVALO_SECONDS = env.int("DASHBOARD_INTERVALO_SECONDS", default=1)
+
+# Celery: tasks agendadas por eventos (distribuição, painel) exigem o broker
+# (CELERY_BROKER_URL). Sem broker, CELERY_TASK_ALWAYS_EAGER=True executa as
+# tasks no próprio processo, sem countdown (padrão em desenvolvimento)
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER", default=False)
+
+# Tarefas periódicas (celery beat)
+CELERY_BEAT_SCHEDULE = {
+    "flush-agent-presence": {
+        "task": "accounts.tasks.flush_agent_presence",
+        "schedule": env.int("PRESENCE_FLUSH_INTERVAL_SECONDS", default=15),
+    },
+    "check-agent-presence-timeout": {
+        "task": "accounts.tasks.check_agent_presence_timeout",
+        "schedule": 30,
+    },
+    "prune-chat-changes": {
+        "task": "chats.tasks.prune_chat_changes",
+        "schedule": 3600,
+    },
+}
+
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "accounts.serializers.VersionedTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "accounts.serializers.VersionedTokenRefreshSerializer",
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "accounts.authentication.VersionedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
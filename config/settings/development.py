@@ -6,6 +6,10 @@ from .base import *  # noqa
 
 DEBUG = True
 
+# Sem worker/broker local, as tasks rodam no próprio processo; defina
+# CELERY_TASK_ALWAYS_EAGER=False no .env ao subir o worker (docker-compose)
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER", default=True)  # noqa: F405
+
 # CORS: A configuração está em base.py
 # Se precisar adicionar origins específicas de desenvolvimento, configure a
 # variável de ambiente CORS_ALLOWED_ORIGINS no arquivo .env
@@ -14,6 +14,7 @@ from core.views.whatsapp import (
     WhatsAppSendMessageView,
 )
 from core.views.upload import AppearanceUploadView
+from core.views.metrics import metrics_view
 from accounts.views import (
     AgentGroupsView,
     GroupDetailView,
@@ -47,6 +48,8 @@ def me_view(request):
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/v1/health/", health_view),
+    # Métricas Prometheus (scrape em monitoring/prometheus.yml)
+    path("metrics", metrics_view, name="metrics"),
     # Auth JWT (v1)
     path("api/v1/auth/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/v1/auth/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
@@ -58,6 +61,7 @@ urlpatterns = [
     path("api/v1/presence/me/", AgentPresenceViewSet.as_view({'get': 'my_presence'}), name="my-presence"),
     path("api/v1/presence/set-status/", AgentPresenceViewSet.as_view({'post': 'set_status'}), name="set-status"),
     path("api/v1/presence/heartbeat/", AgentPresenceViewSet.as_view({'post': 'heartbeat'}), name="heartbeat"),
+    path("api/v1/presence/snapshot/", AgentPresenceViewSet.as_view({'get': 'snapshot'}), name="presence-snapshot"),
     path("api/v1/typing/", TypingIndicatorView.as_view(), name="typing"),
     # Config (v1)
     path("api/v1/config/", ConfigView.as_view()),
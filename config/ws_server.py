@@ -0,0 +1,97 @@
+"""
+Daphne com suporte a permessage-deflate (RFC 7692) nos WebSockets.
+
+O Daphne usa o Autobahn, que implementa a extensão, mas não a aceita por
+padrão. Este módulo roda o mesmo CLI do Daphne aceitando a oferta de
+compressão do cliente (navegadores enviam por padrão):
+
+    python -m config.ws_server -b 0.0.0.0 -p 8000 config.asgi:application
+
+WS_PERMESSAGE_DEFLATE=0 desativa a extensão sem trocar o comando.
+
+O escopo de cada WebSocket também recebe a extensão x-write-buffer
+(whatsapp.outbound.WRITE_BUFFER_EXTENSION), que informa se o transporte
+pediu para parar de escrever: o envio do Daphne nunca espera o cliente ler,
+então o servidor registra no transporte um IPushProducer e o consumer aplica
+contrapressão enquanto ele estiver pausado.
+"""
+import os
+
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+from whatsapp.outbound import WRITE_BUFFER_EXTENSION
+
+
+def accept_permessage_deflate(offers):
+    """Aceita a primeira oferta permessage-deflate do cliente (ou nenhuma)"""
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+def enable_permessage_deflate(factory) -> None:
+    """Configura uma WebSocketServerFactory do Autobahn para negociar compressão"""
+    factory.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+
+
+@implementer(IPushProducer)
+class WriteBufferProducer:
+    """
+    Produtor registrado no transporte do WebSocket.
+
+    O Twisted chama pauseProducing quando o buffer de escrita passa de
+    bufferSize e resumeProducing quando ele esvazia.
+    """
+
+    def __init__(self):
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        # Conexão encerrada: nada mais a esperar
+        self.paused = False
+
+
+class CompressingServer(Server):
+    """Server do Daphne que habilita permessage-deflate na fábrica de WebSockets"""
+
+    @property
+    def ws_factory(self):
+        return self._ws_factory
+
+    @ws_factory.setter
+    def ws_factory(self, factory):
+        # Server.run() cria a fábrica e só depois ajusta as demais opções
+        if os.getenv("WS_PERMESSAGE_DEFLATE", "1") != "0":
+            enable_permessage_deflate(factory)
+        self._ws_factory = factory
+
+    def create_application(self, protocol, scope):
+        if scope.get("type") == "websocket":
+            producer = WriteBufferProducer()
+            protocol.registerProducer(producer, True)
+            scope.setdefault("extensions", {})[WRITE_BUFFER_EXTENSION] = {
+                "paused": lambda: producer.paused,
+            }
+        return super().create_application(protocol, scope)
+
+
+class CompressingCommandLineInterface(CommandLineInterface):
+    server_class = CompressingServer
+
+
+if __name__ == "__main__":
+    CompressingCommandLineInterface.entrypoint()
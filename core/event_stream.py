@@ -0,0 +1,142 @@
+"""
+Stream de eventos por usuário com número de sequência e buffer de replay.
+
+Todo evento enviado aos grupos user_{id}_whatsapp recebe um campo "seq"
+monotonicamente crescente por usuário e é guardado em um ring buffer no cache
+(N slots por usuário, com TTL). Um cliente que reconecta com ?since=<seq>
+recebe apenas os eventos que perdeu; se a lacuna já saiu do buffer, recebe um
+sinal de resincronização completa.
+"""
+import logging
+from typing import Dict, List, Tuple
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id: int) -> str:
+    """Grupo do channel layer com todos os sockets do usuário"""
+    return f"user_{user_id}_whatsapp"
+
+
+class UserEventStream:
+    """
+    Sequência e ring buffer de eventos por usuário.
+
+    Cada evento ocupa o slot (seq % buffer_size) do usuário, então o consumo de
+    memória é limitado a buffer_size eventos por usuário, e cada slot expira
+    após ttl segundos.
+    """
+
+    def __init__(self, buffer_size: int = None, ttl: int = None):
+        self.buffer_size = buffer_size or getattr(settings, 'WS_REPLAY_BUFFER_SIZE', 500)
+        self.ttl = ttl or getattr(settings, 'WS_REPLAY_TTL_SECONDS', 600)
+
+    def _seq_key(self, user_id: int) -> str:
+        return f"ws_stream:{user_id}:seq"
+
+    def _slot_key(self, user_id: int, seq: int) -> str:
+        return f"ws_stream:{user_id}:slot:{seq % self.buffer_size}"
+
+    def _next_seq(self, user_id: int) -> int:
+        key = self._seq_key(user_id)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Chave inexistente: inicializa sem sobrescrever concorrentes
+            cache.add(key, 0, timeout=None)
+            return cache.incr(key)
+
+    def current_seq(self, user_id: int) -> int:
+        """Último número de sequência emitido para o usuário"""
+        return cache.get(self._seq_key(user_id)) or 0
+
+    def record(self, user_id: int, payload: Dict) -> Dict:
+        """
+        Atribui o próximo número de sequência ao evento e o guarda no buffer.
+
+        Returns:
+            Cópia do payload com o campo "seq"
+        """
+        seq = self._next_seq(user_id)
+        event = {**payload, 'seq': seq}
+        cache.set(self._slot_key(user_id, seq), event, timeout=self.ttl)
+        return event
+
+    def replay(self, user_id: int, since: int) -> Tuple[List[Dict], bool]:
+        """
+        Retorna os eventos com seq > since.
+
+        Returns:
+            (eventos, resync_required). resync_required é True quando a lacuna
+            não pode ser reconstruída (saiu do buffer, expirou ou a sequência
+            foi reiniciada) e o cliente deve recarregar o estado completo.
+        """
+        current = self.current_seq(user_id)
+
+        if since > current:
+            # Sequência reiniciada (ex.: cache limpo)
+            return [], True
+        if since == current:
+            return [], False
+        if current - since > self.buffer_size:
+            return [], True
+
+        seqs = range(since + 1, current + 1)
+        keys = [self._slot_key(user_id, seq) for seq in seqs]
+        stored = cache.get_many(keys)
+
+        events = []
+        for seq, key in zip(seqs, keys):
+            event = stored.get(key)
+            if not event or event.get('seq') != seq:
+                # Slot expirado ou já sobrescrito por um evento mais novo
+                return [], True
+            events.append(event)
+
+        return events, False
+
+
+_stream = UserEventStream()
+
+
+def get_user_event_stream() -> UserEventStream:
+    """Retorna instância global do stream"""
+    return _stream
+
+
+def publish_user_event(user_id: int, payload: Dict) -> Dict:
+    """
+    Numera, guarda no buffer e envia um evento para os sockets do usuário.
+
+    Returns:
+        Evento enviado (com "seq")
+    """
+    event = _stream.record(user_id, payload)
+
+    channel_layer = get_channel_layer()
+    if channel_layer:
+        async_to_sync(channel_layer.group_send)(
+            user_group_name(user_id),
+            {"type": "whatsapp.event", "event": event}
+        )
+
+    return event
+
+
+async def apublish_user_event(user_id: int, payload: Dict) -> Dict:
+    """Versão async de publish_user_event"""
+    event = await sync_to_async(_stream.record)(user_id, payload)
+
+    channel_layer = get_channel_layer()
+    if channel_layer:
+        await channel_layer.group_send(
+            user_group_name(user_id),
+            {"type": "whatsapp.event", "event": event}
+        )
+
+    return event
@@ -0,0 +1,84 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.auth_cache import invalidate_user_auth_cache
+from core.ws import jwt_auth_middleware
+from whatsapp.consumers import WhatsAppConsumer
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a latência de conexão do WebSocket em uma rajada de reconexões "
+        "(autenticação JWT + entrada nos grupos). Os usuários criados são "
+        "descartados ao final (rollback)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=5000, help="Conexões por rodada")
+        parser.add_argument("--users", type=int, default=500, help="Usuários distintos")
+        parser.add_argument("--concurrency", type=int, default=200, help="Conexões simultâneas")
+
+    def handle(self, *args, **options):
+        sockets = options["sockets"]
+        users = max(1, options["users"])
+        concurrency = max(1, options["concurrency"])
+
+        app = jwt_auth_middleware(WhatsAppConsumer.as_asgi())
+        User = get_user_model()
+
+        with transaction.atomic():
+            agents = User.objects.bulk_create([
+                User(username=f"bench_ws_{i}") for i in range(users)
+            ])
+            tokens = [str(RefreshToken.for_user(agent).access_token) for agent in agents]
+            for agent in agents:
+                invalidate_user_auth_cache(agent.pk, agent.token_version)
+
+            for label in ("fria (cache vazio)", "reconexão (cache quente)"):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    latencies = async_to_sync(self._burst)(app, tokens, sockets, concurrency)
+                    elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f"Rodada {label}: {sockets} conexões em {elapsed:.2f}s "
+                    f"({sockets / elapsed:.0f}/s), queries={len(queries)}, "
+                    f"p50={statistics.median(latencies):.2f}ms "
+                    f"p95={_percentile(latencies, 95):.2f}ms "
+                    f"p99={_percentile(latencies, 99):.2f}ms"
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("Benchmark concluído."))
+
+    async def _burst(self, app, tokens, sockets, concurrency):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def connect(i):
+            async with semaphore:
+                communicator = WebsocketCommunicator(app, f"/ws/whatsapp/?token={tokens[i % len(tokens)]}")
+                started = time.perf_counter()
+                connected, _ = await communicator.connect()
+                latencies.append((time.perf_counter() - started) * 1000)
+                if connected:
+                    await communicator.disconnect()
+
+        await asyncio.gather(*(connect(i) for i in range(sockets)))
+        return latencies
@@ -0,0 +1,90 @@
+"""
+Métricas de processo no formato de exposição do Prometheus.
+
+Contadores e gauges simples, mantidos em memória por processo (cada worker
+expõe os seus valores em /metrics e o Prometheus agrega por instância).
+"""
+import threading
+from typing import Dict, Tuple
+
+_lock = threading.Lock()
+
+# nome -> (tipo, ajuda)
+_metadata: Dict[str, Tuple[str, str]] = {}
+# nome -> {labels ordenados -> valor}
+_values: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+
+
+def _register(name: str, kind: str, documentation: str) -> None:
+    with _lock:
+        _metadata.setdefault(name, (kind, documentation))
+        _values.setdefault(name, {})
+
+
+def _label_key(labels: Dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class Counter:
+    """Contador monotônico, opcionalmente com labels"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        _register(name, 'counter', documentation)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            series = _values[self.name]
+            series[key] = series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return _values[self.name].get(_label_key(labels), 0)
+
+
+class Gauge:
+    """Valor que sobe e desce, opcionalmente com labels"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        _register(name, 'gauge', documentation)
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            _values[self.name][_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            series = _values[self.name]
+            series[key] = series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return _values[self.name].get(_label_key(labels), 0)
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...]) -> str:
+    if not key:
+        return ''
+    parts = []
+    for name, value in key:
+        escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def render_prometheus() -> str:
+    """Renderiza todas as métricas registradas no formato texto do Prometheus"""
+    lines = []
+    with _lock:
+        for name in sorted(_metadata):
+            kind, documentation = _metadata[name]
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(_values[name].items()):
+                number = int(value) if float(value).is_integer() else value
+                lines.append(f'{name}{_format_labels(key)} {number}')
+    return '\n'.join(lines) + '\n'
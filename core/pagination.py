@@ -0,0 +1,161 @@
+"""
+Paginação por keyset em (campo, id); por padrão (created_at, id).
+
+Cada página é uma busca por faixa no índice, sem OFFSET nem COUNT(*): a
+página 500 custa o mesmo que a primeira. A listagem é sempre da mais recente
+para a mais antiga.
+
+Query params:
+- limit: itens por página (padrão 50, máximo 200)
+- before: cursor; devolve itens mais antigos que ele (próxima página)
+- after: cursor; devolve itens mais novos que ele (polling por novidades)
+- include_total=true: inclui estimated_total (estimativa do planner do
+  Postgres; contagem exata quando a estimativa é pequena)
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+# Abaixo desta estimativa, o total é contado de fato (barato e exato)
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def encode_cursor(value, pk: int) -> str:
+    """Cursor de (valor do campo, id); datas vão em ISO 8601"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = f"{value}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, parse=datetime.fromisoformat):
+    """Retorna (valor, id) de um cursor, com o valor convertido por parse; ValidationError se inválido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, sep, pk = base64.urlsafe_b64decode(padded.encode()).decode().rpartition('|')
+        if not sep:
+            raise ValueError(cursor)
+        return parse(value), int(pk)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Cursor inválido'})
+
+
+def keyset_page(queryset, field: str, descending: bool, cursor=None, reverse: bool = False, limit: int = 50):
+    """
+    Uma página por faixa em (field, id) a partir de cursor = (valor, id).
+
+    reverse busca no sentido oposto ao da listagem (página anterior) e
+    devolve os itens já na ordem da listagem. Retorna (itens, há_mais).
+    """
+    lookup = 'lt' if descending != reverse else 'gt'
+    if cursor:
+        value, pk = cursor
+        queryset = queryset.filter(**{f'{field}__{lookup}e': value}).filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{f'id__{lookup}': pk})
+        )
+    if lookup == 'lt':
+        queryset = queryset.order_by(f'-{field}', '-id')
+    else:
+        queryset = queryset.order_by(field, 'id')
+
+    page = list(queryset[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    if reverse:
+        page.reverse()
+    return page, has_more
+
+
+def estimate_count(queryset) -> int:
+    """Total estimado pelo planner; conta de fato quando a estimativa é pequena"""
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+    except Exception:
+        return queryset.count()
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+class KeysetPagination(BasePagination):
+    """Paginação before/after em (key_field, id), mais recentes primeiro"""
+    default_limit = 50
+    max_limit = 200
+    limit_query_param = 'limit'
+    key_field = 'created_at'
+
+    def get_limit(self, request) -> int:
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.default_limit))
+        except ValueError:
+            raise ValidationError({self.limit_query_param: 'Deve ser um número inteiro'})
+        return max(1, min(limit, self.max_limit))
+
+    def parse_key(self, value: str):
+        """Converte o valor do campo guardado no cursor"""
+        return datetime.fromisoformat(value)
+
+    def encode_cursor(self, item) -> str:
+        return encode_cursor(getattr(item, self.key_field), item.pk)
+
+    def decode_cursor(self, cursor: str):
+        return decode_cursor(cursor, self.parse_key)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+
+        self.after = after
+        self.estimated_total = None
+        if request.query_params.get('include_total') in ('1', 'true', 'True'):
+            self.estimated_total = estimate_count(queryset)
+
+        if after:
+            page, self.has_newer = keyset_page(
+                queryset, self.key_field, True, self.decode_cursor(after), True, limit
+            )
+            self.has_older = True  # ao menos o item do cursor
+        else:
+            cursor = self.decode_cursor(before) if before else None
+            page, self.has_older = keyset_page(queryset, self.key_field, True, cursor, False, limit)
+            self.has_newer = bool(before)
+
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        first = self.page[0] if self.page else None
+        last = self.page[-1] if self.page else None
+        body = {
+            'results': data,
+            # Próxima página (mais antigas)
+            'before': self.encode_cursor(last) if last and self.has_older else None,
+            # Polling por novidades; sem itens novos, o cursor recebido continua válido
+            'after': self.encode_cursor(first) if first else self.after,
+            'has_older': self.has_older,
+            'has_newer': self.has_newer,
+        }
+        if self.estimated_total is not None:
+            body['estimated_total'] = self.estimated_total
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'results': schema,
+                'before': {'type': 'string', 'nullable': True},
+                'after': {'type': 'string', 'nullable': True},
+                'has_older': {'type': 'boolean'},
+                'has_newer': {'type': 'boolean'},
+                'estimated_total': {'type': 'integer'},
+            },
+        }
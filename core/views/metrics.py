@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import BasePermission, IsAdminUser
+
+from core.metrics import render_prometheus
+
+# Esquema do header Authorization do scrape; "Bearer" fica com o JWT
+METRICS_AUTH_SCHEME = "Metrics"
+
+
+class HasMetricsToken(BasePermission):
+    """Authorization: Metrics <METRICS_TOKEN> (scrape do Prometheus)"""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, "METRICS_TOKEN", "")
+        if not token:
+            return False
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        return hmac.compare_digest(header.encode(), f"{METRICS_AUTH_SCHEME} {token}".encode())
+
+
+@api_view(["GET"])
+@permission_classes([HasMetricsToken | IsAdminUser])
+def metrics_view(_request):
+    """Exposição das métricas do processo para o Prometheus (GET /metrics)"""
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
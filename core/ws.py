@@ -1,3 +1,4 @@
+import asyncio
 import json
 from urllib.parse import parse_qs
 
@@ -8,7 +9,7 @@ from channels.auth import AuthMiddlewareStack
 from django.contrib.auth.models import AnonymousUser
 from asgiref.sync import sync_to_async
 from channels.layers import get_channel_layer
-from urllib.parse import parse_qs
+from django.core.cache import cache
 
 
 User = get_user_model()
@@ -16,7 +17,8 @@ User = get_user_model()
 
 class EchoConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
-        if not getattr(self.scope, "user", None) or not self.scope["user"].is_authenticated:
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
             await self.close(code=4001)
             return
         await self.accept()
@@ -33,6 +35,60 @@ class EchoConsumer(AsyncJsonWebsocketConsumer):
 # O consumer ativo agora é whatsapp.consumers.WhatsAppConsumer
 
 
+# Cargas de usuário em andamento neste processo, por chave de cache
+_pending_user_loads = {}
+
+
+def _load_active_user(user_id, token_version):
+    """Busca o usuário no banco; None se inativo ou se o token foi revogado"""
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if not user or getattr(user, "token_version", 0) != token_version:
+        return None
+    return user
+
+
+async def authenticate_ws_token(token):
+    """
+    Resolve o usuário de um access token JWT.
+
+    O token é validado (assinatura/expiração) uma única vez por conexão e o
+    usuário vem do cache (user_id, token_version) com TTL curto, evitando uma
+    query por conexão em rajadas de reconexão.
+    """
+    from accounts.auth_cache import get_auth_cache_ttl, user_auth_cache_key
+
+    access = AccessToken(token)
+    user_id = access.get("user_id")
+    if not user_id:
+        return None
+    token_version = access.get("token_version", 0)
+
+    key = user_auth_cache_key(user_id, token_version)
+    user = await cache.aget(key)
+    if user is not None:
+        return user
+
+    # Conexões simultâneas do mesmo usuário com cache frio compartilham a query
+    pending = _pending_user_loads.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _pending_user_loads[key] = future
+    try:
+        user = await sync_to_async(_load_active_user)(user_id, token_version)
+        if user is not None:
+            await cache.aset(key, user, timeout=get_auth_cache_ttl())
+        future.set_result(user)
+    except Exception:
+        # Quem aguardava trata como não autenticado; o erro segue para o chamador
+        future.set_result(None)
+        raise
+    finally:
+        _pending_user_loads.pop(key, None)
+    return user
+
+
 def jwt_auth_middleware(inner):
     async def middleware(scope, receive, send):
         # Expect token via query string ?token=...
@@ -42,15 +98,10 @@ def jwt_auth_middleware(inner):
         user = None
         if token:
             try:
-                access = AccessToken(token)
-                user_id = access.get("user_id")
-                if user_id:
-                    user = await sync_to_async(lambda: User.objects.filter(pk=user_id).first())()
+                user = await authenticate_ws_token(token)
             except Exception:
                 user = None
         scope["user"] = user or AnonymousUser()  # type: ignore[name-defined]
         return await inner(scope, receive, send)
 
     return middleware
-
-
@@ -42,4 +42,5 @@ if [ "${DJANGO_DEBUG}" != "True" ] && [ "${DJANGO_DEBUG}" != "true" ]; then
   python manage.py collectstatic --noinput || true
 fi
 
-exec daphne -b 0.0.0.0 -p 8000 config.asgi:application
\ No newline at end of file
+# Daphne com permessage-deflate habilitado (ver config/ws_server.py)
+exec python -m config.ws_server -b 0.0.0.0 -p 8000 config.asgi:application
\ No newline at end of file
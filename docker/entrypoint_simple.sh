@@ -25,4 +25,5 @@ if [ "${DJANGO_DEBUG}" != "True" ] && [ "${DJANGO_DEBUG}" != "true" ]; then
 fi
 
 # Iniciar o servidor
-exec daphne -b 0.0.0.0 -p 8000 config.asgi:application
+# Daphne com permessage-deflate habilitado (ver config/ws_server.py)
+exec python -m config.ws_server -b 0.0.0.0 -p 8000 config.asgi:application
@@ -83,10 +83,12 @@ class WhatsAppStubTests(TestCase):
         import asyncio
         asyncio.run(self.service._emit(123, {"type": "test"}))
         
-        mock_layer.group_send.assert_called_once_with(
-            "user_123_whatsapp",
-            {"type": "whatsapp.event", "event": {"type": "test"}}
-        )
+        mock_layer.group_send.assert_called_once()
+        group, message = mock_layer.group_send.call_args[0]
+        self.assertEqual(group, "user_123_whatsapp")
+        self.assertEqual(message["type"], "whatsapp.event")
+        self.assertEqual(message["event"]["type"], "test")
+        self.assertIn("seq", message["event"])
 
     @patch('integrations.whatsapp_stub.get_channel_layer')
     def test_emit_without_channel_layer(self, mock_get_channel_layer):
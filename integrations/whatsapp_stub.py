@@ -11,9 +11,11 @@ from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Dict, Optional
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
 
+from core.event_stream import get_user_event_stream
+
 
 def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -49,18 +51,21 @@ class StubWhatsAppSessionService:
         layer = get_channel_layer()
         if not layer:
             return
+        # Numera o evento no stream do usuário (replay em reconexões)
+        event = await sync_to_async(get_user_event_stream().record)(user_id, payload)
         await layer.group_send(  # type: ignore[func-returns-value]
             user_group_name(user_id),
-            {"type": "whatsapp.event", "event": payload},
+            {"type": "whatsapp.event", "event": event},
         )
 
     def _emit_sync(self, user_id: int, payload: Dict):
         layer = get_channel_layer()
         if not layer:
             return
+        event = get_user_event_stream().record(user_id, payload)
         async_to_sync(layer.group_send)(
             user_group_name(user_id),
-            {"type": "whatsapp.event", "event": payload},
+            {"type": "whatsapp.event", "event": event},
         )
 
     async def start(self, user_id: int) -> Dict:
@@ -1,17 +1,70 @@
 """
 WebSocket consumers aprimorados para WhatsApp com persistência.
 """
+import asyncio
 import logging
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken
 from urllib.parse import parse_qs
 
+from accounts.presence_state import PRESENCE_GROUP, get_presence_service
+from accounts.typing_state import get_typing_service
+from chats.events import chat_group_name
+from core.event_stream import get_user_event_stream, user_group_name
+from .encoding import JSON_ENCODER, negotiate_encoding
+from .outbound import OutboundQueue, write_paused
 from .service import get_whatsapp_session_service
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Limite de conversas acompanhadas simultaneamente por socket
+MAX_CHAT_SUBSCRIPTIONS = 50
+
+# Intervalo entre verificações do buffer de escrita acima do limite
+WRITE_BUFFER_POLL_SECONDS = 0.05
+
+# Código de fechamento para cliente lento (RFC 6455: Try Again Later)
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def _user_can_view_chat(user_id, chat_id) -> bool:
+    """Mesma regra de permissão de GET /chats/{chat_id}/messages/"""
+    from atendimento.models import Atendimento
+    
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if not user:
+        return False
+    if user.is_superuser:
+        return True
+    
+    atendimento = Atendimento.objects.filter(
+        chat_id=chat_id,
+        status__in=['aguardando', 'em_atendimento', 'pausado', 'finalizado']
+    ).order_by('-criado_em').first()
+    
+    if not atendimento:
+        return False
+    if atendimento.atendente_id and atendimento.atendente_id != user.id:
+        return atendimento.status in ['aguardando', 'finalizado']
+    return True
+
+
+def _user_can_view_dashboard(user_id, departamento_id) -> bool:
+    """Painel do departamento: staff, superusuário ou atendente do departamento"""
+    from atendimento.models import Departamento
+    
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if not user:
+        return False
+    if user.is_superuser or user.is_staff:
+        return True
+    return Departamento.atendentes.through.objects.filter(
+        departamento_id=departamento_id, agent_id=user_id
+    ).exists()
+
 
 class WhatsAppConsumer(AsyncJsonWebsocketConsumer):
     """
@@ -22,56 +75,161 @@ class WhatsAppConsumer(AsyncJsonWebsocketConsumer):
     - Persistir mensagens no banco
     - Enviar eventos para o cliente
     - Calcular métricas de latência
+    - Gerenciar inscrições em conversas (tópicos chat_{chat_id})
+    - Gerenciar inscrições em painéis de departamento (dashboard_dept_{id})
+    
+    Eventos do channel layer passam por uma fila de saída limitada
+    (WS_OUTBOUND_QUEUE_SIZE) com coalescência de status; respostas diretas
+    ao cliente (pong, subscribed) são enviadas imediatamente.
+    
+    O formato dos frames (JSON, JSON compacto ou MessagePack) é negociado na
+    conexão; ver whatsapp/encoding.py.
     """
     
+    encoder = JSON_ENCODER
+    
     async def connect(self):
         """Conecta o WebSocket e autentica o usuário"""
-        # Tenta resolver usuário via middleware ou via token no query string
-        user_id = None
+        # Usuário autenticado pelo jwt_auth_middleware (token decodificado uma única vez)
+        user = self.scope.get("user")
+        user_id = user.id if user is not None and user.is_authenticated else None
+        params = parse_qs(self.scope.get("query_string", b"").decode())
         
-        if getattr(self.scope, "user", None) and getattr(self.scope["user"], "is_authenticated", False):
-            user_id = self.scope["user"].id
-        else:
-            try:
-                query = self.scope.get("query_string", b"").decode()
-                params = parse_qs(query)
-                token = (params.get("token") or [None])[0]
-                if token:
-                    access = AccessToken(token)
-                    user_id = access.get("user_id")
-            except Exception as e:
-                logger.warning(f"Falha na autenticação WebSocket: {e}")
-                user_id = None
+        self.encoder, subprotocol = negotiate_encoding(
+            self.scope, (params.get("encoding") or [None])[0]
+        )
+        self.chat_groups = {}
+        self.dashboard_groups = {}
+        self.outbound = OutboundQueue(getattr(settings, "WS_OUTBOUND_QUEUE_SIZE", 256))
+        self.sender_task = None
         
         if user_id:
             self.user_id = user_id
-            self.group_name = f"user_{user_id}_whatsapp"
+            self.group_name = user_group_name(user_id)
             await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.channel_layer.group_add(PRESENCE_GROUP, self.channel_name)
+            await sync_to_async(get_presence_service().socket_connected)(user_id)
             logger.info(f"WebSocket conectado para usuário {user_id}")
         else:
             logger.warning("Tentativa de conexão WebSocket sem autenticação")
         
-        await self.accept()
+        await self.accept(subprotocol)
+        
+        # Reconexão: reenvia eventos perdidos desde o último seq visto pelo cliente
+        since = (params.get("since") or [None])[0]
+        if user_id and since is not None:
+            await self._replay_since(since)
+        
+        self.sender_task = asyncio.ensure_future(self._drain_outbound())
+    
+    async def _replay_since(self, since):
+        """
+        Reenvia os eventos com seq > since do buffer do usuário.
+        
+        O group_add acontece antes do replay, então um evento pode chegar em
+        duplicidade (ao vivo e no replay); o cliente descarta seq já vistos.
+        Se a lacuna não estiver mais no buffer, envia resync_required e o
+        cliente deve recarregar o estado via REST.
+        """
+        stream = get_user_event_stream()
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            since = -1
+        
+        if since < 0:
+            events, resync_required = [], True
+        else:
+            events, resync_required = await sync_to_async(stream.replay)(self.user_id, since)
+        
+        if resync_required:
+            current = await sync_to_async(stream.current_seq)(self.user_id)
+            await self.send_json({"type": "resync_required", "seq": current})
+            return
+        
+        for event in events:
+            await self.send_json(event)
     
     async def disconnect(self, code):
         """Desconecta o WebSocket"""
+        if getattr(self, "sender_task", None):
+            self.sender_task.cancel()
+            self.sender_task = None
+        if hasattr(self, "outbound"):
+            self.outbound.clear()
+        
+        for group in getattr(self, "chat_groups", {}).values():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in getattr(self, "dashboard_groups", {}).values():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        
         if hasattr(self, "group_name"):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self.channel_layer.group_discard(PRESENCE_GROUP, self.channel_name)
+            await sync_to_async(get_presence_service().socket_disconnected)(self.user_id)
             logger.info(f"WebSocket desconectado para usuário {self.user_id} (code: {code})")
     
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        """Aceita frames binários quando o cliente negociou MessagePack"""
+        if bytes_data is not None and self.encoder.binary:
+            await self.receive_json(self.encoder.decode(bytes_data), **kwargs)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+    
+    async def send_json(self, content, close=False):
+        """Envia no formato negociado na conexão"""
+        encoded = self.encoder.encode(content)
+        if self.encoder.binary:
+            await self.send(bytes_data=encoded, close=close)
+        else:
+            await self.send(text_data=encoded, close=close)
+    
     async def receive_json(self, content, **kwargs):
         """
         Recebe mensagens JSON do cliente.
         
         Suporta:
-        - ping/pong para manter conexão
+        - ping/pong e heartbeat para manter conexão e presença
+        - subscribe/unsubscribe em conversas ({"type": "subscribe", "chat_id": ...})
+        - subscribe_dashboard/unsubscribe_dashboard em painéis de departamento
+          ({"type": "subscribe_dashboard", "departamento_id": ...})
+        - typing_start/typing_stop em conversas inscritas
         - injeção de mensagens (apenas para testes)
         """
-        # Ping/pong
+        # Ping/pong (também conta como heartbeat de presença)
         if content == {"type": "ping"}:
+            await self._heartbeat()
             await self.send_json({"type": "pong"})
             return
         
+        # Heartbeat de presença (substitui POST /presence/heartbeat/)
+        if content.get("type") == "heartbeat":
+            await self._heartbeat()
+            return
+        
+        # Inscrição em conversa
+        if content.get("type") == "subscribe":
+            await self._subscribe_chat(content.get("chat_id"))
+            return
+        
+        if content.get("type") == "unsubscribe":
+            await self._unsubscribe_chat(content.get("chat_id"))
+            return
+        
+        # Painel do departamento
+        if content.get("type") == "subscribe_dashboard":
+            await self._subscribe_dashboard(content.get("departamento_id"))
+            return
+        
+        if content.get("type") == "unsubscribe_dashboard":
+            await self._unsubscribe_dashboard(content.get("departamento_id"))
+            return
+        
+        # Digitação (efêmera, apenas em conversas inscritas)
+        if content.get("type") in ("typing_start", "typing_stop"):
+            await self._typing(content.get("type"), content.get("chat_id"))
+            return
+        
         # Injeção de mensagem de entrada (para testes)
         if content.get("type") == "inject_incoming" and hasattr(self, "user_id"):
             service = get_whatsapp_session_service()
@@ -129,7 +287,202 @@ class WhatsAppConsumer(AsyncJsonWebsocketConsumer):
             await self._handle_session_status(payload)
         
         # Envia payload para o cliente
-        await self.send_json(payload)
+        self.outbound.put(payload)
+    
+    async def chat_event(self, event):
+        """
+        Manipula eventos de conversa (tópico chat_{chat_id}).
+        
+        Encaminha mensagens persistidas e mudanças de status para os
+        sockets inscritos no chat.
+        """
+        data = event.get("data") or {}
+        
+        # Quem digita não precisa receber o próprio indicador
+        if event.get("event") in ("typing_start", "typing_stop") and \
+                data.get("agent_id") == getattr(self, "user_id", None):
+            return
+        
+        self.outbound.put({
+            "event": event.get("event"),
+            "data": data,
+            "version": "v1"
+        })
+    
+    async def dashboard_event(self, event):
+        """Snapshot coalescido do painel de um departamento (atendimento.dashboard)"""
+        self.outbound.put({
+            "event": event.get("event"),
+            "data": event.get("data") or {},
+            "version": "v1"
+        })
+    
+    async def _drain_outbound(self):
+        """
+        Envia os eventos enfileirados, na ordem, enquanto o socket estiver aberto.
+        
+        Antes de cada envio espera o transporte liberar a escrita (buffer do
+        socket abaixo do limite do Twisted); enquanto isso os eventos coalescem e,
+        se preciso, são descartados na fila limitada. Um cliente que não lê o
+        que já foi enviado em WS_SEND_TIMEOUT_SECONDS é desconectado.
+        """
+        try:
+            while True:
+                await self.outbound.wait()
+                await self._wait_write_buffer()
+                dropped = self.outbound.take_dropped()
+                if dropped:
+                    await self._send_outbound({"type": "events_dropped", "count": dropped})
+                await self._send_outbound(self.outbound.pop())
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"Cliente WebSocket não consome os eventos; desconectando {self.channel_name}")
+            await self._close_outbound()
+        except Exception as e:
+            logger.warning(f"Falha ao enviar eventos WebSocket: {e}; desconectando {self.channel_name}")
+            await self._close_outbound()
+    
+    async def _wait_write_buffer(self):
+        """Aguarda o transporte retomar a escrita (TimeoutError se não retomar)"""
+        timeout = getattr(settings, "WS_SEND_TIMEOUT_SECONDS", 10)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while write_paused(self.scope):
+            if loop.time() >= deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(WRITE_BUFFER_POLL_SECONDS)
+    
+    async def _send_outbound(self, event):
+        """Envia um evento da fila; falha em um evento não interrompe os seguintes"""
+        try:
+            await asyncio.wait_for(
+                self.send_json(event), timeout=getattr(settings, "WS_SEND_TIMEOUT_SECONDS", 10)
+            )
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            logger.warning(f"Evento WebSocket {event.get('type') or event.get('event')} não enviado: {e}")
+    
+    async def _close_outbound(self):
+        """Fecha o socket quando a task de envio não pode continuar"""
+        self.outbound.clear()
+        try:
+            await self.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+        except Exception as e:
+            logger.warning(f"Falha ao fechar WebSocket: {e}")
+    
+    async def _subscribe_chat(self, chat_id):
+        """Inscreve o socket no tópico de uma conversa"""
+        if not chat_id or not hasattr(self, "user_id"):
+            await self.send_json({
+                "type": "subscribe_error",
+                "chat_id": chat_id,
+                "error": "chat_id é obrigatório e o socket deve estar autenticado"
+            })
+            return
+        
+        chat_id = str(chat_id)
+        if chat_id in self.chat_groups:
+            await self.send_json({"type": "subscribed", "chat_id": chat_id})
+            return
+        
+        if len(self.chat_groups) >= MAX_CHAT_SUBSCRIPTIONS:
+            await self.send_json({
+                "type": "subscribe_error",
+                "chat_id": chat_id,
+                "error": f"Limite de {MAX_CHAT_SUBSCRIPTIONS} conversas acompanhadas atingido"
+            })
+            return
+        
+        allowed = await sync_to_async(_user_can_view_chat)(self.user_id, chat_id)
+        if not allowed:
+            await self.send_json({
+                "type": "subscribe_error",
+                "chat_id": chat_id,
+                "error": "Você não tem permissão para visualizar este chat"
+            })
+            return
+        
+        group = chat_group_name(chat_id)
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.chat_groups[chat_id] = group
+        logger.debug(f"Usuário {self.user_id} inscrito no chat {chat_id}")
+        
+        await self.send_json({"type": "subscribed", "chat_id": chat_id})
+    
+    async def _unsubscribe_chat(self, chat_id):
+        """Remove a inscrição do socket no tópico de uma conversa"""
+        group = self.chat_groups.pop(str(chat_id), None) if chat_id else None
+        if group:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        
+        await self.send_json({"type": "unsubscribed", "chat_id": chat_id})
+    
+    async def _subscribe_dashboard(self, departamento_id):
+        """Inscreve o socket no painel de um departamento e envia o estado atual"""
+        from atendimento.dashboard import dashboard_group_name, get_dashboard_service
+        
+        try:
+            departamento_id = int(departamento_id)
+        except (TypeError, ValueError):
+            departamento_id = None
+        
+        if not departamento_id or not hasattr(self, "user_id"):
+            await self.send_json({
+                "type": "subscribe_error",
+                "departamento_id": departamento_id,
+                "error": "departamento_id é obrigatório e o socket deve estar autenticado"
+            })
+            return
+        
+        allowed = await sync_to_async(_user_can_view_dashboard)(self.user_id, departamento_id)
+        if not allowed:
+            await self.send_json({
+                "type": "subscribe_error",
+                "departamento_id": departamento_id,
+                "error": "Você não tem permissão para acompanhar este departamento"
+            })
+            return
+        
+        group = dashboard_group_name(departamento_id)
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.dashboard_groups[departamento_id] = group
+        
+        await self.send_json({"type": "dashboard_subscribed", "departamento_id": departamento_id})
+        snapshot = await sync_to_async(get_dashboard_service().snapshot)(departamento_id)
+        await self.send_json({"event": "dashboard_snapshot", "data": snapshot, "version": "v1"})
+    
+    async def _unsubscribe_dashboard(self, departamento_id):
+        """Remove a inscrição do socket no painel de um departamento"""
+        try:
+            group = self.dashboard_groups.pop(int(departamento_id), None)
+        except (TypeError, ValueError):
+            group = None
+        if group:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        
+        await self.send_json({"type": "dashboard_unsubscribed", "departamento_id": departamento_id})
+    
+    async def _heartbeat(self):
+        """Renova a presença do atendente no cache"""
+        if hasattr(self, "user_id"):
+            await sync_to_async(get_presence_service().heartbeat)(self.user_id, socket=True)
+    
+    async def _typing(self, event_type, chat_id):
+        """Repassa typing_start/typing_stop para o serviço de digitação"""
+        chat_id = str(chat_id) if chat_id else None
+        if not chat_id or chat_id not in self.chat_groups:
+            await self.send_json({
+                "type": "typing_error",
+                "chat_id": chat_id,
+                "error": "Inscreva-se no chat antes de enviar indicadores de digitação"
+            })
+            return
+        
+        service = get_typing_service()
+        handler = service.start if event_type == "typing_start" else service.stop
+        await sync_to_async(handler)(self.user_id, self.scope["user"].username, chat_id)
     
     async def _handle_message_received(self, payload):
         """Processa mensagem recebida e persiste no banco"""
@@ -0,0 +1,152 @@
+"""
+Codificação dos eventos enviados pelo WhatsAppConsumer.
+
+O cliente escolhe o formato na conexão, via subprotocolo WebSocket
+(Sec-WebSocket-Protocol) ou, se o cliente não suporta subprotocolos,
+via query string ?encoding=:
+
+- dx.v1.json    / ?encoding=json     JSON completo (padrão, formato atual)
+- dx.v1.compact / ?encoding=compact  JSON com chaves curtas e datas em epoch ms
+- dx.v1.msgpack / ?encoding=msgpack  MessagePack (frames binários) com as
+                                     mesmas chaves curtas e datas em epoch ms
+
+Mensagens do cliente para o servidor continuam com as chaves completas (em
+JSON, ou em MessagePack quando esse formato foi negociado).
+"""
+import json
+import re
+from datetime import datetime
+from typing import Dict, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack vem com channels-redis
+    msgpack = None
+
+# Chaves do envelope ({"event", "data", "version", "seq"} ou {"type", ...}) e sua forma curta
+ENVELOPE_KEYS = {
+    'event': 'e',
+    'data': 'd',
+    'version': 'v',
+    'type': 't',
+    'seq': 's',
+}
+
+# Campos mais repetidos dos eventos (no envelope ou no primeiro nível de "data")
+DATA_KEYS = {
+    'chat_id': 'c',
+    'message_id': 'm',
+    'status': 'st',
+    'atendimento_id': 'a',
+}
+
+COMPACT_KEYS = {**ENVELOPE_KEYS, **DATA_KEYS}
+
+# Campos de data enviados pelo servidor; só eles viram epoch ms
+DATE_FIELDS = frozenset({
+    'created_at', 'sent_at', 'delivered_at', 'read_at', 'queued_at',
+    'connected_at', 'status_changed_at', 'last_message_at',
+    'criado_em', 'atualizado_em', 'finalizado_em', 'lido_em',
+    'ultima_mensagem_em', 'ultima_resposta_em',
+})
+
+_ISO_DATETIME = re.compile(
+    r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})$'
+)
+
+
+def _to_epoch_ms(value: str) -> Union[int, str]:
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        return value
+
+
+def _compact_fields(fields: Dict, keys: Dict[str, str]) -> Dict:
+    compact = {}
+    for key, value in fields.items():
+        if key in DATE_FIELDS and isinstance(value, str) and _ISO_DATETIME.match(value):
+            value = _to_epoch_ms(value)
+        compact[keys.get(key, key)] = value
+    return compact
+
+
+def compact_payload(content: Dict) -> Dict:
+    """
+    Encurta as chaves conhecidas e converte datas ISO 8601 (com fuso) em epoch ms.
+
+    Só o envelope e o primeiro nível de "data" são reescritos, e só nos campos
+    conhecidos (COMPACT_KEYS, DATE_FIELDS): conteúdo do usuário (texto de
+    mensagens, metadados, objetos aninhados) segue como veio.
+    """
+    compact = _compact_fields(content, COMPACT_KEYS)
+    data = content.get('data')
+    if isinstance(data, dict):
+        compact[ENVELOPE_KEYS['data']] = _compact_fields(data, DATA_KEYS)
+    return compact
+
+
+class JsonEncoder:
+    """Formato padrão: JSON com as chaves completas"""
+    name = 'json'
+    binary = False
+
+    def encode(self, content: Dict) -> str:
+        return json.dumps(content)
+
+    def decode(self, data) -> Dict:
+        return json.loads(data)
+
+
+class CompactJsonEncoder(JsonEncoder):
+    """JSON sem espaços, chaves curtas e datas em epoch ms"""
+    name = 'compact'
+
+    def encode(self, content: Dict) -> str:
+        return json.dumps(compact_payload(content), separators=(',', ':'), ensure_ascii=False)
+
+
+class MsgPackEncoder:
+    """MessagePack com chaves curtas e datas em epoch ms (frames binários)"""
+    name = 'msgpack'
+    binary = True
+
+    def encode(self, content: Dict) -> bytes:
+        return msgpack.packb(compact_payload(content), use_bin_type=True)
+
+    def decode(self, data: bytes) -> Dict:
+        return msgpack.unpackb(data, raw=False)
+
+
+JSON_ENCODER = JsonEncoder()
+
+ENCODERS = {
+    'json': JSON_ENCODER,
+    'compact': CompactJsonEncoder(),
+}
+if msgpack is not None:
+    ENCODERS['msgpack'] = MsgPackEncoder()
+
+SUBPROTOCOL_PREFIX = 'dx.v1.'
+
+
+def negotiate_encoding(scope: Dict, query_encoding: Optional[str] = None) -> Tuple[object, Optional[str]]:
+    """
+    Escolhe o codificador da conexão.
+
+    Returns:
+        (encoder, subprotocol). subprotocol deve ser devolvido no accept
+        quando a escolha veio de Sec-WebSocket-Protocol.
+    """
+    for subprotocol in scope.get('subprotocols') or []:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            encoder = ENCODERS.get(subprotocol[len(SUBPROTOCOL_PREFIX):])
+            if encoder is not None:
+                return encoder, subprotocol
+
+    if query_encoding:
+        encoder = ENCODERS.get(query_encoding)
+        if encoder is not None:
+            return encoder, None
+
+    return JSON_ENCODER, None
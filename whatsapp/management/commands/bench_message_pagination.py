@@ -0,0 +1,130 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from whatsapp.models import WhatsAppMessage, WhatsAppSession
+from whatsapp.views import WhatsAppMessageViewSet
+
+# Colunas que variam por linha; as demais recebem o valor de uma mensagem modelo
+VARYING_COLUMNS = {
+    "message_id": "'bench-' || g",
+    "client_message_id": "'bench-' || g",
+    "created_at": "%(now)s - g * interval '1 second'",
+    "queued_at": "%(now)s - g * interval '1 second'",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a latência da listagem de mensagens na página 1 e em uma página "
+        "profunda: cursor (before) versus OFFSET + COUNT(*). Insere as linhas "
+        "dentro de uma transação descartada ao final (rollback)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5_000_000, help="Mensagens do usuário de teste")
+        parser.add_argument("--page", type=int, default=500, help="Página profunda a medir")
+        parser.add_argument("--limit", type=int, default=50, help="Itens por página")
+        parser.add_argument("--repeat", type=int, default=20, help="Medições por cenário")
+
+    def handle(self, *args, **options):
+        rows, page, limit, repeat = options["rows"], options["page"], options["limit"], options["repeat"]
+        if rows < page * limit:
+            self.stderr.write(f"--rows precisa ser >= page * limit ({page * limit})")
+            return
+
+        with transaction.atomic():
+            user = get_user_model().objects.create(username="bench_pagination")
+            session = WhatsAppSession.objects.create(usuario=user, status="ready")
+
+            started = time.perf_counter()
+            self._seed(session, rows)
+            self.stdout.write(f"{rows} mensagens inseridas em {time.perf_counter() - started:.1f}s")
+
+            view = WhatsAppMessageViewSet.as_view({"get": "list"})
+            factory = APIRequestFactory()
+
+            def get(params):
+                request = factory.get("/api/v1/whatsapp/messages/", params)
+                force_authenticate(request, user=user)
+                response = view(request)
+                response.render()
+                return response
+
+            # Cursor da página profunda, obtido percorrendo as páginas
+            before = None
+            for _ in range(page - 1):
+                params = {"limit": limit, **({"before": before} if before else {})}
+                before = get(params).data["before"]
+
+            queryset = WhatsAppMessage.objects.filter(usuario=user).order_by("-created_at")
+
+            def offset_page(number):
+                offset = (number - 1) * limit
+                queryset.count()
+                list(queryset[offset:offset + limit])
+
+            scenarios = [
+                ("cursor página 1", lambda: get({"limit": limit})),
+                (f"cursor página {page}", lambda: get({"limit": limit, "before": before})),
+                ("offset+count página 1", lambda: offset_page(1)),
+                (f"offset+count página {page}", lambda: offset_page(page)),
+            ]
+            for label, run in scenarios:
+                run()  # aquecimento
+                timings = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    run()
+                    timings.append((time.perf_counter() - t0) * 1000)
+                self.stdout.write(
+                    f"{label:<28} p50={statistics.median(timings):.2f}ms max={max(timings):.2f}ms"
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("Benchmark concluído."))
+
+    def _seed(self, session, rows):
+        """Insere as mensagens com um único INSERT ... SELECT generate_series"""
+        from django.utils import timezone
+
+        template = WhatsAppMessage(
+            session=session,
+            usuario=session.usuario,
+            direction="inbound",
+            message_type="text",
+            chat_id="5511999999999",
+            contact_number="5511999999999",
+            text_content="Mensagem de benchmark",
+            status="delivered",
+        )
+        columns, expressions, params = [], [], []
+        now = timezone.now()
+        for field in WhatsAppMessage._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            columns.append(connection.ops.quote_name(field.column))
+            if field.column in VARYING_COLUMNS:
+                expression = VARYING_COLUMNS[field.column]
+                if "%(now)s" in expression:
+                    params.append(now)
+                expressions.append(expression % {"now": "%s"})
+            else:
+                value = getattr(template, field.attname)
+                if value is None and field.has_default():
+                    value = field.get_default()
+                expressions.append("%s")
+                params.append(field.get_db_prep_save(value, connection))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {WhatsAppMessage._meta.db_table} ({', '.join(columns)}) "
+                f"SELECT {', '.join(expressions)} FROM generate_series(1, %s) AS g",
+                params + [rows],
+            )
+            cursor.execute(f"ANALYZE {WhatsAppMessage._meta.db_table}")
@@ -0,0 +1,101 @@
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+
+from whatsapp.encoding import ENCODERS
+
+
+def _sample_events(count):
+    """Eventos representativos: rajadas de status, mensagens de chat e new_message"""
+    base = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        ts = (base + timedelta(milliseconds=37 * i)).isoformat()
+        kind = i % 6
+        if kind < 4:
+            events.append({
+                "event": "chat_message_status",
+                "data": {
+                    "chat_id": "5511999999999",
+                    "message_id": f"msg_{i // 4}",
+                    "status": ("queued", "sent", "delivered", "read")[kind],
+                    "sent_at": ts,
+                    "delivered_at": ts if kind >= 2 else None,
+                    "read_at": ts if kind == 3 else None,
+                },
+                "version": "v1",
+                "seq": i,
+            })
+        elif kind == 4:
+            events.append({
+                "event": "chat_message",
+                "data": {
+                    "id": i,
+                    "chat_id": "5511999999999",
+                    "message_id": f"msg_in_{i}",
+                    "direction": "inbound",
+                    "message_type": "text",
+                    "text_content": "Olá, gostaria de saber o status do meu pedido",
+                    "status": "delivered",
+                    "contact_name": "Cliente Teste",
+                    "contact_number": "5511999999999",
+                    "created_at": ts,
+                    "sent_at": ts,
+                },
+                "version": "v1",
+                "seq": i,
+            })
+        else:
+            events.append({
+                "event": "new_message",
+                "play_sound": False,
+                "data": {
+                    "chat_id": "5511999999999",
+                    "atendimento_id": 42,
+                    "message_id": f"msg_in_{i}",
+                    "texto": "Olá, gostaria de saber o status do meu pedido",
+                    "tipo": "text",
+                    "de": "Cliente Teste",
+                    "criado_em": ts,
+                },
+                "seq": i,
+            })
+    return events
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara tamanho por evento e CPU de codificação dos formatos WebSocket "
+        "(json, compact, msgpack), com e sem permessage-deflate"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=20000, help="Eventos por formato")
+
+    def handle(self, *args, **options):
+        events = _sample_events(options["events"])
+        baseline = None
+
+        self.stdout.write(f"{'formato':<10}{'bytes/evento':>14}{'deflate':>10}{'µs/evento':>12}{'vs json':>10}")
+        for name, encoder in ENCODERS.items():
+            started = time.perf_counter()
+            frames = [encoder.encode(event) for event in events]
+            elapsed = time.perf_counter() - started
+
+            frames = [f.encode() if isinstance(f, str) else f for f in frames]
+            raw = sum(len(f) for f in frames) / len(frames)
+
+            # permessage-deflate com context takeover (padrão dos navegadores)
+            compressor = zlib.compressobj(wbits=-15)
+            deflated = sum(
+                len(compressor.compress(f) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4 for f in frames
+            ) / len(frames)
+
+            if baseline is None:
+                baseline = raw
+            self.stdout.write(
+                f"{name:<10}{raw:>14.1f}{deflated:>10.1f}"
+                f"{elapsed / len(events) * 1e6:>12.2f}{raw / baseline:>9.0%}"
+            )
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-19 01:26
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Índice criado sem bloquear escritas na tabela de mensagens
+    atomic = False
+
+    dependencies = [
+        ('atendimento', '0002_add_transferencia_model'),
+        ('whatsapp', '0003_add_reconnect_proxy_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whatsappmessage',
+            name='atendimento',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mensagens', to='atendimento.atendimento', verbose_name='Atendimento'),
+        ),
+        AddIndexConcurrently(
+            model_name='whatsappmessage',
+            index=models.Index(fields=['atendimento', 'created_at'], name='whatsapp_wh_atendim_5e7891_idx'),
+        ),
+    ]
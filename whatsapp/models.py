@@ -280,6 +280,18 @@ class WhatsAppMessage(models.Model):
         help_text=_("Usuário responsável pela mensagem")
     )
     
+    # Atendimento ao qual a mensagem pertence (definido na ingestão/envio).
+    # Indexado junto com created_at em Meta.indexes.
+    atendimento = models.ForeignKey(
+        'atendimento.Atendimento',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='mensagens',
+        verbose_name=_("Atendimento"),
+        db_index=False
+    )
+    
     # Identificadores
     message_id = models.CharField(
         max_length=255,
@@ -440,12 +452,26 @@ class WhatsAppMessage(models.Model):
             models.Index(fields=['chat_id', 'created_at']),
             models.Index(fields=['direction', 'status']),
             models.Index(fields=['usuario', 'created_at']),
+            models.Index(fields=['atendimento', 'created_at']),
         ]
     
     def __str__(self) -> str:
         direction_str = "Recebida de" if self.direction == 'inbound' else "Enviada para"
         return f"{direction_str} {self.contact_number} - {self.message_type} ({self.get_status_display()})"
     
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # Alimenta o delta-sync da API de chats (GET /chats/changes/) e o
+        # cache de mensagens recentes (mudanças de status). Mensagens novas
+        # entram no log quando o ChatService as contabiliza.
+        from chats.changes import CAMPOS_MENSAGEM, altera_campos, record_chat_change
+        from chats.message_cache import get_recent_messages_cache
+        if adding or not self.atendimento_id or not altera_campos(kwargs.get('update_fields'), CAMPOS_MENSAGEM):
+            return
+        record_chat_change(atendimento_id=self.atendimento_id, mensagem_id=self.pk)
+        get_recent_messages_cache().update_message(self)
+    
     @property
     def latency_to_sent_ms(self) -> int | None:
         """Latência desde criação até envio (em milissegundos)"""
@@ -0,0 +1,145 @@
+"""
+Fila de saída limitada por conexão WebSocket, com coalescência de eventos.
+
+Os handlers do consumer apenas enfileiram; uma task por socket drena a fila
+para o cliente. Eventos que só importam pelo estado mais recente (status de
+uma mensagem, status da sessão) substituem o pendente de mesma chave em vez
+de ocupar outra posição. Se a fila enche, o evento pendente mais antigo é
+descartado e o cliente é avisado com {"type": "events_dropped"} para
+recuperar a lacuna via ?since=<seq>.
+
+A fila só enche se a task de envio esperar: config.ws_server publica no
+escopo (WRITE_BUFFER_EXTENSION) se o transporte pausou a escrita (buffer do
+socket cheio), e o consumer não envia enquanto ele estiver pausado.
+"""
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, Hashable, Optional
+
+from core.metrics import Counter, Gauge
+
+# Extensão de escopo ASGI que informa se o buffer de escrita do socket está cheio
+WRITE_BUFFER_EXTENSION = 'x-write-buffer'
+
+ws_events_coalesced = Counter(
+    'ws_outbound_events_coalesced_total',
+    'Eventos WebSocket substituídos por uma versão mais recente antes do envio'
+)
+ws_events_dropped = Counter(
+    'ws_outbound_events_dropped_total',
+    'Eventos WebSocket descartados por fila de saída cheia'
+)
+ws_queue_depth = Gauge(
+    'ws_outbound_queue_depth',
+    'Eventos aguardando envio somando todas as conexões do processo'
+)
+
+
+def coalesce_key(payload: Dict) -> Optional[Hashable]:
+    """
+    Chave de coalescência de um evento, ou None se todo evento deve ser entregue.
+
+    - message_status / chat_message_status: último status por message_id
+    - session_status: último status da sessão
+    - typing_start / typing_stop: último estado de digitação por (chat, atendente)
+    - queue_position: última posição por chat
+    - dashboard_snapshot: último snapshot por departamento
+    """
+    event_type = payload.get('type') or payload.get('event')
+
+    if event_type == 'session_status':
+        return ('session_status',)
+    if event_type == 'message_status':
+        message_id = payload.get('message_id')
+        return ('message_status', message_id) if message_id else None
+    if event_type in ('typing_start', 'typing_stop'):
+        data = payload.get('data') or {}
+        return ('typing', data.get('chat_id'), data.get('agent_id'))
+    if event_type == 'chat_message_status':
+        data = payload.get('data') or {}
+        message_id = data.get('message_id')
+        return ('chat_message_status', data.get('chat_id'), message_id) if message_id else None
+    if event_type == 'queue_position':
+        data = payload.get('data') or {}
+        return ('queue_position', data.get('chat_id'))
+    if event_type == 'dashboard_snapshot':
+        data = payload.get('data') or {}
+        return ('dashboard_snapshot', data.get('departamento_id'))
+    return None
+
+
+def write_paused(scope: Dict) -> bool:
+    """True se o transporte pausou a escrita da conexão (False se o servidor não informa)"""
+    extension = (scope.get('extensions') or {}).get(WRITE_BUFFER_EXTENSION) or {}
+    paused = extension.get('paused')
+    return bool(paused()) if paused else False
+
+
+def _event_label(payload: Dict) -> str:
+    return str(payload.get('type') or payload.get('event') or 'unknown')
+
+
+class OutboundQueue:
+    """
+    Fila FIFO limitada a maxsize eventos pendentes.
+
+    Um evento coalescível mantém a posição do primeiro pendente de mesma chave
+    e só o payload é atualizado, então a ordem relativa entre mensagens
+    diferentes é preservada.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._order = deque()
+        self._pending = {}
+        self._unique = itertools.count()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def put(self, payload: Dict) -> None:
+        key = coalesce_key(payload)
+
+        if key is not None and key in self._pending:
+            ws_events_coalesced.inc(event=_event_label(self._pending[key]))
+            self._pending[key] = payload
+            return
+
+        if key is None:
+            key = ('unique', next(self._unique))
+
+        if len(self._order) >= self.maxsize:
+            oldest = self._order.popleft()
+            dropped_payload = self._pending.pop(oldest)
+            self.dropped += 1
+            ws_events_dropped.inc(event=_event_label(dropped_payload))
+            ws_queue_depth.dec()
+
+        self._order.append(key)
+        self._pending[key] = payload
+        ws_queue_depth.inc()
+        self._ready.set()
+
+    def pop(self) -> Dict:
+        key = self._order.popleft()
+        ws_queue_depth.dec()
+        return self._pending.pop(key)
+
+    def take_dropped(self) -> int:
+        """Retorna e zera o número de descartes ainda não avisados ao cliente"""
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    async def wait(self) -> None:
+        """Aguarda até haver eventos pendentes"""
+        while not self._order:
+            self._ready.clear()
+            await self._ready.wait()
+
+    def clear(self) -> None:
+        ws_queue_depth.dec(len(self._order))
+        self._order.clear()
+        self._pending.clear()
@@ -13,6 +13,7 @@ from typing import Dict, Optional
 from django.utils import timezone
 from django.db import transaction
 
+from chats.events import aemit_chat_message, aemit_chat_message_status
 from integrations.whatsapp_stub import get_whatsapp_service, StubWhatsAppSessionService
 from .models import WhatsAppSession, WhatsAppMessage
 
@@ -174,9 +175,10 @@ class WhatsAppSessionService:
         if not client_message_id:
             client_message_id = str(uuid.uuid4())
         
-        # Cria registro da mensagem no banco (status: queued)
+        # Cria registro da mensagem no banco (status: queued), já no atendimento ativo do chat
         message = await self._acreate_message(
             session=session,
+            atendimento_id=await self._aget_atendimento_ativo_id(to),
             message_id=client_message_id,
             direction='outbound',
             message_type=payload.get('type', 'text'),
@@ -190,6 +192,10 @@ class WhatsAppSessionService:
             usuario_id=user_id
         )
         
+        # Publica no tópico do chat (sockets com a conversa aberta)
+        await aemit_chat_message(message)
+        await self._avincular_atendimento(message)
+        
         try:
             # Envia via stub service
             result = await self.stub_service.send_message(
@@ -249,9 +255,10 @@ class WhatsAppSessionService:
         
         message_id = payload.get('message_id', str(uuid.uuid4()))
         
-        # Cria registro da mensagem no banco
+        # Cria registro da mensagem no banco, já no atendimento ativo do chat (se houver)
         message = await self._acreate_message(
             session=session,
+            atendimento_id=await self._aget_atendimento_ativo_id(chat_id),
             message_id=message_id,
             direction='inbound',
             message_type=payload.get('type', 'text'),
@@ -267,17 +274,17 @@ class WhatsAppSessionService:
             protocol_version=protocol_version,
             is_from_me=False,
             usuario_id=user_id,
-            status='delivered'  # Mensagem recebida já está "delivered"
+            status='delivered',  # Mensagem recebida já está "delivered"
+            delivered_at=timezone.now()
         )
         
-        # Marca como entregue
-        message.delivered_at = timezone.now()
-        await self._asave_message(message, update_fields=['delivered_at'])
-        
         # Atualiza contadores da sessão (async-safe)
         from asgiref.sync import sync_to_async
         await sync_to_async(session.increment_received_messages)()
         
+        # Publica no tópico do chat (sockets com a conversa aberta)
+        await aemit_chat_message(message)
+        
         # Calcula latência
         latency_ms = message.total_latency_ms
         latency_ok = message.is_latency_acceptable
@@ -332,6 +339,9 @@ class WhatsAppSessionService:
                 message.status = status
                 await self._asave_message(message, update_fields=['status'])
             
+            # Publica mudança de status no tópico do chat
+            await aemit_chat_message_status(message)
+            
             latency_ms = message.total_latency_ms
             logger.info(
                 f"Status da mensagem {message_id} atualizado para {status} "
@@ -373,6 +383,27 @@ class WhatsAppSessionService:
         from asgiref.sync import sync_to_async
         return await sync_to_async(WhatsAppMessage.objects.create)(**kwargs)
     
+    async def _aget_atendimento_ativo_id(self, chat_id: str) -> Optional[int]:
+        """ID do atendimento ativo do chat (cache por chat_id), ou None"""
+        from asgiref.sync import sync_to_async
+        from chats.active_conversations import get_conversa_ativa_service
+        try:
+            conversa = await sync_to_async(get_conversa_ativa_service().obter)(chat_id)
+            return conversa.id if conversa else None
+        except Exception as e:
+            # A mensagem é vinculada depois, pelo ChatService
+            logger.warning(f"Falha ao obter atendimento ativo do chat {chat_id}: {e}")
+            return None
+    
+    async def _avincular_atendimento(self, message: WhatsAppMessage):
+        """Vincula a mensagem enviada ao atendimento ativo e atualiza o resumo do chat"""
+        from asgiref.sync import sync_to_async
+        from chats.service import get_chat_service
+        try:
+            await sync_to_async(get_chat_service().registrar_mensagem_enviada)(message)
+        except Exception as e:
+            logger.warning(f"Falha ao vincular mensagem ao atendimento do chat {message.chat_id}: {e}")
+    
     async def _asave_message(self, message: WhatsAppMessage, update_fields=None):
         """Salva mensagem (async)"""
         from asgiref.sync import sync_to_async
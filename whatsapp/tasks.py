@@ -11,6 +11,8 @@ from django.db import models
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
+from core.event_stream import publish_user_event
+
 logger = logging.getLogger(__name__)
 
 
@@ -170,10 +172,7 @@ def _emit_message_sent_event(
     }
     
     try:
-        async_to_sync(channel_layer.group_send)(
-            f"user_{user_id}_whatsapp",
-            {"type": "whatsapp.event", "event": event_payload}
-        )
+        publish_user_event(user_id, event_payload)
         
         logger.debug(f"Evento message_sent emitido: {message_id} (status: {status})")
     
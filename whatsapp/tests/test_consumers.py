@@ -0,0 +1,402 @@
+"""
+Testes para o WhatsAppConsumer (inscrição em conversas via WebSocket).
+"""
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from atendimento.models import Atendimento, Departamento
+from clientes.models import Cliente
+from core.ws import authenticate_ws_token, jwt_auth_middleware
+from core.event_stream import UserEventStream, get_user_event_stream, publish_user_event
+from whatsapp.consumers import WhatsAppConsumer
+from whatsapp.models import WhatsAppSession
+from whatsapp.service import WhatsAppSessionService
+
+User = get_user_model()
+
+
+class ChatSubscriptionTests(TestCase):
+    """Testes do protocolo subscribe/unsubscribe por chat_id"""
+
+    def setUp(self):
+        cache.clear()
+        self.atendente = User.objects.create_user(username='atendente', password='pass123')
+        self.outro = User.objects.create_user(username='outro', password='pass123')
+
+        self.departamento = Departamento.objects.create(nome='Suporte', ativo=True)
+        self.cliente = Cliente.objects.create(
+            razao_social='Cliente Teste',
+            cnpj='12.345.678/0001-90',
+            status='ativo'
+        )
+        self.session = WhatsAppSession.objects.create(
+            usuario=self.atendente,
+            status='ready',
+            is_active=True
+        )
+        self.atendimento = Atendimento.objects.create(
+            departamento=self.departamento,
+            cliente=self.cliente,
+            atendente=self.atendente,
+            chat_id='5511999999999',
+            numero_whatsapp='5511999999999',
+            status='em_atendimento'
+        )
+        self.service = WhatsAppSessionService()
+
+    def _communicator(self, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        return WebsocketCommunicator(
+            jwt_auth_middleware(WhatsAppConsumer.as_asgi()), f"/ws/whatsapp/?token={token}"
+        )
+
+    def test_subscribe_recebe_mensagens_do_chat(self):
+        """Socket inscrito recebe mensagens persistidas e mudanças de status"""
+        async def scenario():
+            communicator = self._communicator(self.atendente)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({"type": "subscribe", "chat_id": "5511999999999"})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response, {"type": "subscribed", "chat_id": "5511999999999"})
+
+            message = await self.service.handle_incoming_message(
+                user_id=self.atendente.id,
+                from_number='5511999999999',
+                chat_id='5511999999999',
+                payload={'type': 'text', 'text': 'Olá', 'message_id': 'msg_ws_1'}
+            )
+            event = await communicator.receive_json_from()
+            self.assertEqual(event['event'], 'chat_message')
+            self.assertEqual(event['data']['message_id'], 'msg_ws_1')
+            self.assertEqual(event['data']['text_content'], 'Olá')
+
+            await self.service.update_message_status(message.message_id, 'read')
+            event = await communicator.receive_json_from()
+            self.assertEqual(event['event'], 'chat_message_status')
+            self.assertEqual(event['data']['status'], 'read')
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_unsubscribe_para_de_receber(self):
+        """Após unsubscribe, o socket não recebe mais eventos do chat"""
+        async def scenario():
+            communicator = self._communicator(self.atendente)
+            await communicator.connect()
+
+            await communicator.send_json_to({"type": "subscribe", "chat_id": "5511999999999"})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({"type": "unsubscribe", "chat_id": "5511999999999"})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'unsubscribed')
+
+            await self.service.handle_incoming_message(
+                user_id=self.atendente.id,
+                from_number='5511999999999',
+                chat_id='5511999999999',
+                payload={'type': 'text', 'text': 'Olá', 'message_id': 'msg_ws_2'}
+            )
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_subscribe_sem_permissao(self):
+        """Atendente não pode acompanhar chat em atendimento por outro"""
+        async def scenario():
+            communicator = self._communicator(self.outro)
+            await communicator.connect()
+
+            await communicator.send_json_to({"type": "subscribe", "chat_id": "5511999999999"})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'subscribe_error')
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_typing_chega_aos_outros_inscritos(self):
+        """typing_start via WebSocket vai para os outros sockets do chat, não para quem digita"""
+        supervisor = User.objects.create_superuser(username='supervisor', password='pass123')
+
+        async def scenario():
+            digitando = self._communicator(self.atendente)
+            observando = self._communicator(supervisor)
+            await digitando.connect()
+            await observando.connect()
+            for communicator in (digitando, observando):
+                await communicator.send_json_to({"type": "subscribe", "chat_id": "5511999999999"})
+                await communicator.receive_json_from()
+
+            for _ in range(5):
+                await digitando.send_json_to({"type": "typing_start", "chat_id": "5511999999999"})
+
+            event = await observando.receive_json_from()
+            self.assertEqual(event['event'], 'typing_start')
+            self.assertEqual(event['data']['agent_id'], self.atendente.id)
+            self.assertTrue(await observando.receive_nothing(timeout=0.2))
+            self.assertTrue(await digitando.receive_nothing(timeout=0.1))
+
+            await digitando.send_json_to({"type": "typing_stop", "chat_id": "5511999999999"})
+            event = await observando.receive_json_from()
+            self.assertEqual(event['event'], 'typing_stop')
+
+            await digitando.disconnect()
+            await observando.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_typing_exige_inscricao(self):
+        async def scenario():
+            communicator = self._communicator(self.atendente)
+            await communicator.connect()
+
+            await communicator.send_json_to({"type": "typing_start", "chat_id": "5511999999999"})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'typing_error')
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_sockets_de_outros_chats_nao_recebem(self):
+        """Eventos vão apenas para os sockets inscritos naquele chat"""
+        async def scenario():
+            communicator = self._communicator(self.atendente)
+            await communicator.connect()
+
+            await communicator.send_json_to({"type": "subscribe", "chat_id": "5511999999999"})
+            await communicator.receive_json_from()
+
+            await self.service.handle_incoming_message(
+                user_id=self.atendente.id,
+                from_number='5511888888888',
+                chat_id='5511888888888',
+                payload={'type': 'text', 'text': 'Outro chat', 'message_id': 'msg_ws_3'}
+            )
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class UserEventStreamTests(TestCase):
+    """Testes do buffer de replay por usuário"""
+
+    def setUp(self):
+        cache.clear()
+        self.stream = UserEventStream(buffer_size=5, ttl=60)
+
+    def test_record_numera_sequencialmente(self):
+        first = self.stream.record(1, {"event": "a"})
+        second = self.stream.record(1, {"event": "b"})
+        other_user = self.stream.record(2, {"event": "c"})
+
+        self.assertEqual(first["seq"], 1)
+        self.assertEqual(second["seq"], 2)
+        self.assertEqual(other_user["seq"], 1)
+        self.assertEqual(self.stream.current_seq(1), 2)
+
+    def test_replay_retorna_eventos_perdidos(self):
+        for i in range(4):
+            self.stream.record(1, {"event": f"e{i}"})
+
+        events, resync = self.stream.replay(1, since=2)
+        self.assertFalse(resync)
+        self.assertEqual([e["seq"] for e in events], [3, 4])
+        self.assertEqual(events[0]["event"], "e2")
+
+        events, resync = self.stream.replay(1, since=4)
+        self.assertEqual((events, resync), ([], False))
+
+    def test_replay_lacuna_fora_do_buffer_pede_resync(self):
+        for i in range(8):
+            self.stream.record(1, {"event": f"e{i}"})
+
+        events, resync = self.stream.replay(1, since=1)
+        self.assertTrue(resync)
+        self.assertEqual(events, [])
+
+        # Dentro da janela ainda funciona
+        events, resync = self.stream.replay(1, since=4)
+        self.assertFalse(resync)
+        self.assertEqual([e["seq"] for e in events], [5, 6, 7, 8])
+
+    def test_replay_since_maior_que_atual_pede_resync(self):
+        self.stream.record(1, {"event": "a"})
+        events, resync = self.stream.replay(1, since=10)
+        self.assertTrue(resync)
+
+
+class ReconnectReplayTests(TestCase):
+    """Testes de reconexão com ?since=<seq>"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='atendente', password='pass123')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def _communicator(self, since=None):
+        path = f"/ws/whatsapp/?token={self.token}"
+        if since is not None:
+            path += f"&since={since}"
+        return WebsocketCommunicator(jwt_auth_middleware(WhatsAppConsumer.as_asgi()), path)
+
+    def test_eventos_ao_vivo_carregam_seq(self):
+        async def scenario():
+            communicator = self._communicator()
+            await communicator.connect()
+
+            await sync_to_async(publish_user_event)(self.user.id, {"event": "x", "data": {}, "version": "v1"})
+            event = await communicator.receive_json_from()
+            self.assertEqual(event["event"], "x")
+            self.assertEqual(event["seq"], 1)
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_reconexao_recebe_apenas_eventos_perdidos(self):
+        for i in range(3):
+            publish_user_event(self.user.id, {"event": f"e{i}", "data": {}, "version": "v1"})
+
+        async def scenario():
+            communicator = self._communicator(since=1)
+            await communicator.connect()
+
+            first = await communicator.receive_json_from()
+            second = await communicator.receive_json_from()
+            self.assertEqual([first["seq"], second["seq"]], [2, 3])
+            self.assertEqual(second["event"], "e2")
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_reconexao_com_lacuna_expirada_pede_resync(self):
+        stream = get_user_event_stream()
+        for i in range(stream.buffer_size + 2):
+            stream.record(self.user.id, {"event": f"e{i}"})
+
+        async def scenario():
+            communicator = self._communicator(since=0)
+            await communicator.connect()
+
+            response = await communicator.receive_json_from()
+            self.assertEqual(response, {"type": "resync_required", "seq": stream.buffer_size + 2})
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class WebSocketAuthCacheTests(TestCase):
+    """Testes da autenticação WebSocket com cache por (user_id, token_version)"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='atendente', password='pass123')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_reconexao_nao_consulta_banco(self):
+        """Após a primeira conexão, o usuário vem do cache"""
+        user = async_to_sync(authenticate_ws_token)(self.token)
+        self.assertEqual(user.id, self.user.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(20):
+                user = async_to_sync(authenticate_ws_token)(self.token)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(user.id, self.user.id)
+
+    def test_desativacao_invalida_cache(self):
+        async_to_sync(authenticate_ws_token)(self.token)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(async_to_sync(authenticate_ws_token)(self.token))
+
+    def test_revoke_tokens_rejeita_token_antigo(self):
+        async_to_sync(authenticate_ws_token)(self.token)
+
+        self.user.revoke_tokens()
+
+        self.assertIsNone(async_to_sync(authenticate_ws_token)(self.token))
+
+        refresh = RefreshToken.for_user(self.user)
+        refresh["token_version"] = self.user.token_version
+        user = async_to_sync(authenticate_ws_token)(str(refresh.access_token))
+        self.assertEqual(user.id, self.user.id)
+
+    def test_token_obtido_no_login_inclui_versao(self):
+        response = self.client.post(
+            '/api/v1/auth/token/',
+            {'username': 'atendente', 'password': 'pass123'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        user = async_to_sync(authenticate_ws_token)(response.json()['access'])
+        self.assertEqual(user.id, self.user.id)
+
+    def test_conexao_sem_token_nao_entra_no_grupo(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                jwt_auth_middleware(WhatsAppConsumer.as_asgi()), "/ws/whatsapp/"
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await sync_to_async(publish_user_event)(self.user.id, {"event": "x", "data": {}, "version": "v1"})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class PresenceWebSocketTests(TestCase):
+    """Presença atualizada pelo ciclo de vida do socket e por frames de heartbeat"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='atendente', password='pass123')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_conexao_e_heartbeat_atualizam_presenca(self):
+        from accounts.presence_state import PresenceStateService
+
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                jwt_auth_middleware(WhatsAppConsumer.as_asgi()), f"/ws/whatsapp/?token={self.token}"
+            )
+            await communicator.connect()
+
+            presence = await sync_to_async(PresenceStateService.get)(self.user.id)
+            self.assertEqual(presence['status'], 'online')
+            self.assertTrue(presence['websocket_connected'])
+
+            await sync_to_async(cache.delete)(f"presence:hb:{self.user.id}")
+            await communicator.send_json_to({"type": "heartbeat"})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+            presence = await sync_to_async(PresenceStateService.get)(self.user.id)
+            self.assertFalse(presence['esta_inativo'])
+
+            await communicator.disconnect()
+
+            presence = await sync_to_async(PresenceStateService.get)(self.user.id)
+            self.assertFalse(presence['websocket_connected'])
+
+        async_to_sync(scenario)()
@@ -0,0 +1,232 @@
+"""
+Testes da negociação de formato dos eventos WebSocket e do permessage-deflate.
+"""
+import asyncio
+import json
+import zlib
+
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.event_stream import publish_user_event
+from core.ws import jwt_auth_middleware
+from whatsapp.consumers import WhatsAppConsumer
+from whatsapp.encoding import ENCODERS, compact_payload, negotiate_encoding
+
+User = get_user_model()
+
+EVENT = {
+    "event": "chat_message_status",
+    "data": {
+        "chat_id": "5511999999999",
+        "message_id": "msg_1",
+        "status": "read",
+        "read_at": "2026-10-19T12:00:00.500000+00:00",
+        "texto": "Olá",
+    },
+    "version": "v1",
+    "seq": 7,
+}
+
+
+class CompactEncodingTests(SimpleTestCase):
+    """Testes do formato compacto"""
+
+    def test_chaves_curtas_e_epoch_ms(self):
+        compact = compact_payload(EVENT)
+        self.assertEqual(compact["e"], "chat_message_status")
+        self.assertEqual(compact["s"], 7)
+        self.assertEqual(compact["d"]["c"], "5511999999999")
+        self.assertEqual(compact["d"]["m"], "msg_1")
+        self.assertEqual(compact["d"]["read_at"], 1792411200500)
+        self.assertEqual(compact["d"]["texto"], "Olá")
+
+    def test_datas_sem_fuso_e_textos_comuns_nao_mudam(self):
+        self.assertEqual(compact_payload({"x": "2026-10-19T12:00:00"}), {"x": "2026-10-19T12:00:00"})
+        self.assertEqual(compact_payload({"x": "2026-10-19"}), {"x": "2026-10-19"})
+
+    def test_conteudo_do_usuario_nao_muda(self):
+        event = {
+            "event": "new_message",
+            "data": {
+                "chat_id": "5511999999999",
+                "texto": "2026-10-19T12:00:00+00:00",
+                "metadata": {"status": "x", "read_at": "2026-10-19T12:00:00+00:00"},
+                "itens": [{"chat_id": "a"}],
+            },
+        }
+        compact = compact_payload(event)
+        self.assertEqual(compact["d"]["c"], "5511999999999")
+        self.assertEqual(compact["d"]["texto"], "2026-10-19T12:00:00+00:00")
+        self.assertEqual(compact["d"]["metadata"], event["data"]["metadata"])
+        self.assertEqual(compact["d"]["itens"], [{"chat_id": "a"}])
+
+    def test_formatos_compactos_sao_menores(self):
+        full = len(ENCODERS["json"].encode(EVENT).encode())
+        compact = len(ENCODERS["compact"].encode(EVENT).encode())
+        packed = len(ENCODERS["msgpack"].encode(EVENT))
+        self.assertLess(compact, full)
+        self.assertLess(packed, compact)
+
+    def test_msgpack_roundtrip(self):
+        encoder = ENCODERS["msgpack"]
+        self.assertEqual(encoder.decode(encoder.encode(EVENT)), compact_payload(EVENT))
+
+    def test_negociacao(self):
+        encoder, subprotocol = negotiate_encoding({"subprotocols": ["outro", "dx.v1.msgpack"]})
+        self.assertEqual((encoder.name, subprotocol), ("msgpack", "dx.v1.msgpack"))
+
+        encoder, subprotocol = negotiate_encoding({"subprotocols": []}, "compact")
+        self.assertEqual((encoder.name, subprotocol), ("compact", None))
+
+        encoder, subprotocol = negotiate_encoding({"subprotocols": ["dx.v1.xml"]}, "desconhecido")
+        self.assertEqual((encoder.name, subprotocol), ("json", None))
+
+
+class PerMessageDeflateTests(SimpleTestCase):
+    """Testes da habilitação de permessage-deflate no Daphne"""
+
+    def test_aceita_oferta_deflate(self):
+        from config.ws_server import accept_permessage_deflate
+
+        accept = accept_permessage_deflate([PerMessageDeflateOffer()])
+        self.assertIsInstance(accept, PerMessageDeflateOfferAccept)
+        self.assertIsNone(accept_permessage_deflate([]))
+
+    def test_server_configura_fabrica(self):
+        from daphne.ws_protocol import WebSocketFactory
+        from config.ws_server import CompressingServer, accept_permessage_deflate
+
+        server = CompressingServer(application=None, endpoints=["tcp:port=0"])
+        server.ws_factory = WebSocketFactory(server, server="daphne")
+        self.assertIs(server.ws_factory.perMessageCompressionAccept, accept_permessage_deflate)
+
+    def test_handshake_negocia_deflate_e_comprime_frames(self):
+        """Handshake real contra a fábrica do CompressingServer: extensão aceita e frame com RSV1"""
+        from daphne.ws_protocol import WebSocketFactory
+        from twisted.internet.testing import StringTransport
+        from config.ws_server import CompressingServer
+        from whatsapp.outbound import WRITE_BUFFER_EXTENSION, write_paused
+
+        texto = json.dumps(EVENT) * 20
+        scopes = []
+
+        async def application(scope, receive, send):
+            scopes.append(scope)
+            await receive()
+            await send({"type": "websocket.accept"})
+            await send({"type": "websocket.send", "text": texto})
+            await asyncio.Event().wait()
+
+        server = CompressingServer(application=application, endpoints=["tcp:port=0"])
+        server.connections = {}
+        server.ws_factory = WebSocketFactory(server, server="daphne")
+        server.ws_factory.setProtocolOptions(allowNullOrigin=True)
+        protocol = server.ws_factory.buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        protocol._raw_query_string = b""
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            protocol.dataReceived(
+                b"GET /ws/whatsapp/ HTTP/1.1\r\n"
+                b"Host: localhost\r\n"
+                b"Upgrade: websocket\r\n"
+                b"Connection: Upgrade\r\n"
+                b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+                b"Sec-WebSocket-Version: 13\r\n"
+                b"Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n"
+            )
+            loop.run_until_complete(asyncio.sleep(0.1))
+            server.connections[protocol]["application_instance"].cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        head, _, frame = transport.value().partition(b"\r\n\r\n")
+        self.assertIn(b"101 Switching Protocols", head)
+        self.assertIn(b"Sec-WebSocket-Extensions: permessage-deflate", head)
+
+        # FIN + RSV1 (comprimido) + texto; servidor não mascara
+        self.assertEqual(frame[0], 0xC1)
+        length = frame[1] & 0x7F
+        payload = frame[2:2 + length] if length < 126 else frame[4:4 + int.from_bytes(frame[2:4], "big")]
+        self.assertLess(len(payload), len(texto))
+        decoded = zlib.decompressobj(wbits=-15).decompress(payload + b"\x00\x00\xff\xff")
+        self.assertEqual(decoded.decode(), texto)
+
+        # Contrapressão: o produtor registrado no transporte alimenta a extensão do escopo
+        self.assertIn(WRITE_BUFFER_EXTENSION, scopes[0]["extensions"])
+        self.assertFalse(write_paused(scopes[0]))
+        transport.producer.pauseProducing()
+        self.assertTrue(write_paused(scopes[0]))
+        transport.producer.resumeProducing()
+        self.assertFalse(write_paused(scopes[0]))
+
+    def test_rajada_de_eventos_comprime(self):
+        """Com contexto compartilhado (padrão do deflate), eventos repetitivos encolhem muito"""
+        compressor = zlib.compressobj(wbits=-15)
+        raw = 0
+        compressed = 0
+        for i in range(50):
+            frame = json.dumps({**EVENT, "seq": i}).encode()
+            raw += len(frame)
+            compressed += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.assertLess(compressed, raw / 4)
+
+
+class ConsumerEncodingTests(TestCase):
+    """Testes do WhatsAppConsumer com formatos negociados"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="atendente", password="pass123")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_subprotocolo_msgpack(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                jwt_auth_middleware(WhatsAppConsumer.as_asgi()),
+                f"/ws/whatsapp/?token={self.token}",
+                subprotocols=["dx.v1.msgpack"],
+            )
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, "dx.v1.msgpack")
+
+            await sync_to_async(publish_user_event)(self.user.id, {"event": "x", "data": {}, "version": "v1"})
+            frame = await communicator.receive_from()
+            self.assertIsInstance(frame, bytes)
+            self.assertEqual(msgpack.unpackb(frame), {"e": "x", "d": {}, "v": "v1", "s": 1})
+
+            # Cliente também pode enviar em MessagePack
+            await communicator.send_to(bytes_data=msgpack.packb({"type": "ping"}))
+            self.assertEqual(msgpack.unpackb(await communicator.receive_from()), {"t": "pong"})
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_query_param_compact(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                jwt_auth_middleware(WhatsAppConsumer.as_asgi()),
+                f"/ws/whatsapp/?token={self.token}&encoding=compact",
+            )
+            await communicator.connect()
+
+            await communicator.send_json_to({"type": "ping"})
+            self.assertEqual(await communicator.receive_json_from(), {"t": "pong"})
+
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
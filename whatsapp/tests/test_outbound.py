@@ -0,0 +1,175 @@
+"""
+Testes da fila de saída por conexão WebSocket (coalescência e limite).
+"""
+import asyncio
+from unittest.mock import AsyncMock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from whatsapp.consumers import WS_CLOSE_TRY_AGAIN_LATER, WhatsAppConsumer
+from whatsapp.outbound import (
+    WRITE_BUFFER_EXTENSION,
+    OutboundQueue,
+    coalesce_key,
+    ws_events_coalesced,
+    ws_events_dropped,
+)
+
+
+def status_event(message_id, status):
+    return {"type": "message_status", "message_id": message_id, "status": status}
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Testes da OutboundQueue"""
+
+    def drain(self, queue):
+        return [queue.pop() for _ in range(len(queue))]
+
+    def test_coalesce_key(self):
+        self.assertEqual(coalesce_key(status_event("m1", "sent")), ("message_status", "m1"))
+        self.assertEqual(coalesce_key({"type": "session_status", "status": "ready"}), ("session_status",))
+        self.assertEqual(
+            coalesce_key({"event": "chat_message_status", "data": {"chat_id": "c1", "message_id": "m1"}}),
+            ("chat_message_status", "c1", "m1")
+        )
+        self.assertEqual(
+            coalesce_key({"event": "dashboard_snapshot", "data": {"departamento_id": 3}}),
+            ("dashboard_snapshot", 3)
+        )
+        self.assertIsNone(coalesce_key({"event": "new_message", "data": {}}))
+
+    def test_mantem_apenas_ultimo_status_por_mensagem(self):
+        queue = OutboundQueue(maxsize=10)
+        before = ws_events_coalesced.value(event="message_status")
+
+        for status in ("queued", "sent", "delivered", "read"):
+            queue.put(status_event("m1", status))
+        queue.put(status_event("m2", "sent"))
+
+        self.assertEqual(self.drain(queue), [status_event("m1", "read"), status_event("m2", "sent")])
+        self.assertEqual(ws_events_coalesced.value(event="message_status") - before, 3)
+
+    def test_preserva_ordem_de_eventos_nao_coalescidos(self):
+        queue = OutboundQueue(maxsize=10)
+        queue.put({"event": "new_message", "data": {"id": 1}})
+        queue.put({"type": "session_status", "status": "qrcode"})
+        queue.put({"event": "new_message", "data": {"id": 2}})
+        queue.put({"type": "session_status", "status": "ready"})
+
+        events = self.drain(queue)
+        self.assertEqual(
+            events,
+            [
+                {"event": "new_message", "data": {"id": 1}},
+                {"type": "session_status", "status": "ready"},
+                {"event": "new_message", "data": {"id": 2}},
+            ]
+        )
+
+    def test_fila_cheia_descarta_mais_antigo(self):
+        queue = OutboundQueue(maxsize=3)
+        before = ws_events_dropped.value(event="new_message")
+
+        for i in range(5):
+            queue.put({"event": "new_message", "data": {"id": i}})
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual([e["data"]["id"] for e in self.drain(queue)], [2, 3, 4])
+        self.assertEqual(queue.take_dropped(), 2)
+        self.assertEqual(queue.take_dropped(), 0)
+        self.assertEqual(ws_events_dropped.value(event="new_message") - before, 2)
+
+    def test_memoria_limitada_sob_rajada(self):
+        queue = OutboundQueue(maxsize=50)
+        for i in range(10000):
+            queue.put(status_event(f"m{i % 20}", "sent"))
+            queue.put({"event": "new_message", "data": {"id": i}})
+        self.assertEqual(len(queue), 50)
+
+
+@override_settings(WS_SEND_TIMEOUT_SECONDS=1)
+class DrainOutboundTests(SimpleTestCase):
+    """Testes da task de envio do consumer (contrapressão e falhas)"""
+
+    def make_consumer(self, buffer):
+        consumer = WhatsAppConsumer()
+        consumer.scope = {"extensions": {WRITE_BUFFER_EXTENSION: {"paused": lambda: buffer["paused"]}}}
+        consumer.channel_name = "test"
+        consumer.outbound = OutboundQueue(maxsize=3)
+        consumer.send_json = AsyncMock()
+        consumer.close = AsyncMock()
+        return consumer
+
+    def sent(self, consumer):
+        return [call.args[0] for call in consumer.send_json.await_args_list]
+
+    def test_espera_buffer_de_escrita_baixar(self):
+        buffer = {"paused": True}
+        consumer = self.make_consumer(buffer)
+
+        async def run():
+            task = asyncio.ensure_future(consumer._drain_outbound())
+            for status in ("sent", "delivered", "read"):
+                consumer.outbound.put(status_event("m1", status))
+                await asyncio.sleep(0.06)
+            self.assertEqual(consumer.send_json.await_count, 0)
+            buffer["paused"] = False
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await task
+
+        async_to_sync(run)()
+        self.assertEqual(self.sent(consumer), [status_event("m1", "read")])
+        consumer.close.assert_not_awaited()
+
+    def test_cliente_que_nao_le_e_desconectado(self):
+        consumer = self.make_consumer({"paused": True})
+
+        async def run():
+            consumer.outbound.put({"event": "new_message", "data": {}})
+            await asyncio.wait_for(consumer._drain_outbound(), timeout=3)
+
+        async_to_sync(run)()
+        consumer.send_json.assert_not_awaited()
+        consumer.close.assert_awaited_once_with(code=WS_CLOSE_TRY_AGAIN_LATER)
+        self.assertEqual(len(consumer.outbound), 0)
+
+    def test_falha_em_um_evento_nao_interrompe_envio(self):
+        consumer = self.make_consumer({"paused": False})
+        consumer.send_json.side_effect = [TypeError("not serializable"), None]
+
+        async def run():
+            task = asyncio.ensure_future(consumer._drain_outbound())
+            consumer.outbound.put({"event": "new_message", "data": {"id": 1}})
+            consumer.outbound.put({"event": "new_message", "data": {"id": 2}})
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await task
+
+        async_to_sync(run)()
+        self.assertEqual([e["data"]["id"] for e in self.sent(consumer)], [1, 2])
+        consumer.close.assert_not_awaited()
+
+
+@override_settings(METRICS_TOKEN="segredo")
+class MetricsEndpointTests(SimpleTestCase):
+    """Testes do endpoint /metrics"""
+
+    def test_exige_token_do_scrape(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Metrics outro")
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_expoe_contadores_do_websocket(self):
+        queue = OutboundQueue(maxsize=1)
+        queue.put({"event": "new_message", "data": {}})
+        queue.put({"event": "new_message", "data": {}})
+
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Metrics segredo")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn("# TYPE ws_outbound_events_dropped_total counter", body)
+        self.assertIn('ws_outbound_events_dropped_total{event="new_message"}', body)
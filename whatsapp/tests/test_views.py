@@ -231,6 +231,59 @@ class WhatsAppMessageViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # Deve retornar pelo menos 1 mensagem com alta latência
         self.assertGreaterEqual(len(response.data), 1)
+    
+    def test_paginacao_por_cursor(self):
+        """Páginas before/after em (created_at, id), inclusive com empates de created_at"""
+        from django.utils import timezone
+        
+        mesmo_instante = timezone.now()
+        for i in range(6):
+            msg = WhatsAppMessage.objects.create(
+                session=self.session,
+                usuario=self.user,
+                message_id=f'msg_page_{i}',
+                direction='inbound',
+                message_type='text',
+                chat_id='5511999999999',
+                contact_number='5511999999999'
+            )
+            if i < 3:
+                WhatsAppMessage.objects.filter(pk=msg.pk).update(created_at=mesmo_instante)
+        
+        url = reverse('whatsapp-message-list')
+        response = self.client.get(url, {'limit': 3})
+        vistos = [m['id'] for m in response.data['results']]
+        primeiro_after = response.data['after']
+        while response.data['before']:
+            response = self.client.get(url, {'limit': 3, 'before': response.data['before']})
+            vistos += [m['id'] for m in response.data['results']]
+        
+        esperados = list(
+            WhatsAppMessage.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(vistos, esperados)
+        self.assertFalse(response.data['has_older'])
+        
+        # Polling: apenas o que chegou depois do cursor
+        nova = WhatsAppMessage.objects.create(
+            session=self.session,
+            usuario=self.user,
+            message_id='msg_nova',
+            direction='inbound',
+            message_type='text',
+            chat_id='5511999999999',
+            contact_number='5511999999999'
+        )
+        response = self.client.get(url, {'after': primeiro_after})
+        self.assertEqual([m['id'] for m in response.data['results']], [nova.id])
+        
+        response = self.client.get(url, {'after': response.data['after']})
+        self.assertEqual(response.data['results'], [])
+    
+    def test_cursor_invalido(self):
+        """Cursor malformado retorna 400"""
+        response = self.client.get(reverse('whatsapp-message-list'), {'before': 'xyz'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class WhatsAppSendMessageViewTests(APITestCase):
@@ -22,6 +22,8 @@ from .serializers import (
     WhatsAppSessionStatusSerializer
 )
 from .service import get_whatsapp_session_service
+from core.event_stream import publish_user_event
+from core.pagination import KeysetPagination
 
 
 class WhatsAppSessionViewSet(viewsets.ModelViewSet):
@@ -283,17 +285,18 @@ class WhatsAppMessageViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet para consulta de mensagens WhatsApp (somente leitura).
     
-    Permite listar e visualizar mensagens enviadas e recebidas.
+    Permite listar e visualizar mensagens enviadas e recebidas. A listagem
+    é paginada por cursor (before/after, ver core.pagination).
     """
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # Keyset em (created_at, id): ordem fixa, mais recentes primeiro
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = [
         'direction', 'message_type', 'status', 'chat_id', 
         'is_from_me', 'session'
     ]
     search_fields = ['text_content', 'contact_number', 'contact_name']
-    ordering_fields = ['created_at', 'sent_at', 'delivered_at']
-    ordering = ['-created_at']
     
     def get_queryset(self):
         """Filtra mensagens do usuário autenticado ou todas se superuser"""
@@ -625,10 +628,7 @@ class WhatsAppWebhookView(APIView):
                     "version": protocol_version
                 }
                 
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{user_id}_whatsapp",
-                    {"type": "whatsapp.event", "event": event_payload}
-                )
+                publish_user_event(user_id, event_payload)
             
             # Processar nova conversa (Issue #85)
             from chats.service import get_chat_service